@@ -0,0 +1,344 @@
+import ast
+import sys
+import time
+import tracemalloc
+import random
+import string
+import tempfile
+import typing
+import os
+
+import binary
+import command
+import compare
+import convert
+import lazy_dfa
+import fa
+import packed
+import product
+import regex_parser
+
+
+def timed(name: str, func: typing.Callable[[], typing.Any]) -> typing.Any:
+    start = time.perf_counter()
+    res = func()
+    print(f'{name}: {time.perf_counter() - start:.3f} s')
+    return res
+
+
+def walk(a: fa.FA, path: str) -> bool:
+    '''
+        Pure-python acceptance check over fa.Node sets, a must have no eps.
+    '''
+    current_nodes = {a.start}
+    for c in path:
+        next_nodes: set[fa.Node] = set()
+        for node in current_nodes:
+            next_nodes |= node.next_nodes_by_label.get(c, set())
+        current_nodes = next_nodes
+    return any(a.is_final(node) for node in current_nodes)
+
+
+def compile_regex(regex: str, letters: str) -> fa.FA:
+    a = convert.ast_to_eps_nfa(convert.regex_to_ast(regex))
+    return convert.make_min(convert.make_full(convert.make_deterministic(convert.remove_eps(a)), letters))
+
+
+def bench_matcher() -> None:
+    import matcher
+
+    letters = 'qwer'
+    a = compile_regex('(q+w+e+r)**None * q * (q+w+e+r)**6', letters)
+    rand = random.Random(0)
+    strings = [
+        ''.join(rand.choice(letters) for i in range(rand.randint(0, 24)))
+        for j in range(200000)
+    ]
+
+    expected = timed('pure python walk', lambda: [walk(a, s) for s in strings])
+    compiled = timed('compile', lambda: matcher.compile_dfa(a))
+    res = timed('numpy batch match', lambda: compiled.match(strings))
+    assert res.tolist() == expected
+
+
+def bench_binary() -> None:
+    '''
+        Loading a dfa with 2**16 states from JSON and from the binary format to match strings.
+    '''
+    import matcher
+
+    letters = 'qwer'
+    p = packed.make_min(packed.make_full(packed.make_deterministic(packed.remove_eps(packed.thompson(
+        regex_parser.parse('(q+w+e+r)**None * q * (q+w+e+r)**15')))), letters))
+    text = command.fa_or_re(command.live_fa(packed.packed_to_fa(p), letters)).as_public_str()
+    data = binary.dumps(p, letters)
+    print(f'states: {p.state_count}, JSON: {len(text)} bytes, binary: {len(data)} bytes')
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fa.bin')
+        with open(path, 'wb') as file:
+            file.write(data)
+        from_json = timed('load JSON and compile', lambda: matcher.compile_packed_dfa(command.compile_value(command.fa_or_re.from_public_str(text))))
+        from_binary = timed('map binary and compile', lambda: matcher.compile_binary_dfa(binary.load(path)))
+        strings = [''.join(random.Random(i).choice(letters) for j in range(20)) for i in range(1000)]
+        assert from_json.match(strings).tolist() == from_binary.match(strings).tolist()
+
+
+def bench_json_output() -> None:
+    '''
+        Printing a dfa with 2**16 states and 2**18 transitions, by building sorted JSON and by streaming it.
+    '''
+    letters = 'qwer'
+    p = packed.make_min(packed.make_full(packed.make_deterministic(packed.remove_eps(packed.thompson(
+        regex_parser.parse('(q+w+e+r)**None * q * (q+w+e+r)**15')))), letters))
+    a = packed.packed_to_fa(p)
+    p = packed.fa_to_packed(a)
+
+    def built() -> None:
+        with open(os.devnull, 'w') as file:
+            file.write(command.frozen_fa.from_json(fa.fa_to_json(a, letters)).to_json_str())
+
+    def streamed(compact: bool) -> None:
+        with open(os.devnull, 'w') as file:
+            packed.write_json(p, letters, file, compact)
+
+    runs = [('built', built), ('streamed', lambda: streamed(False)), ('streamed compact', lambda: streamed(True))]
+    for name, func in runs:
+        timed(name, func)
+    for name, func in runs:
+        tracemalloc.start()
+        func()
+        print(f'{name}: peak {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB')
+        tracemalloc.stop()
+
+
+def bench_lazy_matcher() -> None:
+    '''
+        Deterministic automaton of the pattern has 2**21 states,
+        the strings are drawn from a pool and reach only a part of them.
+    '''
+    letters = 'qw'
+    regex = '(q+w)**None * q * (q+w)**20'
+    p = packed.remove_eps(packed.thompson(regex_parser.parse(regex)))
+    rand = random.Random(0)
+    pool = [''.join(rand.choice(letters) for i in range(rand.randint(0, 40))) for j in range(2000)]
+    strings = [rand.choice(pool) for j in range(20000)]
+
+    expected = timed('nfa simulation', lambda: [lazy_dfa.lazy_dfa(p, 0).match_nfa((0,), s) for s in strings])
+    for max_states in [1 << 10, 1 << 16]:
+        matcher = lazy_dfa.lazy_dfa(p, max_states)
+        res = timed(f'lazy dfa, {max_states} states', lambda: [matcher.match(s) for s in strings])
+        print(f'flushes: {matcher.flush_count}, nfa fallback: {matcher.uses_nfa}')
+        assert res == expected
+
+
+def bench_letter_classes() -> None:
+    '''
+        60 letters, only q is distinguished by the pattern.
+    '''
+    letters = string.ascii_letters[:60]
+    any_letter = '(' + '+'.join(letters) + ')'
+    p = packed.remove_eps(packed.thompson(regex_parser.parse(f'{any_letter}**None * q * {any_letter}**9')))
+
+    def chain(p: packed.PackedFA, letters: str) -> packed.PackedFA:
+        return packed.make_min(packed.make_full(packed.make_deterministic(p), letters))
+
+    plain = timed('all letters', lambda: chain(p, letters))
+
+    def compressed() -> packed.PackedFA:
+        classes = packed.letter_classes(p, letters)
+        first_letters = ''.join(letters_of_class[0] for letters_of_class in classes)
+        return packed.expand_letters(chain(packed.compress_letters(p, classes), first_letters), classes)
+
+    res = timed('letter classes', compressed)
+    assert packed.fingerprint(res) == packed.fingerprint(plain)
+    print(f'states: {res.state_count}')
+
+
+def bench_char_sets() -> None:
+    '''
+        26 letters written as one set and as an alternation, then the whole of unicode as one set.
+    '''
+    letters = string.ascii_lowercase
+    any_letter = '(' + '+'.join(letters) + ')'
+
+    def chain(regex: str, letters: str) -> packed.PackedFA:
+        p = packed.remove_eps(packed.thompson(regex_parser.parse(regex)))
+        return packed.make_min(packed.make_full(packed.make_deterministic(p), letters))
+
+    plain = timed('alternation', lambda: chain(f'{any_letter}**None * q * {any_letter}**9', letters))
+    sets = timed('set', lambda: chain('[a-z]**None * q * [a-z]**9', '[a-z]'))
+    print(f'states: {plain.state_count}, labels: {len(plain.labels) - 1} and {len(sets.labels) - 1}')
+    assert plain.state_count == sets.state_count
+
+    res = timed('unicode', lambda: chain('[\\x00-\\U0010ffff]**None * [\\u0400-\\u04ff] * [a-z]**9', '[\\x00-\\U0010ffff]'))
+    print(f'states: {res.state_count}, labels: {len(res.labels) - 1}')
+
+
+def bench_implicit_sink() -> None:
+    '''
+        Dictionary of random words over 50 letters: most transitions of its dfa go to the sink.
+    '''
+    rand = random.Random(0)
+    letters = string.ascii_letters[:50]
+    words = {''.join(rand.choice(letters) for i in range(rand.randint(3, 12))) for j in range(3000)}
+    p = packed.remove_eps(packed.thompson(regex_parser.parse(' + '.join(' * '.join(word) for word in words))))
+    dfa = packed.make_deterministic(p)
+
+    def explicit() -> packed.PackedFA:
+        full = packed.make_min(packed.make_full(dfa, letters))
+        return packed.make_min(packed.invert_full_fa(full))
+
+    def implicit() -> packed.PackedFA:
+        partial = packed.invert_full_fa(packed.make_min_partial(dfa, False))
+        return packed.make_min_partial(partial, True)
+
+    plain = timed('explicit sink', explicit)
+    partial = timed('implicit sink', implicit)
+    res = timed('expand sink for output', lambda: packed.expand_sink(partial, letters, True))
+    assert packed.fingerprint(res) == packed.fingerprint(plain)
+    edge_count = len(packed.make_full(dfa, letters).edge_labels)
+    print(f'states: {res.state_count}, edges: {edge_count} with sink, {len(dfa.edge_labels)} without')
+
+
+def bench_parser() -> None:
+    rand = random.Random(0)
+    regexes = {
+        'alternation': ' + '.join(f'x{rand.randint(0, 999)} * y' for i in range(100000)),
+        'nesting': '(' * 100000 + 'x' + ' * y)' * 100000,
+    }
+    for name, regex in regexes.items():
+        print(f'{name}: {len(regex)} chars')
+        try:
+            timed('ast.parse', lambda: ast.parse(regex))
+        except (RecursionError, MemoryError, SyntaxError) as e:
+            print(f'ast.parse: failed with {type(e).__name__}')
+        timed('regex_parser.parse', lambda: regex_parser.parse(regex))
+
+
+def bench_thompson() -> None:
+    rand = random.Random(0)
+    regex = ' + '.join(f'(x{rand.randint(0, 99)} * y) ** None' for i in range(20000))
+    a = regex_parser.parse(regex)
+    builds: list[tuple[str, typing.Callable[[], typing.Any]]] = [
+        ('fa.FA operators', lambda: convert.postfix_to_fa(a.postfix)),
+        ('packed.thompson', lambda: packed.thompson(a)),
+    ]
+    for name, func in builds:
+        timed(name, func)
+        tracemalloc.start()
+        func()
+        print(f'{name}: peak {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB')
+        tracemalloc.stop()
+
+
+def bench_repetition() -> None:
+    rand = random.Random(0)
+    term = ' + '.join(f'x{rand.randint(0, 9)} * y{rand.randint(0, 9)}' for i in range(100))
+    regexes = {
+        'counted': f'({term}) ** 500',
+        'repeated': ' * '.join(f'({term})' for i in range(500)),
+    }
+    for name, regex in regexes.items():
+        a = regex_parser.parse(regex)
+        print(f'{name}: {packed.thompson_sizes(a.postfix)[0]} states')
+        timed('fa.FA operators', lambda: convert.postfix_to_fa(a.postfix))
+        timed('packed.thompson', lambda: packed.thompson(a))
+
+
+def random_regex(rand: random.Random, name_count: int, letters: str) -> str:
+    terms = [rand.choice(letters) for i in range(name_count)]
+    while len(terms) > 1:
+        right = terms.pop(rand.randrange(len(terms)))
+        left = terms.pop(rand.randrange(len(terms)))
+        op = rand.choice(['+', '*', '*'])
+        term = f'({left}) {op} ({right})'
+        if rand.random() < 0.2:
+            term = f'({term}) ** None'
+        terms.append(term)
+    return terms[0]
+
+
+def random_dfa(rand: random.Random, state_count: int, letters: str) -> fa.FA:
+    builder = packed.PackedBuilder([''])
+    for state in range(state_count):
+        for letter in letters:
+            builder.add_edge(builder.label_id(letter), rand.randrange(state_count))
+        builder.end_state(rand.random() < 0.2)
+    return packed.packed_to_fa(builder.build())
+
+
+def bench_fa_to_re() -> None:
+    rand = random.Random(0)
+    automata = [convert.ast_to_eps_nfa(convert.regex_to_ast(random_regex(rand, name_count, 'qwer'))) for name_count in [25, 100, 250]]
+    automata += [random_dfa(random.Random(state_count), state_count, 'qw') for state_count in [60, 100]]
+    for a in automata:
+        state_count = len([*a.start.bfs()])
+        regex = timed(f'fa_to_re of {state_count} states', lambda: convert.fa_to_re(a))
+        print(f'regex length: {len(regex)}')
+
+
+def bench_compare() -> None:
+    '''
+        (q+w)**None * q * (q+w)**n has 2**(n+1) states after minimization,
+        a difference in the last letters is found without determinizing it.
+    '''
+    n = 14
+    left = f'(q+w)**None * q * (q+w)**{n}'
+    right = f'(q+w)**None * q * (q+w)**{n - 1} * (q+w+1)'
+    letters = 'qw'
+    timed('full chain', lambda: compile_regex(left, letters) and compile_regex(right, letters))
+    a, b = [packed.remove_eps(packed.thompson(regex_parser.parse(regex))) for regex in (left, right)]
+    counterexample = timed('equivalence', lambda: compare.equivalence_counterexample(a, b))
+    print(f'counterexample: {counterexample!r}')
+    counterexample = timed('inclusion', lambda: compare.inclusion_counterexample(b, a))
+    print(f'counterexample: {counterexample!r}')
+
+
+def chain_dfa(state_count: int, w_step: int) -> packed.PackedFA:
+    '''
+        Every state goes to the next one by q and by w if its number is divisible by w_step,
+        every second state is final.
+    '''
+    builder = packed.PackedBuilder(['', 'q', 'w'])
+    for state in range(state_count - 1):
+        builder.add_edge(1, state + 1)
+        if state % w_step == 0:
+            builder.add_edge(2, state + 1)
+        builder.end_state(state % 2 == 0)
+    builder.end_state(True)
+    return builder.build()
+
+
+def bench_product() -> None:
+    '''
+        Operands have 10**4 states each, full product would have 10**8 pairs,
+        only about 10**4 of them are reachable.
+    '''
+    a, b = chain_dfa(10 ** 4, 2), chain_dfa(10 ** 4, 3)
+    for operation in (product.intersect, product.union, product.difference):
+        res = timed(operation.__name__, lambda: operation(a, b))
+        print(f'states: {res.state_count}')
+
+
+benchmarks = {
+    'product': bench_product,
+    'compare': bench_compare,
+    'fa-to-re': bench_fa_to_re,
+    'repetition': bench_repetition,
+    'thompson': bench_thompson,
+    'parser': bench_parser,
+    'matcher': bench_matcher,
+    'lazy-matcher': bench_lazy_matcher,
+    'binary': bench_binary,
+    'json-output': bench_json_output,
+    'letter-classes': bench_letter_classes,
+    'char-sets': bench_char_sets,
+    'implicit-sink': bench_implicit_sink,
+}
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or benchmarks:
+        print(f'# {name}')
+        benchmarks[name]()
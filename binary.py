@@ -0,0 +1,221 @@
+'''
+    Binary format of automata, all numbers are little-endian:
+
+        header: magic b'FSMB', then u32 version, flags, state count, label count, edge count, letter count
+        labels: u32 length and utf-8 bytes of every label, labels[0] is eps, padded to 4 bytes
+        letters: the same for the letters the automaton was written with, as they were given
+        finals: bitset of final states, bit s of byte s // 8 is state s, padded to 4 bytes
+
+    then for a deterministic automaton (flag DENSE) the table as compiled_dfa in matcher.py has it:
+    i32 rows for states and one more for the dead state, one column for every label but eps
+    and one more for unknown chars, missing transitions go to the dead state.
+    Labels of a deterministic automaton are disjoint, sets of chars are split.
+
+    Otherwise edges as in PackedFA: i32 offsets of every state and one more,
+    then i32 labels and i32 targets of all edges.
+
+    Reading checks that all numbers of the table or the edges are in range.
+    Written and read again an automaton has the same letters, labels and language,
+    but its states may be numbered differently and its sets of chars may be split.
+'''
+from __future__ import annotations
+import array
+import mmap
+import struct
+import sys
+import typing
+
+import charset
+import packed
+
+MAGIC = b'FSMB'
+VERSION = 2
+DENSE = 1
+header = struct.Struct('<4s6I')
+
+
+def pad(size: int) -> int:
+    return -size % 4
+
+
+def texts_bytes(texts: list[str]) -> bytes:
+    parts = []
+    for text in texts:
+        data = text.encode()
+        parts += [struct.pack('<I', len(data)), data]
+    size = sum(map(len, parts))
+    return b''.join(parts) + bytes(pad(size))
+
+
+def int_array(data: typing.Any) -> array.array[int]:
+    '''
+        Copy of little-endian i32 data as array.
+    '''
+    res = array.array('i', bytes(data))
+    if sys.byteorder == 'big':
+        res.byteswap()
+    return res
+
+
+def int_bytes(values: array.array[int]) -> bytes:
+    if sys.byteorder == 'big':
+        values = array.array('i', values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def dumps(p: packed.PackedFA, letters: typing.Iterable[str]) -> bytes:
+    '''
+        p in binary format, letters are added to its labels.
+    '''
+    given_letters = letters = list(letters)
+    is_dense = p.is_deterministic()
+    if is_dense and charset.has_sets([*p.labels, *letters]):
+        atoms = charset.split([*p.labels[packed.EPS + 1:], *letters])
+        letters = [atom for label in letters for atom in atoms[label]]
+        p = packed.split_labels(p, letters)
+    labels = ['', *sorted(set(letters) - {''} | set(p.labels[packed.EPS + 1:]))]
+    label_ids = {label: index for index, label in enumerate(labels)}
+    new_labels = [label_ids[label] for label in p.labels]
+    state_count = p.state_count
+
+    parts = [
+        header.pack(MAGIC, VERSION, DENSE if is_dense else 0, state_count, len(labels), len(p.edge_labels), len(given_letters)),
+        texts_bytes(labels),
+        texts_bytes(given_letters),
+        bytes(p.finals),
+        bytes(pad(len(p.finals))),
+    ]
+
+    if is_dense:
+        width = len(labels)
+        table = array.array('i', [state_count]) * ((state_count + 1) * width)
+        for state in range(state_count):
+            for label, target in p.edges(state):
+                table[state * width + new_labels[label] - 1] = target
+        parts.append(int_bytes(table))
+    else:
+        parts += [
+            int_bytes(p.offsets),
+            int_bytes(array.array('i', (new_labels[label] for label in p.edge_labels))),
+            int_bytes(p.edge_targets),
+        ]
+    return b''.join(parts)
+
+
+def read_texts(view: memoryview, position: int, count: int) -> tuple[list[str], int]:
+    '''
+        count texts written by texts_bytes at position, and the position after them.
+    '''
+    texts = []
+    for index in range(count):
+        if position + 4 > len(view):
+            raise ValueError('binary automaton is truncated')
+        size, = struct.unpack_from('<I', view, position)
+        texts.append(str(view[position + 4:position + 4 + size], 'utf-8'))
+        position += 4 + size
+    return texts, position + pad(position)
+
+
+def check_range(data: memoryview, low: int, high: int, name: str) -> None:
+    '''
+        Raises ValueError unless every i32 of data is in range(low, high).
+    '''
+    if not data:
+        return
+    try:
+        import numpy
+    except ImportError:
+        values: typing.Any = int_array(data)
+        smallest, largest = min(values), max(values)
+    else:
+        values = numpy.frombuffer(data, dtype='<i4')
+        smallest, largest = int(values.min()), int(values.max())
+    if smallest < low or largest >= high:
+        raise ValueError(f'binary automaton has {name} out of range')
+
+
+def is_sorted(data: memoryview) -> bool:
+    try:
+        import numpy
+    except ImportError:
+        values = int_array(data)
+        return all(a <= b for a, b in zip(values, values[1:]))
+    return bool(numpy.all(numpy.diff(numpy.frombuffer(data, dtype='<i4')) >= 0))
+
+
+class binary_fa:
+    '''
+        Automaton in binary format over any buffer, sections are memoryviews of it without copies.
+    '''
+
+    def __init__(self, buffer: typing.Any) -> None:
+        self.buffer = buffer
+        view = memoryview(buffer)
+        if len(view) < header.size or bytes(view[:4]) != MAGIC:
+            raise ValueError('not an automaton in binary format')
+        magic, version, flags, state_count, label_count, edge_count, letter_count = header.unpack_from(view)
+        if version != VERSION:
+            raise ValueError(f'unknown binary format version {version}')
+        self.is_dense = bool(flags & DENSE)
+        self.state_count = state_count
+
+        position = header.size
+        self.labels, position = read_texts(view, position, label_count)
+        self.letters, position = read_texts(view, position, letter_count)
+
+        finals_size = (state_count + 7) // 8
+        self.finals_offset = position
+        self.finals = view[position:position + finals_size]
+        position += finals_size + pad(finals_size)
+
+        sizes = [(state_count + 1) * label_count] if self.is_dense else [state_count + 1, edge_count, edge_count]
+        self.sections = []
+        self.table_offset = position
+        for count in sizes:
+            self.sections.append(view[position:position + 4 * count])
+            position += 4 * count
+        if position > len(view):
+            raise ValueError('binary automaton is truncated')
+
+        if self.is_dense:
+            # the extra row is the dead state
+            check_range(self.sections[0], 0, state_count + 1, 'transition target')
+        else:
+            offsets, edge_labels, edge_targets = self.sections
+            check_range(edge_labels, 0, label_count, 'edge label')
+            check_range(edge_targets, 0, state_count, 'edge target')
+            first, = struct.unpack_from('<i', offsets)
+            last, = struct.unpack_from('<i', offsets, 4 * state_count)
+            if first != 0 or last != edge_count or not is_sorted(offsets):
+                raise ValueError('binary automaton has edge offsets out of order')
+
+    def to_packed(self) -> packed.PackedFA:
+        finals = bytearray(self.finals)
+        if not self.is_dense:
+            offsets, edge_labels, edge_targets = map(int_array, self.sections)
+            return packed.PackedFA(list(self.labels), offsets, edge_labels, edge_targets, finals)
+
+        table = int_array(self.sections[0])
+        width = len(self.labels)
+        builder = packed.PackedBuilder(list(self.labels))
+        for state in range(self.state_count):
+            for column in range(width - 1):
+                target = table[state * width + column]
+                if target != self.state_count:
+                    builder.add_edge(column + 1, target)
+            builder.end_state(packed.bit_get(finals, state))
+        return packed.merge_labels(builder.build())
+
+
+def load(path: str) -> binary_fa:
+    '''
+        Maps the file to memory, it stays mapped while the result is used.
+    '''
+    with open(path, 'rb') as file:
+        return binary_fa(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def is_binary(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
@@ -0,0 +1,135 @@
+from __future__ import annotations
+import os
+import collections
+import json
+import hashlib
+import tempfile
+import typing
+
+
+class result_cache:
+    '''
+        Results of operation chains stored as files named by a hash of
+        the canonical input, letters, operation names and options.
+
+        Files are written to a temporary name and renamed, so readers in other processes
+        see either the whole file or nothing. Reading a file touches it, when the directory
+        grows over max_bytes the least recently used files are removed.
+    '''
+
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # bytes in directory as this process knows them, None before the first scan
+        self.known_bytes: int | None = None
+
+    @staticmethod
+    def key(canonical_input: str, letters: str, operation_names: tuple[str, ...], options: tuple[str, ...] = ()) -> str:
+        '''
+            options are flags that change the output, such as --letter-classes.
+        '''
+        parts: list[typing.Any] = [canonical_input, letters, list(operation_names)]
+        if options:
+            parts.append(list(options))
+        return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def load(self, key: str) -> str | None:
+        path = self.path(key)
+        try:
+            with open(path) as file:
+                text = file.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return text
+
+    def store(self, key: str, text: str) -> None:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        try:
+            with os.fdopen(descriptor, 'w') as file:
+                file.write(text)
+            os.replace(temporary_path, path)
+        except BaseException:
+            try:
+                os.remove(temporary_path)
+            except OSError:
+                pass
+            raise
+
+        if self.known_bytes is None:
+            self.evict()
+        else:
+            self.known_bytes += len(text.encode())
+            if self.known_bytes > self.max_bytes:
+                self.evict()
+
+    def evict(self) -> None:
+        '''
+            Removes least recently used files until the directory fits into 3/4 of max_bytes.
+        '''
+        files = []
+        for subdirectory in os.scandir(self.directory):
+            if not subdirectory.is_dir():
+                continue
+            for entry in os.scandir(subdirectory.path):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for mtime, size, path in files)
+        if total > self.max_bytes:
+            files.sort()
+            for mtime, size, path in files:
+                if total <= self.max_bytes * 3 // 4:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+        self.known_bytes = total
+
+
+class answer_cache:
+    '''
+        Recent answers in memory by a sha256 of their requests, so the request texts are not kept.
+        At most max_count answers of at most max_chars chars in total, the least recently used go first.
+    '''
+
+    def __init__(self, max_count: int, max_chars: int) -> None:
+        self.max_count = max_count
+        self.max_chars = max_chars
+        self.chars = 0
+        self.answers: collections.OrderedDict[str, tuple[int, str, str]] = collections.OrderedDict()
+
+    @staticmethod
+    def key(*request: typing.Any) -> str:
+        return hashlib.sha256(json.dumps(request).encode()).hexdigest()
+
+    @staticmethod
+    def size(answer: tuple[int, str, str]) -> int:
+        return len(answer[1]) + len(answer[2])
+
+    def load(self, key: str) -> tuple[int, str, str] | None:
+        answer = self.answers.get(key)
+        if answer is not None:
+            self.answers.move_to_end(key)
+        return answer
+
+    def store(self, key: str, answer: tuple[int, str, str]) -> None:
+        if key in self.answers or self.size(answer) > self.max_chars:
+            return
+        self.answers[key] = answer
+        self.chars += self.size(answer)
+        while len(self.answers) > self.max_count or self.chars > self.max_chars:
+            key, answer = self.answers.popitem(last=False)
+            self.chars -= self.size(answer)
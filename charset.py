@@ -0,0 +1,198 @@
+'''
+    Labels that stand for sets of chars: '[a-z0-9_]' is any of its ranges and chars,
+    a label of one char is that char, other labels are names that match no char.
+
+    Inside brackets \\xHH, \\uHHHH and \\UHHHHHHHH are chars by code, \\c is c.
+'''
+from __future__ import annotations
+import bisect
+import re
+import typing
+
+# sorted disjoint ranges of codes, ends included
+Ranges = tuple[tuple[int, int], ...]
+
+item_re = re.compile(r'\\x([0-9a-fA-F]{2})|\\u([0-9a-fA-F]{4})|\\U([0-9a-fA-F]{8})|\\(.)|([^\\])', re.DOTALL)
+letters_re = re.compile(r'\[(?:\\.|[^\]\\])*\]|.', re.DOTALL)
+special_chars = '[]\\-'
+
+
+def is_set(label: str) -> bool:
+    return label.startswith('[') and label.endswith(']') and len(label) > 1
+
+
+def parse_set(label: str) -> Ranges:
+    '''
+        Ranges of a label in brackets.
+    '''
+    # code and whether it is a '-' written without escape, which makes a range of its neighbours
+    items: list[tuple[int, bool]] = []
+    for match in item_re.finditer(label, 1, len(label) - 1):
+        hex_code = match.group(1) or match.group(2) or match.group(3)
+        char = match.group(4) or match.group(5)
+        items.append((int(hex_code, 16) if hex_code else ord(char), match.group(5) == '-'))
+
+    ranges = []
+    index = 0
+    while index < len(items):
+        if index + 2 < len(items) and items[index + 1][1]:
+            low, high = items[index][0], items[index + 2][0]
+            if low > high:
+                raise ValueError(f'bad range in {label!r}')
+            ranges.append((low, high))
+            index += 3
+        else:
+            ranges.append((items[index][0], items[index][0]))
+            index += 1
+    return normalize(ranges)
+
+
+def parse(label: str) -> Ranges | None:
+    '''
+        Ranges of chars of label, None for names.
+    '''
+    if is_set(label):
+        return parse_set(label)
+    if len(label) == 1:
+        return ((ord(label), ord(label)),)
+    return None
+
+
+def normalize(ranges: typing.Iterable[tuple[int, int]]) -> Ranges:
+    res: list[tuple[int, int]] = []
+    for low, high in sorted(ranges):
+        if res and low <= res[-1][1] + 1:
+            res[-1] = res[-1][0], max(res[-1][1], high)
+        else:
+            res.append((low, high))
+    return tuple(res)
+
+
+def format_char(code: int) -> str:
+    char = chr(code)
+    if char in special_chars:
+        return '\\' + char
+    if not char.isprintable() or char.isspace():
+        return f'\\x{code:02x}' if code < 0x100 else f'\\u{code:04x}' if code < 0x10000 else f'\\U{code:08x}'
+    return char
+
+
+def format_ranges(ranges: Ranges) -> str:
+    '''
+        Shortest label for ranges, one char if it can be a name in regex.
+    '''
+    if len(ranges) == 1 and ranges[0][0] == ranges[0][1] and chr(ranges[0][0]).isidentifier():
+        return chr(ranges[0][0])
+    parts = []
+    for low, high in ranges:
+        parts.append(format_char(low))
+        if high > low + 1:
+            parts.append('-')
+        if high > low:
+            parts.append(format_char(high))
+    return '[' + ''.join(parts) + ']'
+
+
+def union(left: Ranges, right: Ranges) -> Ranges:
+    return normalize(left + right)
+
+
+def difference(left: Ranges, right: Ranges) -> Ranges:
+    res = []
+    index = 0
+    for low, high in left:
+        while index < len(right) and right[index][1] < low:
+            index += 1
+        position = index
+        while low <= high:
+            if position == len(right) or right[position][0] > high:
+                res.append((low, high))
+                break
+            if right[position][0] > low:
+                res.append((low, right[position][0] - 1))
+            low = max(low, right[position][1] + 1)
+            position += 1
+    return tuple(res)
+
+
+def letters_to_labels(letters: str) -> list[str]:
+    '''
+        Labels of --letters: sets in brackets and single chars.
+    '''
+    return letters_re.findall(letters)
+
+
+def has_sets(labels: typing.Iterable[str]) -> bool:
+    return any(is_set(label) for label in labels)
+
+
+def covers(letters: str, label: str) -> bool:
+    '''
+        Whether every char of label is in letters.
+    '''
+    if '[' not in letters and not is_set(label):
+        return label in letters
+    ranges = parse(label)
+    if ranges is None:
+        return label in letters_to_labels(letters)
+    alphabet: Ranges = ()
+    for letter in letters_to_labels(letters):
+        alphabet = union(alphabet, parse(letter) or ())
+    return not difference(ranges, alphabet)
+
+
+def example(label: str) -> str:
+    '''
+        First char of label, names are returned as they are.
+    '''
+    ranges = parse(label)
+    if not ranges:
+        return label
+    return chr(ranges[0][0])
+
+
+def split(labels: typing.Iterable[str]) -> dict[str, list[str]]:
+    '''
+        Splits chars of labels into disjoint atoms, the largest ranges no label divides,
+        returns labels of atoms of every label. Names are atoms of themselves.
+    '''
+    ranges_by_label = {label: parse(label) for label in labels}
+    points = sorted({
+        point
+        for ranges in ranges_by_label.values() if ranges
+        for low, high in ranges
+        for point in (low, high + 1)
+    })
+    names = [format_ranges(((low, high - 1),)) for low, high in zip(points, points[1:])]
+    res = {}
+    for label, ranges in ranges_by_label.items():
+        if ranges is None:
+            res[label] = [label]
+            continue
+        res[label] = [
+            names[index]
+            for low, high in ranges
+            for index in range(bisect.bisect_left(points, low), bisect.bisect_left(points, high + 1))
+        ]
+    return res
+
+
+def classifier(labels: typing.Iterable[str]) -> typing.Callable[[str], str | None]:
+    '''
+        Function from a char to the label containing it, labels must be disjoint.
+    '''
+    bounds = sorted(
+        (low, high, label)
+        for label in labels
+        for low, high in parse(label) or ()
+    )
+    lows = [low for low, high, label in bounds]
+    found: dict[str, str | None] = {}
+
+    def classify(char: str) -> str | None:
+        if char not in found:
+            code = ord(char)
+            index = bisect.bisect_right(lows, code) - 1
+            found[char] = bounds[index][2] if index >= 0 and code <= bounds[index][1] else None
+        return found[char]
+    return classify
@@ -1,19 +1,34 @@
 from __future__ import annotations
 import abc
 import convert
+import functools
+import itertools
 import sys
+import os
+import signal
+import pathlib
+import collections
+import concurrent.futures
 import typing
 import traceback
 import contextlib
 from collections import defaultdict as dd
 import json
 import io
-from dataclasses import dataclass
+from dataclasses import dataclass, field, replace
 
 from utils import *
 import fa
+import packed
 import argparse
 import validate
+import cache
+import compare
+import product
+import lazy_dfa
+import charset
+import regex_parser
+import binary
 
 
 @dataclass(frozen=True)
@@ -28,6 +43,10 @@ class frozen_fa:
     def from_json_str(data: str) -> frozen_fa:
         value = json.loads(data)
         assert isinstance(value, dict)
+        return frozen_fa.from_json(value)
+
+    @staticmethod
+    def from_json(value: dict[str, typing.Any]) -> frozen_fa:
         value['states'].sort()
         value['letters'].sort()
         value['transition_function'].sort()
@@ -36,13 +55,79 @@ class frozen_fa:
         value = {k:v for (k,v) in sorted(value.items())}
         return frozen_fa(**value)
 
-    def to_json_str(self) -> str:
+    def to_json_str(self, compact: bool = False) -> str:
+        if compact:
+            return json.dumps(vars(self), separators=(',', ':'))
         return json.dumps(vars(self), indent=4)
 
 
+@dataclass(frozen=True)
+class live_fa:
+    '''
+        Result of an operation, kept in memory until it is printed or used by the next operation.
+
+        If sink is not None, transitions missing from value go to a sink state, final if sink is True.
+        The sink is added when the value is printed or used by an operation that needs all transitions.
+    '''
+    value: fa.FA
+    letters_: str
+    sink: bool | None = None
+
+    @functools.cached_property
+    def full_value(self) -> fa.FA:
+        if self.sink is None:
+            return self.value
+        return convert.expand_sink(self.value, self.letters_, self.sink)
+
+    @functools.cached_property
+    def packed_value(self) -> packed.PackedFA:
+        return packed.fa_to_packed(self.full_value)
+
+    def write_json(self, file: typing.IO[str], compact: bool = False) -> None:
+        '''
+            Same text as frozen_fa of the value gives, written as it is made.
+        '''
+        packed.write_json(self.packed_value, self.letters_, file, compact)
+
+    @functools.cached_property
+    def letters(self) -> tuple[str, ...]:
+        # edges to the sink are labeled by letters_ only, so the sink is not added here
+        value = self.packed_value if self.sink is None else packed.fa_to_packed(self.value)
+        labels = set(charset.letters_to_labels(self.letters_)) | set(value.labels)
+        labels.discard('')
+        return tuple(sorted(labels))
+
+    @functools.cached_property
+    def private_fa(self) -> fa.FA:
+        '''
+            Same automaton as json_to_fa gives for the printed value:
+            nodes are created and edges are added in order of sorted transitions.
+        '''
+        p = self.packed_value
+        names = [str(state + 1) for state in range(p.state_count)]
+
+        name_to_node: dd[str, fa.Node] = dd(fa.Node)
+        res = fa.FA()
+
+        res.start = name_to_node[names[0]]
+
+        for name in sorted(names[state] for state in range(p.state_count) if p.is_final(state)):
+            name_to_node[name].is_final = True
+
+        for state in sorted(range(p.state_count), key=names.__getitem__):
+            transitions = sorted((p.labels[label], names[target]) for label, target in p.edges(state))
+            for letter, to in transitions:
+                name_to_node[names[state]] >> letter >> name_to_node[to]
+
+        for name, node in name_to_node.items():
+            node.name = name
+
+        return res
+
+
 @dataclass(frozen=True)
 class fa_or_re:
-    value_: str | frozen_fa
+    value_: str | frozen_fa | live_fa
 
     @staticmethod
     def from_public_str(data: str) -> fa_or_re:
@@ -51,44 +136,89 @@ class fa_or_re:
         except Exception:
             return fa_or_re(data)
 
-    def as_public_str(self) -> str:
+    @staticmethod
+    def from_binary(b: binary.binary_fa) -> fa_or_re:
+        return fa_or_re(live_fa(packed.packed_to_fa(b.to_packed()), ''.join(b.letters)))
+
+    def as_packed(self) -> packed.PackedFA:
+        if isinstance(self.value_, live_fa):
+            return self.value_.packed_value
+        return packed.fa_to_packed(self.as_private_fa())
+
+    def as_public_str(self, compact: bool = False) -> str:
+        if isinstance(self.value_, live_fa):
+            file = io.StringIO()
+            self.value_.write_json(file, compact)
+            return file.getvalue()
         if isinstance(self.value_, frozen_fa):
-            return self.value_.to_json_str()
+            return self.value_.to_json_str(compact)
         else:
             return self.value_
 
+    def write_public(self, file: typing.IO[str], compact: bool = False) -> None:
+        '''
+            Writes as_public_str, automata made by operations are written without building the text.
+        '''
+        if isinstance(self.value_, live_fa):
+            self.value_.write_json(file, compact)
+        else:
+            file.write(self.as_public_str(compact))
+
     def as_private_re(self) -> str:
-        if isinstance(self.value_, frozen_fa):
+        if isinstance(self.value_, (frozen_fa, live_fa)):
             assert False
         else:
             return self.value_
 
     def as_private_fa(self) -> fa.FA:
+        if isinstance(self.value_, live_fa):
+            return self.value_.private_fa
         if isinstance(self.value_, frozen_fa):
-            return fa.json_to_fa(json.loads(self.value_.to_json_str()))
+            return self.private_fa
         assert False
 
+    def as_partial_fa(self) -> tuple[fa.FA, bool | None]:
+        '''
+            Automaton that may miss transitions to a sink state and the sink, see live_fa.
+        '''
+        if isinstance(self.value_, live_fa) and self.value_.sink is not None:
+            return self.value_.value, self.value_.sink
+        return self.as_private_fa(), None
+
+    @functools.cached_property
+    def private_fa(self) -> fa.FA:
+        assert isinstance(self.value_, frozen_fa)
+        return fa.json_to_fa(json.loads(self.value_.to_json_str()))
+
+    @functools.cached_property
+    def properties(self) -> validate.fa_properties:
+        '''
+            Computed once, shared by all preconditions and postconditions checked on this value.
+            A deterministic value with a sink is full without adding it.
+        '''
+        if isinstance(self.value_, live_fa) and self.value_.sink is not None:
+            properties = validate.analyze(self.value_.value, self.value_.letters_)
+            return replace(properties, is_full=properties.is_det)
+        return validate.analyze(self.as_private_fa(), self.letters())
+
     def letters(self) -> str:
-        if isinstance(self.value_, frozen_fa):
-            return ''.join(self.value_.letters)
+        return ''.join(self.letter_labels())
+
+    def letter_labels(self) -> tuple[str, ...]:
+        if isinstance(self.value_, (frozen_fa, live_fa)):
+            return tuple(self.value_.letters)
         assert False
 
     @staticmethod
-    def from_private_fa(a: fa.FA, letters: str) -> fa_or_re:
-        return fa_or_re(
-            frozen_fa.from_json_str(
-                json.dumps(
-                    fa.fa_to_json(a, letters)
-                )
-            )
-        )
+    def from_private_fa(a: fa.FA, letters: str, sink: bool | None = None) -> fa_or_re:
+        return fa_or_re(live_fa(a, letters, sink))
 
     @staticmethod
     def from_private_re(a: str, letters: str) -> fa_or_re:
         return fa_or_re(a)
 
     def is_fa(self) -> bool:
-        return isinstance(self.value_, frozen_fa)
+        return isinstance(self.value_, (frozen_fa, live_fa))
 
 
 @dataclass
@@ -109,17 +239,17 @@ class IsFA(Condition):
 
 class HasNoEps(IsFA):
     def __call__(self, value: fa_or_re) -> bool:
-        return super().__call__(value) and validate.fa_has_no_eps(value.as_private_fa())
+        return super().__call__(value) and not value.properties.has_eps
 
 
 class IsDeterministic(HasNoEps):
     def __call__(self, value: fa_or_re) -> bool:
-        return super().__call__(value) and validate.fa_is_det(value.as_private_fa())
+        return super().__call__(value) and value.properties.is_det
 
 
 class IsFull(IsDeterministic):
     def __call__(self, value: fa_or_re) -> bool:
-        return super().__call__(value) and validate.fa_is_full(value.as_private_fa(), value.letters())
+        return super().__call__(value) and value.properties.is_full
 
 
 @dataclass(frozen=True)
@@ -127,6 +257,13 @@ class command_line_operation_base:
     name: str
     preconditions: tuple[Condition]
     postconditions: tuple[Condition]
+    # the operation takes the value of --other as its second argument
+    needs_other: bool = field(default=False, repr=False)
+    # the operation gives the same result for letters with the same transitions,
+    # so it can work with one letter of every class
+    keeps_letter_classes: bool = field(default=False, repr=False)
+    # the operation can leave transitions to the sink state missing, see live_fa
+    can_skip_sink: bool = field(default=False, repr=False)
 
 
 class command_line_operation(command_line_operation_base):
@@ -155,12 +292,16 @@ class command_line_operation(command_line_operation_base):
 
 command_line_operations = {
     're-to-eps-nfa':        command_line_operation(name='re-to-eps-nfa',       preconditions=(IsRE(),),            postconditions=(IsFA(),)),
-    'remove-eps':           command_line_operation(name='remove-eps',          preconditions=(IsFA(),),            postconditions=(HasNoEps(),)),
-    'make-deterministic':   command_line_operation(name='make-deterministic',  preconditions=(HasNoEps(),),        postconditions=(IsDeterministic(),)),
-    'make-full':            command_line_operation(name='make-full',           preconditions=(IsDeterministic(),), postconditions=(IsFull(),)),
-    'minimize':             command_line_operation(name='minimize',            preconditions=(IsFull(),),          postconditions=(IsFull(),)),
-    'invert':               command_line_operation(name='invert',              preconditions=(IsFull(),),          postconditions=(IsFull(),)),
+    'remove-eps':           command_line_operation(name='remove-eps',          preconditions=(IsFA(),),            postconditions=(HasNoEps(),),        keeps_letter_classes=True),
+    'make-deterministic':   command_line_operation(name='make-deterministic',  preconditions=(HasNoEps(),),        postconditions=(IsDeterministic(),), keeps_letter_classes=True),
+    'make-full':            command_line_operation(name='make-full',           preconditions=(IsDeterministic(),), postconditions=(IsFull(),),          keeps_letter_classes=True, can_skip_sink=True),
+    'minimize':             command_line_operation(name='minimize',            preconditions=(IsFull(),),          postconditions=(IsFull(),),          keeps_letter_classes=True),
+    'invert':               command_line_operation(name='invert',              preconditions=(IsFull(),),          postconditions=(IsFull(),),          keeps_letter_classes=True),
     'eps-nfa-to-re':        command_line_operation(name='eps-nfa-to-re',       preconditions=(IsFA(),),            postconditions=(IsRE(),)),
+    'canonicalize':         command_line_operation(name='canonicalize',        preconditions=(IsFull(),),          postconditions=(IsFull(),)),
+    'intersect':            command_line_operation(name='intersect',           preconditions=(Condition(),),       postconditions=(HasNoEps(),),        needs_other=True),
+    'union':                command_line_operation(name='union',               preconditions=(Condition(),),       postconditions=(HasNoEps(),),        needs_other=True),
+    'difference':           command_line_operation(name='difference',          preconditions=(Condition(),),       postconditions=(HasNoEps(),),        needs_other=True),
 }
 
 
@@ -180,6 +321,23 @@ def process_args(
         type=command_line_operation,
     )
     parser.add_argument('--letters', required=True)
+    parser.add_argument('--input', help='read regex or automaton from this file instead of stdin, automata may be in binary format')
+    parser.add_argument('--output', help='write the result to this file instead of stdout')
+    parser.add_argument('--format', choices=['json', 'binary'], default='json', help='format of the automaton written to --output, see README')
+    parser.add_argument('--compact', action='store_true', help='write JSON of automata without indentation')
+    parser.add_argument('--match', help='print accept or reject for every line of this file, - for stdin')
+    parser.add_argument('--only-matching', action='store_true', help='with --match print only accepted lines')
+    parser.add_argument('--letter-classes', action='store_true', help='run operations over classes of letters with the same transitions, see README')
+    parser.add_argument('--implicit-sink', action='store_true', help='make-full leaves transitions to the sink state out until the result is printed, see README')
+    parser.add_argument('--lazy', action='store_true', help='with --match build deterministic states only for the lines being matched')
+    parser.add_argument('--fingerprint', action='store_true', help='print sha256 of the minimal full automaton of the result instead of the result')
+    parser.add_argument('--other', help='regex or automaton to compare the result with or to use in intersect, union and difference')
+    parser.add_argument('--compare', choices=['equivalence', 'inclusion'], help='with --other: check that the result is equivalent to it or included in it')
+    parser.add_argument('--serve', action='store_true', help='as the first argument: answer JSON-lines requests from stdin, see README')
+    parser.add_argument('--batch', help='convert every line of this file or every file of this directory, see README')
+    parser.add_argument('--jobs', type=int, help='with --batch: number of worker processes, all available cores by default')
+    parser.add_argument('--timeout', type=float, help='with --batch: seconds allowed for one input')
+    add_cache_arguments(parser)
 
     try:
         args = parser.parse_args(argv[1:])
@@ -192,6 +350,175 @@ def process_args(
 
     assert issubclass(IsFull, IsFA)
 
+    if args.serve:
+        print('--serve must be the first argument.', file=stderr)
+        return 1
+
+    if args.match == '-' and args.input is None:
+        print('--match - reads lines from stdin, so --input is required.', file=stderr)
+        return 1
+
+    if args.batch is not None and (args.input is not None or args.match is not None):
+        print('--batch can not be used with --input or --match.', file=stderr)
+        return 1
+
+    if args.fingerprint and (args.batch is not None or args.match is not None):
+        print('--fingerprint can not be used with --batch or --match.', file=stderr)
+        return 1
+
+    if args.compare is not None and (args.batch is not None or args.match is not None or args.fingerprint):
+        print('--compare can not be used with --batch, --match or --fingerprint.', file=stderr)
+        return 1
+
+    if args.output is not None and (args.batch is not None or args.match is not None or args.fingerprint or args.compare is not None):
+        print('--output can not be used with --batch, --match, --fingerprint or --compare.', file=stderr)
+        return 1
+
+    if args.format == 'binary' and args.output is None:
+        print('--format binary needs --output.', file=stderr)
+        return 1
+
+    if args.other is None:
+        for operation in operations:
+            if operation.needs_other:
+                print(f'{operation.name} needs --other.', file=stderr)
+                return 1
+        if args.compare is not None:
+            print('--compare needs --other.', file=stderr)
+            return 1
+
+    if not check_chain(operations, stderr):
+        return 1
+
+    other = None
+    if args.other is not None:
+        try:
+            other_input = read_input(args.other)
+            other = other_input if isinstance(other_input, str) else fa_or_re.from_binary(other_input).as_public_str()
+        except Exception as e:
+            print(f'{e!r}', file=stderr)
+            return 1
+
+    if args.batch is not None:
+        try:
+            items = batch_items(args.batch)
+        except Exception as e:
+            print(f'{e!r}', file=stderr)
+            return 1
+        names = tuple(operation.name for operation in operations)
+        for response in run_batch(items, names, letters, args.jobs, args.timeout, args.cache, args.cache_size, other):
+            stdout.write(json.dumps(response) + '\n')
+        return 0
+
+    text: str | binary.binary_fa
+    try:
+        text = stdin.read() if args.input is None else read_input(args.input)
+    except Exception as e:
+        print(f'{e!r}', file=stderr)
+        return 1
+
+    value = None
+    if args.match is not None and isinstance(text, binary.binary_fa) and text.is_dense and not operations and not args.lazy:
+        if not check_letters(''.join(text.labels), letters, stderr):
+            return 1
+    else:
+        value = evaluate(text, operations, letters, stderr, open_cache(args.cache, args.cache_size), other, args.letter_classes, args.implicit_sink)
+        if value is None:
+            return 1
+
+    if args.match is not None:
+        with contextlib.ExitStack() as stack:
+            try:
+                lines = stdin if args.match == '-' else stack.enter_context(open(args.match))
+            except Exception as e:
+                print(f'{e!r}', file=stderr)
+                return 1
+            if value is None:
+                # the table of the file is matched where it is mapped
+                matched = match_binary_lines(typing.cast(binary.binary_fa, text), lines)
+            elif args.lazy:
+                matched = lazy_match_lines(nfa_value(value), lines)
+            else:
+                matched = match_lines(compile_value(value), lines)
+            for line, accepted in matched:
+                if not args.only_matching:
+                    stdout.write('accept\n' if accepted else 'reject\n')
+                elif accepted:
+                    stdout.write(line + '\n')
+        return 0
+
+    assert value is not None
+
+    if args.fingerprint:
+        print(fingerprint(value, letters))
+        return 0
+
+    if args.compare is not None:
+        assert other is not None
+        try:
+            other_value = fa_or_re.from_public_str(other)
+            if args.compare == 'equivalence':
+                counterexample = compare.equivalence_counterexample(nfa_value(value), nfa_value(other_value))
+            else:
+                counterexample = compare.inclusion_counterexample(nfa_value(value), nfa_value(other_value))
+        except Exception as e:
+            print(f'{e!r}', file=stderr)
+            return 1
+        if counterexample is None:
+            print('equivalent' if args.compare == 'equivalence' else 'included')
+        else:
+            print(f'counterexample: {json.dumps(counterexample)}')
+        return 0
+
+    if args.output is not None:
+        if args.format == 'binary' and not value.is_fa():
+            print('--format binary needs an automaton, not a regex.', file=stderr)
+            return 1
+        try:
+            if args.format == 'binary':
+                with open(args.output, 'wb') as binary_file:
+                    binary_file.write(binary.dumps(value.as_packed(), value.letter_labels()))
+            else:
+                with open(args.output, 'w') as file:
+                    value.write_public(file, args.compact)
+                    file.write('\n')
+        except Exception as e:
+            print(f'{e!r}', file=stderr)
+            return 1
+        return 0
+
+    value.write_public(stdout, args.compact)
+    stdout.write('\n')
+
+    return 0
+
+
+def read_input(path: str) -> str | binary.binary_fa:
+    '''
+        Text of the file, or its automaton mapped to memory if it is in binary format.
+    '''
+    if binary.is_binary(path):
+        return binary.load(path)
+    with open(path) as file:
+        return file.read()
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--cache', help='directory to keep results of operations in, see README')
+    parser.add_argument('--cache-size', type=int, default=1 << 28, help='with --cache: size limit of the directory in bytes')
+
+
+@functools.cache
+def open_cache(directory: str | None, max_bytes: int) -> cache.result_cache | None:
+    if directory is None:
+        return None
+    return cache.result_cache(directory, max_bytes)
+
+
+def check_chain(operations: list[command_line_operation], stderr: typing.IO[str]) -> bool:
+    '''
+        Checks that postconditions of every operation fulfill preconditions of the next one.
+    '''
     for left_operation, right_operation in zip(operations, operations[1:]):
 
         for precondition in right_operation.preconditions:
@@ -204,24 +531,43 @@ def process_args(
                 operation = left_operation
                 msg += f'{operation = }.'
                 print(msg, file=stderr)
-                return 1
+                return False
+
+    return True
+
 
+def evaluate(
+    text: str | binary.binary_fa,
+    operations: list[command_line_operation],
+    letters: str,
+    stderr: typing.IO[str],
+    results: cache.result_cache | None = None,
+    other: str | None = None,
+    letter_classes: bool = False,
+    implicit_sink: bool = False,
+) -> fa_or_re | None:
+    '''
+        Parses text or takes the automaton in binary format and applies operations to it,
+        on errors prints them to stderr and returns None.
+        Operations that need a second argument get other parsed the same way.
+
+        With letter_classes runs of operations that keep letter classes get an automaton
+        with one letter of every class, letters are expanded after the run.
+        Automata or letters with sets of chars are not grouped.
+
+        With implicit_sink operations that can skip the sink state do, see live_fa.
+
+        With results cache the value after every operation is stored,
+        and the chain resumes after its longest prefix found in the cache.
+    '''
     try:
-        value = fa_or_re.from_public_str(stdin.read())
+        value = fa_or_re.from_binary(text) if isinstance(text, binary.binary_fa) else fa_or_re.from_public_str(text)
     except Exception as e:
         print(f'{e!r}', file=stderr)
-        return 1
+        return None
 
-    if value.is_fa():
-        missing_letters = ''.join([
-            letter
-            for letter in value.letters()
-            if letter not in letters
-        ])
-        if missing_letters:
-            print(
-                f'FA has letters {missing_letters!r} missing in command line arguments.', file=stderr)
-            return 1
+    if value.is_fa() and not check_letters(value.letters(), letters, stderr):
+        return None
 
     if operations:
         operation = operations[0]
@@ -229,52 +575,492 @@ def process_args(
             if not precondition(value):
                 print(
                     f'Input {value!r} dit not pass {precondition = !r} of the {operation = !r}.', file=stderr)
-                return 1
+                return None
 
+    other_value = None
     for operation in operations:
+        if operation.needs_other:
+            if other is None:
+                print(f'{operation.name} needs --other.', file=stderr)
+                return None
+            other_value = fa_or_re.from_public_str(other)
+
+    names = tuple(operation.name for operation in operations)
+    options = tuple(flag for flag, is_set in [('--letter-classes', letter_classes), ('--implicit-sink', implicit_sink)] if is_set)
+    done = 0
+    if results is not None:
+        canonical_input = canonical_text(value)
+        if other_value is not None:
+            canonical_input = json.dumps([canonical_input, canonical_text(other_value)])
+        for done in range(len(operations), -1, -1):
+            cached = results.load(results.key(canonical_input, letters, names[:done], options)) if done else None
+            if cached is not None:
+                value = fa_or_re.from_public_str(cached)
+                break
+
+    classes = None
+    operation_letters = letters
+    for index, operation in enumerate(operations[done:], done):
+
+        if letter_classes and operation.keeps_letter_classes:
+            # sets of chars already stand for many letters, their labels are not grouped
+            if classes is None and not charset.has_sets([*charset.letters_to_labels(letters), *value.letter_labels()]):
+                value, classes = compress_letters(value, letters)
+                operation_letters = ''.join(letters_of_class[0] for letters_of_class in classes if charset.parse(letters_of_class[0]) is not None)
+        elif classes is not None:
+            value = expand_letters(value, letters, classes)
+            classes = None
+            operation_letters = letters
 
         for precondition in operation.preconditions:
             assert precondition(value)
 
         func = typing.cast(
-            typing.Callable[[fa_or_re, str], fa_or_re],
-            eval(
+            typing.Callable[..., fa_or_re],
+            globals()[
                 operation.name.replace('-', '_')
-            )
+            ]
         )
 
+        arguments: list[typing.Any] = [value, operation_letters]
+        if operation.needs_other:
+            arguments.append(other_value)
+        keywords = {'implicit_sink': True} if implicit_sink and operation.can_skip_sink else {}
+
         value = (
             func(
-                value,
-                letters
+                *arguments,
+                **keywords,
             )
         )
 
-        if value.is_fa():
-            missing_letters = ''.join([
-                letter
-                for letter in value.letters()
-                if letter not in letters
-            ])
-            if missing_letters:
-                print(
-                    f'FA has letters {missing_letters!r} missing in command line arguments.', file=stderr)
-                return 1
+        if value.is_fa() and not check_letters(value.letters(), letters, stderr):
+            return None
 
         for postcondition in operation.postconditions:
             assert postcondition(value)
 
-    print(value.as_public_str())
+        if results is not None:
+            result = value if classes is None else expand_letters(value, letters, classes)
+            results.store(results.key(canonical_input, letters, names[:index + 1], options), result.as_public_str())
+
+    if classes is not None:
+        value = expand_letters(value, letters, classes)
+
+    return value
+
+
+def check_letters(labels: str, letters: str, stderr: typing.IO[str]) -> bool:
+    '''
+        Checks that letters cover labels of an automaton.
+    '''
+    missing_letters = ''.join([
+        letter
+        for letter in charset.letters_to_labels(labels)
+        if not charset.covers(letters, letter)
+    ])
+    if missing_letters:
+        print(
+            f'FA has letters {missing_letters!r} missing in command line arguments.', file=stderr)
+        return False
+    return True
+
+
+def compress_letters(value: fa_or_re, letters: str) -> tuple[fa_or_re, list[list[str]]]:
+    '''
+        value with edges of the first letter of every class only, and the classes.
+    '''
+    p = packed.fa_to_packed(value.as_private_fa())
+    classes = packed.letter_classes(p, charset.letters_to_labels(letters))
+    first_letters = ''.join(letters_of_class[0] for letters_of_class in classes if charset.parse(letters_of_class[0]) is not None)
+    return fa_or_re.from_private_fa(packed.packed_to_fa(packed.compress_letters(p, classes)), first_letters), classes
+
+
+def expand_letters(value: fa_or_re, letters: str, classes: list[list[str]]) -> fa_or_re:
+    p = packed.fa_to_packed(value.as_private_fa())
+    return fa_or_re.from_private_fa(packed.packed_to_fa(packed.expand_letters(p, classes)), letters)
 
+
+def canonical_text(value: fa_or_re) -> str:
+    '''
+        Public text of value, regexes as their parsed postfix form or as they are if they do not parse.
+    '''
+    if value.is_fa():
+        return value.as_public_str()
+    text = value.as_public_str()
+    try:
+        return repr(regex_parser.parse(text).postfix)
+    except regex_parser.RegexSyntaxError:
+        return text
+
+
+def serve(
+    argv: list[str],
+    stdin: typing.IO[str],
+    stdout: typing.IO[str],
+    stderr: typing.IO[str],
+) -> int:
+    '''
+        Answers every JSON line of stdin with one JSON line, until stdin ends.
+    '''
+    parser = ThrowingArgumentParser(exit_on_error=False)
+    parser.add_argument('--serve', action='store_true', required=True)
+    add_cache_arguments(parser)
+    try:
+        args = parser.parse_args(argv[1:])
+    except Exception as e:
+        print(e, file=stderr)
+        return 1
+
+    for line in stdin:
+        if not line.strip():
+            continue
+        stdout.write(json.dumps(serve_request(line, args.cache, args.cache_size)) + '\n')
+        stdout.flush()
     return 0
 
 
+def serve_request(line: str, cache_directory: str | None = None, cache_size: int = 0) -> dict[str, typing.Any]:
+    '''
+        Request is {"operations": [...], "letters": "...", "input": regex or automaton, "other": regex or automaton, "id": any},
+        automata may be JSON objects or their texts, other and id are optional, id is echoed back.
+
+        Response has id, code, output and error, where code, output and error are
+        exit code, stdout and stderr the same call of command.py would give,
+        except that an exception gives code 1 and its repr as error.
+    '''
+    request_id = None
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise ValueError('request must be a JSON object')
+        request_id = request.get('id')
+        operations = request['operations']
+        letters = request['letters']
+        text = request['input']
+        if not isinstance(operations, list) or not all(isinstance(name, str) for name in operations):
+            raise ValueError('operations must be a list of strings')
+        if not isinstance(letters, str):
+            raise ValueError('letters must be a string')
+        if not isinstance(text, str):
+            text = json.dumps(text)
+        other = request.get('other')
+        if other is not None and not isinstance(other, str):
+            other = json.dumps(other)
+        code, output, error = run_request(tuple(operations), letters, text, cache_directory, cache_size, other)
+    except Exception as e:
+        code, output, error = 1, '', f'{e!r}\n'
+    return {'id': request_id, 'code': code, 'output': output, 'error': error}
+
+
+recent_answers = cache.answer_cache(max_count=1024, max_chars=1 << 24)
+
+
+def run_request(
+    operation_names: tuple[str, ...],
+    letters: str,
+    text: str,
+    cache_directory: str | None = None,
+    cache_size: int = 0,
+    other: str | None = None,
+) -> tuple[int, str, str]:
+    '''
+        Exit code, stdout and stderr of one request, recent answers are cached in memory.
+    '''
+    key = recent_answers.key(operation_names, letters, text, cache_directory, cache_size, other)
+    answer = recent_answers.load(key)
+    if answer is None:
+        answer = answer_request(operation_names, letters, text, cache_directory, cache_size, other)
+        recent_answers.store(key, answer)
+    return answer
+
+
+def answer_request(
+    operation_names: tuple[str, ...],
+    letters: str,
+    text: str,
+    cache_directory: str | None,
+    cache_size: int,
+    other: str | None,
+) -> tuple[int, str, str]:
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    operations = []
+    for name in operation_names:
+        if name not in command_line_operations:
+            raise ValueError(f'unknown operation {name!r}')
+        operations.append(command_line_operations[name])
+
+    code = 1
+    if check_chain(operations, stderr):
+        value = evaluate(text, operations, letters, stderr, open_cache(cache_directory, cache_size), other)
+        if value is not None:
+            print(value.as_public_str(), file=stdout)
+            code = 0
+    return code, stdout.getvalue(), stderr.getvalue()
+
+
+def batch_items(path: str) -> typing.Iterator[tuple[str | int, str | Exception]]:
+    '''
+        (id, text) of inputs: every file of a directory in order of names with its name as id,
+        or every non-empty line of a file with its number as id.
+        A file that can't be read gives the exception instead of text.
+    '''
+    if os.path.isdir(path):
+        names = sorted(name for name in os.listdir(path) if os.path.isfile(os.path.join(path, name)))
+
+        def files() -> typing.Iterator[tuple[str | int, str | Exception]]:
+            for name in names:
+                try:
+                    yield name, pathlib.Path(path, name).read_text()
+                except Exception as e:
+                    yield name, e
+        return files()
+
+    file = open(path)
+
+    def lines() -> typing.Iterator[tuple[str | int, str | Exception]]:
+        with file:
+            for number, line in enumerate(file, 1):
+                if line.strip():
+                    yield number, line.rstrip('\n')
+    return lines()
+
+
+def run_batch(
+    items: typing.Iterable[tuple[str | int, str | Exception]],
+    operation_names: tuple[str, ...],
+    letters: str,
+    jobs: int | None,
+    timeout: float | None,
+    cache_directory: str | None = None,
+    cache_size: int = 0,
+    other: str | None = None,
+    chunk_size: int = 16,
+) -> typing.Iterator[dict[str, typing.Any]]:
+    '''
+        Converts items in worker processes and yields responses in the same format as --serve,
+        in input order.
+
+        Items are sent in chunks, at most a few chunks per worker are in flight,
+        so inputs are read and results are written while the pool works.
+        A failed item or chunk gives an error response and does not stop the others.
+        When a worker dies, the pool is replaced and every chunk lost with it is run again
+        one item at a time, an item that kills a worker on its own gets an error response.
+    '''
+    if jobs is None:
+        jobs = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    items = iter(items)
+    Chunk = list[tuple[str | int, str | Exception]]
+    Results = concurrent.futures.Future[list[tuple[int, str, str]]]
+    executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+
+    def submit(texts: list[str]) -> Results:
+        try:
+            return executor.submit(batch_worker, operation_names, letters, timeout, cache_directory, cache_size, other, texts)
+        except concurrent.futures.process.BrokenProcessPool as e:
+            future: Results = concurrent.futures.Future()
+            future.set_exception(e)
+            return future
+
+    def rerun(chunk: Chunk) -> Results:
+        nonlocal executor
+        results = []
+        for item_id, text in chunk:
+            if isinstance(text, str):
+                try:
+                    results += submit([text]).result()
+                except Exception as e:
+                    results.append((1, '', f'{e!r}\n'))
+                    if isinstance(e, concurrent.futures.process.BrokenProcessPool):
+                        executor.shutdown()
+                        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        future: Results = concurrent.futures.Future()
+        future.set_result(results)
+        return future
+
+    def is_broken(future: Results) -> bool:
+        return isinstance(future.exception(), concurrent.futures.process.BrokenProcessPool)
+
+    try:
+        pending: collections.deque[tuple[Chunk, Results]] = collections.deque()
+        while True:
+            while len(pending) < 4 * jobs and (chunk := list(itertools.islice(items, chunk_size))):
+                pending.append((chunk, submit([text for item_id, text in chunk if isinstance(text, str)])))
+            if not pending:
+                break
+            chunk, future = pending.popleft()
+            if is_broken(future):
+                # the dead worker took every unfinished chunk with it, the finished ones keep their results
+                concurrent.futures.wait([waiting_future for waiting_chunk, waiting_future in pending])
+                executor.shutdown()
+                executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+                future = rerun(chunk)
+                for index, (waiting_chunk, waiting_future) in enumerate(pending):
+                    if is_broken(waiting_future):
+                        pending[index] = waiting_chunk, rerun(waiting_chunk)
+            try:
+                results = iter(future.result())
+            except Exception as e:
+                results = itertools.repeat((1, '', f'{e!r}\n'))
+            for item_id, text in chunk:
+                code, output, error = (1, '', f'{text!r}\n') if isinstance(text, Exception) else next(results)
+                yield {'id': item_id, 'code': code, 'output': output, 'error': error}
+    finally:
+        executor.shutdown()
+
+
+def batch_worker(
+    operation_names: tuple[str, ...],
+    letters: str,
+    timeout: float | None,
+    cache_directory: str | None,
+    cache_size: int,
+    other: str | None,
+    texts: list[str],
+) -> list[tuple[int, str, str]]:
+    '''
+        Runs in a worker process, every text gets its own timeout.
+    '''
+    def on_timeout(signal_number: int, frame: typing.Any) -> None:
+        raise TimeoutError(f'input took more than {timeout} seconds')
+
+    results = []
+    for text in texts:
+        if timeout is not None:
+            signal.signal(signal.SIGALRM, on_timeout)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            results.append(run_request(operation_names, letters, text, cache_directory, cache_size, other))
+        except Exception as e:
+            results.append((1, '', f'{e!r}\n'))
+        finally:
+            if timeout is not None:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+    return results
+
+
+def nfa_value(value: fa_or_re) -> packed.PackedFA:
+    '''
+        Automaton without eps accepting the same strings as value.
+    '''
+    if value.is_fa():
+        p = packed.fa_to_packed(value.as_private_fa())
+    else:
+        p = packed.thompson(convert.regex_to_ast(value.as_private_re()))
+    return packed.remove_eps(p)
+
+
+def compile_value(value: fa_or_re) -> packed.PackedFA:
+    '''
+        Deterministic automaton accepting the same strings as value.
+    '''
+    return packed.make_deterministic(nfa_value(value))
+
+
+def fingerprint(value: fa_or_re, letters: str) -> str:
+    '''
+        Same for all values with the same language over letters.
+    '''
+    p = packed.make_min(packed.make_full(compile_value(value), letters))
+    return packed.fingerprint(p)
+
+
+def match_lines(
+    p: packed.PackedFA,
+    lines: typing.Iterable[str],
+    chunk_size: int = 1 << 14,
+) -> typing.Iterator[tuple[str, bool]]:
+    '''
+        Yields every line without trailing newline and whether p accepts it.
+
+        Reads lines lazily, chunk by chunk when numpy matcher is available.
+    '''
+    lines = iter(lines)
+    try:
+        import matcher
+    except ImportError:
+        p = packed.split_labels(p)
+        next_states: list[dict[str | None, int]] = [
+            {p.labels[label]: target for label, target in p.edges(state)}
+            for state in range(p.state_count)
+        ]
+        classify = charset.classifier(p.labels[packed.EPS + 1:]) if charset.has_sets(p.labels) else None
+        for line in lines:
+            text = line.rstrip('\n')
+            state = 0
+            for char in text:
+                state = next_states[state].get(classify(char) if classify else char, -1)
+                if state == -1:
+                    break
+            yield text, state != -1 and p.is_final(state)
+        return
+
+    yield from match_chunks(matcher.compile_packed_dfa(p), lines, chunk_size)
+
+
+def match_binary_lines(
+    b: binary.binary_fa,
+    lines: typing.Iterable[str],
+    chunk_size: int = 1 << 14,
+) -> typing.Iterator[tuple[str, bool]]:
+    '''
+        Same as match_lines for a deterministic automaton in binary format,
+        the numpy matcher uses its table without copying.
+    '''
+    try:
+        import matcher
+    except ImportError:
+        yield from match_lines(b.to_packed(), lines)
+        return
+    yield from match_chunks(matcher.compile_binary_dfa(b), lines, chunk_size)
+
+
+def match_chunks(
+    compiled: typing.Any,
+    lines: typing.Iterable[str],
+    chunk_size: int,
+    max_chars: int = 1 << 22,
+) -> typing.Iterator[tuple[str, bool]]:
+    '''
+        Matches chunks of at most chunk_size lines and max_chars chars, a longer line is a chunk of its own.
+    '''
+    chunk: list[str] = []
+    chars = 0
+    for line in lines:
+        text = line.rstrip('\n')
+        if chunk and chars + len(text) > max_chars:
+            yield from zip(chunk, compiled.match(chunk).tolist())
+            chunk = []
+            chars = 0
+        chunk.append(text)
+        chars += len(text)
+        if len(chunk) == chunk_size:
+            yield from zip(chunk, compiled.match(chunk).tolist())
+            chunk = []
+            chars = 0
+    if chunk:
+        yield from zip(chunk, compiled.match(chunk).tolist())
+
+
+def lazy_match_lines(p: packed.PackedFA, lines: typing.Iterable[str]) -> typing.Iterator[tuple[str, bool]]:
+    '''
+        Same as match_lines for p without eps, p is not determinized in advance.
+    '''
+    matcher = lazy_dfa.lazy_dfa(p)
+    for line in lines:
+        text = line.rstrip('\n')
+        yield text, matcher.match(text)
+
+
 def main(
     argv: list[str],
     stdin: typing.IO[str],
     stdout: typing.IO[str],
     stderr: typing.IO[str],
 ) -> int:
+    if argv[1:2] == ['--serve']:
+        return serve(argv, stdin, stdout, stderr)
     with (
             contextlib.redirect_stdout(stdout),
             contextlib.redirect_stderr(stderr),
@@ -309,7 +1095,11 @@ def make_deterministic(value: fa_or_re, letters: str) -> fa_or_re:
     return fa_or_re.from_private_fa(a, letters)
 
 
-def make_full(value: fa_or_re, letters: str) -> fa_or_re:
+def make_full(value: fa_or_re, letters: str, implicit_sink: bool = False) -> fa_or_re:
+
+    if implicit_sink:
+        a, sink = value.as_partial_fa()
+        return fa_or_re.from_private_fa(a, letters + letters[0][:0], bool(sink))
 
     a = value.as_private_fa()
 
@@ -320,7 +1110,9 @@ def make_full(value: fa_or_re, letters: str) -> fa_or_re:
 
 def minimize(value: fa_or_re, letters: str) -> fa_or_re:
 
-    a = value.as_private_fa()
+    a, sink = value.as_partial_fa()
+    if sink is not None:
+        return fa_or_re.from_private_fa(convert.make_min_partial(a, sink), letters, sink)
 
     a = convert.make_min(a)
 
@@ -329,13 +1121,43 @@ def minimize(value: fa_or_re, letters: str) -> fa_or_re:
 
 def invert(value: fa_or_re, letters: str) -> fa_or_re:
 
-    a = value.as_private_fa()
+    a, sink = value.as_partial_fa()
 
     a = convert.invert_full_fa(a)
 
+    return fa_or_re.from_private_fa(a, letters, None if sink is None else not sink)
+
+
+def canonicalize(value: fa_or_re, letters: str) -> fa_or_re:
+
+    a = value.as_private_fa()
+
+    a = convert.canonicalize(a)
+
     return fa_or_re.from_private_fa(a, letters)
 
 
+def intersect(value: fa_or_re, letters: str, other: fa_or_re) -> fa_or_re:
+
+    p = product.intersect(nfa_value(value), nfa_value(other))
+
+    return fa_or_re.from_private_fa(packed.packed_to_fa(p), letters)
+
+
+def union(value: fa_or_re, letters: str, other: fa_or_re) -> fa_or_re:
+
+    p = product.union(nfa_value(value), nfa_value(other))
+
+    return fa_or_re.from_private_fa(packed.packed_to_fa(p), letters)
+
+
+def difference(value: fa_or_re, letters: str, other: fa_or_re) -> fa_or_re:
+
+    p = product.difference(nfa_value(value), nfa_value(other))
+
+    return fa_or_re.from_private_fa(packed.packed_to_fa(p), letters)
+
+
 def eps_nfa_to_re(value: fa_or_re, letters: str) -> fa_or_re:
 
     a = value.as_private_fa()
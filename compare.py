@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import charset
+import packed
+
+
+def next_states(p: packed.PackedFA) -> list[dict[str, tuple[int, ...]]]:
+    '''
+        Targets of every state by label text, p must have no eps.
+    '''
+    assert not p.has_eps()
+    res = []
+    for state in range(p.state_count):
+        targets_by_label: dict[str, dict[int, None]] = {}
+        for label, target in p.edges(state):
+            targets_by_label.setdefault(p.labels[label], {})[target] = None
+        res.append({label: tuple(sorted(targets)) for label, targets in targets_by_label.items()})
+    return res
+
+
+class subsets:
+    '''
+        Subset construction of p done lazily, one subset at a time.
+    '''
+
+    def __init__(self, p: packed.PackedFA) -> None:
+        self.p = p
+        self.next_states = next_states(p)
+        self.cache: dict[tuple[int, ...], dict[str, tuple[int, ...]]] = {}
+
+    def is_final(self, subset: tuple[int, ...]) -> bool:
+        return any(self.p.is_final(state) for state in subset)
+
+    def next(self, subset: tuple[int, ...]) -> dict[str, tuple[int, ...]]:
+        res = self.cache.get(subset)
+        if res is None:
+            if len(subset) == 1:
+                res = self.next_states[subset[0]]
+            else:
+                parts_by_label: dict[str, set[int]] = {}
+                for state in subset:
+                    for label, targets in self.next_states[state].items():
+                        parts_by_label.setdefault(label, set()).update(targets)
+                res = {label: tuple(sorted(part)) for label, part in parts_by_label.items()}
+            self.cache[subset] = res
+        return res
+
+
+def word(steps: list[tuple[int, str]], index: int) -> str:
+    '''
+        Chars on the path to steps[index], every step is (previous index, label),
+        a set of chars gives its first char.
+    '''
+    labels = []
+    while index:
+        index, label = steps[index]
+        labels.append(charset.example(label))
+    return ''.join(reversed(labels))
+
+
+def equivalence_counterexample(a: packed.PackedFA, b: packed.PackedFA) -> str | None:
+    '''
+        Hopcroft-Karp: pairs of subsets of a and b are explored in bfs order
+        and merged by union-find, a pair is skipped when it is already merged.
+
+        a and b must have no eps. Returns a shortest word accepted by only one of them,
+        None if they accept the same words.
+    '''
+    a, b = packed.split_labels(a, b.labels[packed.EPS + 1:]), packed.split_labels(b, a.labels[packed.EPS + 1:])
+    sides = subsets(a), subsets(b)
+    parents: dict[tuple[int, tuple[int, ...]], tuple[int, tuple[int, ...]]] = {}
+
+    def find(key: tuple[int, tuple[int, ...]]) -> tuple[int, tuple[int, ...]]:
+        while (parent := parents.setdefault(key, key)) != key:
+            parents[key] = parents.setdefault(parent, parent)
+            key = parents[key]
+        return key
+
+    start: tuple[int, ...] = (0,)
+    pairs = [(start, start)]
+    steps = [(0, '')]
+    if sides[0].is_final(start) != sides[1].is_final(start):
+        return ''
+    parents[0, start] = 1, start
+
+    for index, (x, y) in enumerate(pairs):
+        next_x = sides[0].next(x)
+        next_y = sides[1].next(y)
+        for label in sorted(next_x.keys() | next_y.keys()):
+            new_x = next_x.get(label, ())
+            new_y = next_y.get(label, ())
+            x_root = find((0, new_x))
+            y_root = find((1, new_y))
+            if x_root == y_root:
+                continue
+            pairs.append((new_x, new_y))
+            steps.append((index, label))
+            if sides[0].is_final(new_x) != sides[1].is_final(new_y):
+                return word(steps, len(steps) - 1)
+            parents[x_root] = y_root
+    return None
+
+
+def inclusion_counterexample(a: packed.PackedFA, b: packed.PackedFA) -> str | None:
+    '''
+        Antichain algorithm: pairs of a state of a and a subset of b are explored in bfs order,
+        a pair is skipped when a pair with the same state and a smaller subset was seen.
+
+        a and b must have no eps. Returns a shortest word accepted by a and not by b,
+        None if every word accepted by a is accepted by b.
+    '''
+    a, b = packed.split_labels(a, b.labels[packed.EPS + 1:]), packed.split_labels(b, a.labels[packed.EPS + 1:])
+    next_a = next_states(a)
+    side = subsets(b)
+    seen: dict[int, list[frozenset[int]]] = {}
+
+    def is_new(state: int, subset: tuple[int, ...]) -> bool:
+        items = frozenset(subset)
+        antichain = seen.setdefault(state, [])
+        if any(other <= items for other in antichain):
+            return False
+        antichain[:] = [other for other in antichain if not items <= other]
+        antichain.append(items)
+        return True
+
+    start: tuple[int, ...] = (0,)
+    pairs = [(0, start)]
+    steps = [(0, '')]
+    if a.is_final(0) and not side.is_final(start):
+        return ''
+    is_new(0, start)
+
+    for index, (state, subset) in enumerate(pairs):
+        next_subsets = side.next(subset)
+        for label, targets in sorted(next_a[state].items()):
+            new_subset = next_subsets.get(label, ())
+            for target in targets:
+                if not is_new(target, new_subset):
+                    continue
+                pairs.append((target, new_subset))
+                steps.append((index, label))
+                if a.is_final(target) and not side.is_final(new_subset):
+                    return word(steps, len(steps) - 1)
+    return None
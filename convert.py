@@ -1,109 +1,60 @@
 import typing
-import ast
+import heapq
 from copy import deepcopy as cp
 from collections import defaultdict as dd
 
 from utils import debug
 import fa
+import packed
+import charset
+import regex_parser
+import regex_term
 
 
-def regex_to_ast(a: str) -> ast.AST:
-    expr = ast.parse(a).body[0]
-    assert isinstance(expr, ast.Expr)
-    return expr.value
-
-
-def ast_to_eps_nfa(a: ast.AST) -> fa.FA:
-    this = ast_to_eps_nfa
-    if isinstance(a, ast.BinOp):
-        if isinstance(a.op, ast.Add):
-            return this(a.left) + this(a.right)
-        if isinstance(a.op, ast.Mult):
-            return this(a.left) * this(a.right)
-        if isinstance(a.op, ast.Pow):
-            if isinstance(a.right, ast.Constant):
-                if isinstance(a.right.value, int):
-                    return this(a.left) ** a.right.value
-                if a.right.value is None:
-                    return ~this(a.left)
-    elif isinstance(a, ast.Name):
-        return fa.FA(a.id)
-    elif isinstance(a, ast.Constant):
-        if isinstance(a.value, int):
-            return fa.FA([None, ''][a.value])
-    assert False
+def regex_to_ast(a: str) -> regex_parser.regex_ast:
+    return regex_parser.parse(a)
 
 
-def remove_eps(fa: fa.FA) -> fa.FA:
-    fa = cp(fa)
-    fa.the_only_final_if_exists_or_unrelated_node.is_final = True
-    for root in fa.start.bfs():
-        for node in root.bfs(eps_only=True):
-            root.is_final |= node.is_final
-            for label, next_nodes in node.next_nodes_by_label.items():
-                root.next_nodes_by_label[label] |= next_nodes
-    for root in fa.start.bfs():
-        if '' in root.next_nodes_by_label:
-            del root.next_nodes_by_label['']
-    return fa
-
-
-def make_deterministic(old_fa: fa.FA) -> fa.FA:
-    old_fa = cp(old_fa)
-    new_fa = fa.FA()
-
-    new_to_old: dd[fa.Node, set[fa.Node]] = dd(set)
-    old_to_new: dd[frozenset[fa.Node], fa.Node] = dd(fa.Node)
-
-    new_to_old[new_fa.start] = {old_fa.start}
+def ast_to_eps_nfa(a: regex_parser.regex_ast) -> fa.FA:
+    return packed.packed_to_fa(packed.thompson(a))
 
-    for new_node in new_fa.start.bfs():
 
-        for old_node in new_to_old[new_node]:
+def postfix_to_fa(postfix: list[regex_parser.Term]) -> fa.FA:
+    '''
+        Thompson construction by fa.FA operators, two nodes per name.
+        Slower than ast_to_eps_nfa, tests and benchmark.py compare packed.thompson with it.
+    '''
+    stack: list[fa.FA] = []
+    for op, arg in postfix:
+        if op == 'name':
+            stack.append(fa.FA(arg))
+        elif op == 'const':
+            stack.append(fa.FA([None, ''][arg]))
+        elif op == '**':
+            stack.append(~stack.pop() if arg is None else stack.pop() ** arg)
+        else:
+            right = stack.pop()
+            stack.append(stack.pop() + right if op == '+' else stack.pop() * right)
+    return stack.pop()
 
-            new_node.is_final |= old_node.is_final
 
-            for label, next_nodes_by_label in old_node.next_nodes_by_label.items():
-                new_node.next_nodes_by_label[label] |= next_nodes_by_label
-
-        for label, next_nodes_by_label in new_node.next_nodes_by_label.items():
+def remove_eps(fa: fa.FA) -> fa.FA:
+    return packed.packed_to_fa(packed.remove_eps(packed.fa_to_packed(fa)))
 
-            old_node = old_to_new[frozenset(next_nodes_by_label)]
-            new_node.next_nodes_by_label[label] = {old_node}
-            new_to_old[old_node] = set(next_nodes_by_label)
 
-    return new_fa
+def make_deterministic(old_fa: fa.FA) -> fa.FA:
+    return packed.packed_to_fa(packed.make_deterministic(packed.fa_to_packed(old_fa)))
 
 
 def make_full(a: fa.FA, labels: str) -> fa.FA:
-    a = cp(a)
-    new = fa.Node()
-    for n in a.start.bfs():
-        for l in labels:
-            if not n.next_nodes_by_label[l]:
-                n >> l >> new
-    return a
+    return packed.packed_to_fa(packed.make_full(packed.fa_to_packed(a), labels))
 
 
 def make_min(a: fa.FA) -> fa.FA:
-    a = cp(a)
-    labels: list[str] = list(a.start.next_nodes_by_label)
-    old_node_to_group_save: dict[fa.Node, int] = {}
-    old_node_to_group: dict[fa.Node, int] = {
-        n: int(n.is_final)
-        for n in a.start.bfs()
-    }
-    uniq_nums: dd[tuple[int, ...], int] = dd(lambda: len(uniq_nums))
-    while old_node_to_group_save != old_node_to_group:
-        uniq_nums.clear()
-        old_node_to_group_save = dict(old_node_to_group)
-        old_node_to_group.clear()
-        for n in a.start.bfs():
-            next_groups = [old_node_to_group_save[n]]
-            for l in labels:
-                for nn in n.next_nodes_by_label[l]:
-                    next_groups.append(old_node_to_group_save[nn])
-            old_node_to_group[n] = uniq_nums[tuple(next_groups)]
+    p, old_nodes = packed.fa_to_packed_and_nodes(a)
+    if charset.has_sets(p.labels):
+        return packed.packed_to_fa(packed.make_min(p))
+    old_node_to_group = dict(zip(old_nodes, packed.min_partition(p)))
     group_to_old_node = {g: n for n, g in old_node_to_group.items()}
     s = fa.FA()
     group_to_new_node = dd(fa.Node)
@@ -119,10 +70,18 @@ def make_min(a: fa.FA) -> fa.FA:
                 new_n >> l >> nnn
                 new_node_to_group[nnn] = group
     for n, g in old_node_to_group.items():
-        group_to_new_node[g].is_final |= n.is_final
+        group_to_new_node[g].is_final |= a.is_final(n)
     return s
 
 
+def make_min_partial(a: fa.FA, sink_is_final: bool) -> fa.FA:
+    return packed.packed_to_fa(packed.make_min_partial(packed.fa_to_packed(a), sink_is_final))
+
+
+def expand_sink(a: fa.FA, labels: str, sink_is_final: bool) -> fa.FA:
+    return packed.packed_to_fa(packed.expand_sink(packed.fa_to_packed(a), labels, sink_is_final))
+
+
 def invert_full_fa(a: fa.FA) -> fa.FA:
     a = cp(a)
     for n in a.start.bfs():
@@ -130,221 +89,86 @@ def invert_full_fa(a: fa.FA) -> fa.FA:
     a.the_only_final_if_exists_or_unrelated_node = fa.Node()
     return a
 
-def merge(lopl: int, left: str, midop: str, midopl: int, ropl: int, right: str) -> tuple[int, str]:
-    if midop == '+':
-
-        if left == '0':
-            return ropl, right
-        if right == '0':
-            return lopl, left
-
-        if left == right:
-            return lopl, left
-
-        if lopl < midopl:
-            left = '(' + left + ')'
-        if ropl < midopl:
-            right = '(' + right + ')'
-
-        if left < right:
-            return midopl, left + midop + right
-        if left > right:
-            return midopl, right + midop + left
-
-    elif midop == '*':
-
-        if left == '1':
-            return ropl, right
-        if right == '1':
-            return lopl, left
-
-        if left == '0':
-            return fa.operator_level[''], '0'
-        if right == '0':
-            return fa.operator_level[''], '0'
-
-        if lopl < midopl:
-            left = '(' + left + ')'
-        if ropl < midopl:
-            right = '(' + right + ')'
-
-        return midopl, left + midop + right
-
-    assert False
-
-def inf_pow(lopl: int, left: str) -> tuple[int, str]:
-    if left in '01':
-        return fa.operator_level[''], '1'
-    midopl = fa.operator_level['**']
-    if lopl == midopl:
-        return lopl, left
-    return midopl, '(' + left + ')**None'
+def canonicalize(a: fa.FA) -> fa.FA:
+    return packed.packed_to_fa(packed.canonicalize(packed.fa_to_packed(a)))
 
 
 def fa_to_re(a: fa.FA) -> str:
-    a = cp(a)
-
-    a = fa.FA() + a
-
-    a.the_only_final_if_exists_or_unrelated_node.is_final = True
-
-    a.the_only_final_if_exists_or_unrelated_node = fa.Node()
-
-    a.the_only_final_if_exists_or_unrelated_node.is_final = True
-
-    # print(f'{a.the_only_final_if_exists_or_unrelated_node = }', file=debug)
-
-    for node in a.start.bfs():
-        if node.is_final and node is not a.the_only_final_if_exists_or_unrelated_node:
-            node.is_final = False
-            node.next_nodes_by_label[''] |= {a.the_only_final_if_exists_or_unrelated_node}
-    
-    nodes = {*a.start.bfs()}
-
-    if a.the_only_final_if_exists_or_unrelated_node not in nodes:
+    '''
+        State elimination over packed states of a with new start and final.
+
+        Only states on some path from start to final are eliminated,
+        next goes the state whose elimination adds the least regex length,
+        edges are updated only between its actual in and out neighbours.
+        Ties go to the strongly connected component closer to start, then to the lower state.
+    '''
+    p = packed.fa_to_packed(a)
+    start = p.state_count
+    final = p.state_count + 1
+    terms = regex_term.term_table()
+    label_terms = [terms.one, *map(terms.name, p.labels[packed.EPS + 1:])]
+
+    regex_by_target: list[dict[int, regex_term.regex_term]] = [{} for state in range(p.state_count + 2)]
+    sources: list[dict[int, None]] = [{} for state in range(p.state_count + 2)]
+
+    def add(i: int, j: int, regex: regex_term.regex_term) -> None:
+        regex_by_target[i][j] = terms.plus(regex_by_target[i].get(j, terms.zero), regex)
+        sources[j][i] = None
+
+    add(start, 0, terms.one)
+    for state in range(p.state_count):
+        for label, target in p.edges(state):
+            add(state, target, label_terms[label])
+        if p.is_final(state):
+            add(state, final, terms.one)
+
+    useful = {final}
+    queue = [final]
+    for state in queue:
+        for source in sources[state]:
+            if source not in useful:
+                useful.add(source)
+                queue.append(source)
+    if start not in useful:
         return '0'
-
-    assert a.the_only_final_if_exists_or_unrelated_node in nodes
-
-    for node in nodes:
-        assert node is a.the_only_final_if_exists_or_unrelated_node and node.is_final or not node.is_final
-
-    # now a.the_only_final_if_exists_or_unrelated_node is indeed the only final and not unrelated
-
-    for node in a.start.bfs():
-        for label, next_nodes in node.next_nodes_by_label.items():
-            ltext = '1' if label == '' else label
-            for next_node in next_nodes:
-                node.regex_by_next_node[next_node] = merge(
-                    *node.regex_by_next_node[next_node],
-                    '+', fa.operator_level['+'],
-                    fa.constant_op_level,
-                    ltext,
-                )
-
-    # print(f'{a.the_only_final_if_exists_or_unrelated_node = }', file=debug)
-
-    while 1:
-        nodes = {*a.start.bfs()}
-        # print(nodes, file=debug)
-        # for node in nodes:
-            # for next_node, re in node.regex_by_next_node.items():
-                # print(f'{node} -> {re} -> {next_node}', file=debug)
-        
-        assert a.start in nodes
-        assert a.the_only_final_if_exists_or_unrelated_node in nodes
-        assert a.the_only_final_if_exists_or_unrelated_node is not a.start
-
-        assert len(nodes) >= 2
-
-        if len(nodes) == 2:
-            break
-
-        for q in nodes - {a.start, a.the_only_final_if_exists_or_unrelated_node}:
-
-
-            loop = inf_pow(*q.regex_by_next_node[q])
-            # if q.regex_by_next_node[q] == '0':
-            #     loop = '1'
-            # elif q.regex_by_next_node[q] == '1':
-            #     loop = '1'
-            # else:
-            #     loop = f'({q.regex_by_next_node[q]}**None)'
-
-            for i in nodes - {q}:
-                for j in nodes - {q}:
-                    ij = i.regex_by_next_node[j]
-                    iq = i.regex_by_next_node[q]
-                    qj = q.regex_by_next_node[j]
-                    i.regex_by_next_node[j] = merge(
-                        *merge(
-                            *merge(
-                                *iq,
-                                '*',
-                                fa.operator_level['*'],
-                                *loop,
-                            ),
-                            '*',
-                            fa.operator_level['*'],
-                            *qj,
-                        ),
-                        '+',
-                        fa.operator_level['+'],
-                        *ij,
-                    )
-                    i.next_nodes_by_label['--'] |= {j}
-
-
-                    # if '0' in [iq, loop, qj]:
-                    #     res = ij
-                    # elif ij == '0':
-                    #     if iq == loop == '1':
-                    #         res = qj
-                    #     elif iq == qj == '1':
-                    #         res = loop
-                    #     elif loop == qj == '1':
-                    #         res = iq
-                    #     elif iq == '1':
-                    #         res = f'({loop}*{qj})'
-                    #     elif loop == '1':
-                    #         res = f'({iq}*{qj})'
-                    #     elif qj == '1':
-                    #         res = f'({iq}*{loop})'
-                    #     else:
-                    #         res = f'({iq}*{loop}*{qj})'
-                    # else:
-                    #     if iq == loop == '1':
-                    #         if ij < qj:
-                    #             res = f'({ij}+{qj})'
-                    #         elif ij > qj:
-                    #             res = f'({qj}+{ij})'
-                    #         else:
-                    #             res = f'{qj}'
-                    #     elif iq == qj == '1':
-                    #         if ij < loop:
-                    #             res = f'({ij}+{loop})'
-                    #         elif ij > loop:
-                    #             res = f'({loop}+{ij})'
-                    #         else:
-                    #             res = f'{loop}'
-                    #     elif loop == qj == '1':
-                    #         if ij < iq:
-                    #             res = f'({ij}+{iq})'
-                    #         elif ij > iq:
-                    #             res = f'({iq}+{ij})'
-                    #         else:
-                    #             res = f'{iq}'
-                    #     elif iq == '1':
-                    #         res = f'({ij}+{loop}*{qj})'
-                    #     elif loop == '1':
-                    #         res = f'({ij}+{iq}*{qj})'
-                    #     elif qj == '1':
-                    #         res = f'({ij}+{iq}*{loop})'
-                    #     else:
-                    #         res = f'({ij}+{iq}*{loop}*{qj})'
-                    # # print(f'{ij = !r} + {iq = !r} * {loop = !r} * {qj = !r} -> {res = !r}', file=debug)
-                    # i.regex_by_next_node[j] = res
-                    # # f'({i.regex_by_next_node[j]}+{i.regex_by_next_node[q]}*{loop}*{q.regex_by_next_node[j]})'
-                    # i.next_nodes_by_label['--'] |= {j}
-
-            for node in nodes - {q}:
-
-                for label, next_nodes in node.next_nodes_by_label.items():
-                    next_nodes.discard(q)
-
-                node.regex_by_next_node[q] = fa.operator_level[''], '0'
-
-    nodes = {*a.start.bfs()}
-    
-    assert a.start in nodes
-    assert a.the_only_final_if_exists_or_unrelated_node in nodes
-    assert a.the_only_final_if_exists_or_unrelated_node is not a.start
-
-    assert len(nodes) == 2
-
-    return a.start.regex_by_next_node[a.the_only_final_if_exists_or_unrelated_node][1]
-
-
-
-
-
+    for state in useful:
+        regex_by_target[state] = {j: regex for j, regex in regex_by_target[state].items() if j in useful}
+
+    def weight(q: int) -> int:
+        '''
+            Growth of total regex length when q is eliminated.
+        '''
+        in_lengths = [regex_by_target[i][q].length for i in sources[q] if i != q]
+        out_lengths = [regex.length for j, regex in regex_by_target[q].items() if j != q]
+        loop_length = regex_by_target[q][q].length if q in sources[q] else 0
+        return (
+            sum(in_lengths) * (len(out_lengths) - 1)
+            + sum(out_lengths) * (len(in_lengths) - 1)
+            + loop_length * (len(in_lengths) * len(out_lengths) - 1)
+        )
+
+    component = packed.components(p, False)[0]
+    remaining = {q for q in range(p.state_count) if q in useful}
+    heap = [(weight(q), -component[q], q) for q in remaining]
+    heapq.heapify(heap)
+    while heap:
+        cost, number, q = heapq.heappop(heap)
+        if q not in remaining or cost != weight(q):
+            continue
+        remaining.remove(q)
+
+        loop = terms.star(regex_by_target[q].pop(q, terms.zero))
+        sources[q].pop(q, None)
+        for i in sources[q]:
+            iq_loop = terms.times(regex_by_target[i].pop(q), loop)
+            for j, qj in regex_by_target[q].items():
+                add(i, j, terms.times(iq_loop, qj))
+        for j in regex_by_target[q]:
+            sources[j].pop(q)
+        for neighbour in [*sources[q], *regex_by_target[q]]:
+            if neighbour in remaining:
+                heapq.heappush(heap, (weight(neighbour), -component[neighbour], neighbour))
+        regex_by_target[q] = {}
+        sources[q] = {}
+
+    return regex_term.render(regex_by_target[start].get(final, terms.zero))
@@ -1,13 +1,12 @@
 from __future__ import annotations
-from copy import deepcopy as cp
-import operator
-import functools
 import collections
 from collections import defaultdict as dd
 import typing
 import io
 from dataclasses import dataclass
 
+import charset
+
 constant_op_level = 3
 pow_op_level = 2
 mul_op_level = 1
@@ -146,9 +145,30 @@ class FA:
     def __pow__(self: FA, other: int) -> FA:
         '''
             returns new FA, self is not invalidated.
-        '''
-        return functools.reduce(operator.mul,
-                                map(lambda x: cp(x), [self] * other), FA(''))
+
+            self is indexed by one bfs, then every copy is stamped from the index.
+        '''
+        nodes = [*self.start.bfs()]
+        index = {node: i for i, node in enumerate(nodes)}
+        edges = [
+            (index[node], label, index[next_node])
+            for node in nodes
+            for label, next_nodes in node.next_nodes_by_label.items()
+            for next_node in next_nodes
+        ]
+        final = index.get(self.the_only_final_if_exists_or_unrelated_node)
+
+        res = FA('')
+        for i in range(other):
+            copy = [Node() for node in nodes]
+            for new_node, old_node in zip(copy, nodes):
+                new_node.is_final = old_node.is_final
+                new_node.name = old_node.name
+            for frm, label, to in edges:
+                copy[frm] >> label >> copy[to]
+            res.the_only_final_if_exists_or_unrelated_node >> '' >> copy[0]
+            res.the_only_final_if_exists_or_unrelated_node = Node() if final is None else copy[final]
+        return res
 
     def __invert__(self: FA) -> FA:
         '''
@@ -204,9 +224,9 @@ def fa_to_json(fa: FA, letters: str) -> dict[str, typing.Any]:
     states: set[str] = {start_id}
     final_states: list[str] = []
     transitions: list[list[str]] = []
-    letter_set = set(letters)
+    letter_set = set(charset.letters_to_labels(letters))
 
-    # assign ids and collect states / finals
+    # ids are given to next nodes when they are first seen, that is in bfs order
     for node in fa.start.bfs():
         node_id = str(id_map[node])
         states.add(node_id)
@@ -214,9 +234,6 @@ def fa_to_json(fa: FA, letters: str) -> dict[str, typing.Any]:
         if fa.is_final(node):
             final_states.append(node_id)
 
-    # collect transitions
-    for node in fa.start.bfs():
-        node_id = str(id_map[node])
         for label, next_nodes in node.next_nodes_by_label.items():
             for next_node in next_nodes:
                 next_node_id = str(id_map[next_node])
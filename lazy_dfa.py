@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import charset
+import compare
+import packed
+
+
+class lazy_dfa:
+    '''
+        Matcher over an automaton without eps, its subsets of states get numbers
+        and transitions the first time a string reaches them.
+
+        When more than max_states subsets are known the cache is cleared.
+        If it is cleared again before as many chars as max_states were matched,
+        strings are matched by keeping the set of current states instead,
+        until 8 times as many chars were matched that way and the cache is tried again.
+
+        Sets of chars are split into disjoint atoms, a char is looked up by its atom.
+    '''
+
+    def __init__(self, p: packed.PackedFA, max_states: int = 1 << 14) -> None:
+        self.p = p = packed.split_labels(p)
+        self.next_states = compare.next_states(p)
+        self.classify = charset.classifier(p.labels[packed.EPS + 1:]) if charset.has_sets(p.labels) else None
+        self.max_states = max_states
+        self.flush_count = 0
+        self.uses_nfa = False
+        self.chars_since_flush = 0
+        self.nfa_chars = 0
+        self.flush()
+
+    def flush(self) -> None:
+        self.ids: dict[tuple[int, ...], int] = {}
+        self.subsets: list[tuple[int, ...]] = []
+        self.transitions: list[dict[str, int]] = []
+        self.finals: list[bool] = []
+        self.add((0,))
+        self.dead = self.add(())
+
+    def add(self, subset: tuple[int, ...]) -> int:
+        state = self.ids[subset] = len(self.subsets)
+        self.subsets.append(subset)
+        self.transitions.append({})
+        self.finals.append(any(self.p.is_final(s) for s in subset))
+        return state
+
+    def next_subset(self, subset: tuple[int, ...], char: str) -> tuple[int, ...]:
+        if self.classify is not None:
+            label = self.classify(char)
+            if label is None:
+                return ()
+            char = label
+        if len(subset) == 1:
+            return self.next_states[subset[0]].get(char, ())
+        targets: set[int] = set()
+        for state in subset:
+            targets.update(self.next_states[state].get(char, ()))
+        return tuple(sorted(targets))
+
+    def step(self, state: int, char: str, position: int) -> int:
+        '''
+            Number of the subset after state by char, may clear the cache.
+            position is the number of chars of the current string already matched.
+        '''
+        subset = self.next_subset(self.subsets[state], char)
+        target = self.ids.get(subset)
+        if target is not None:
+            self.transitions[state][char] = target
+            return target
+        if len(self.subsets) >= self.max_states:
+            self.flush_count += 1
+            self.uses_nfa = self.chars_since_flush + position < self.max_states
+            self.chars_since_flush = -position
+            self.nfa_chars = 0
+            self.flush()
+            target = self.ids.get(subset)
+            return self.add(subset) if target is None else target
+        target = self.transitions[state][char] = self.add(subset)
+        return target
+
+    def match(self, text: str) -> bool:
+        if self.uses_nfa:
+            self.nfa_chars += len(text)
+            if self.nfa_chars >= 8 * self.max_states:
+                self.uses_nfa = False
+                self.chars_since_flush = 0
+            return self.match_nfa((0,), text)
+        transitions = self.transitions
+        state = 0
+        for position, char in enumerate(text):
+            next_state = transitions[state].get(char)
+            if next_state is None:
+                next_state = self.step(state, char, position)
+                if self.uses_nfa:
+                    return self.match_nfa(self.subsets[next_state], text[position + 1:])
+                transitions = self.transitions
+            state = next_state
+            if state == self.dead:
+                break
+        self.chars_since_flush += len(text)
+        return self.finals[state]
+
+    def match_nfa(self, subset: tuple[int, ...], text: str) -> bool:
+        for char in text:
+            if not subset:
+                return False
+            subset = self.next_subset(subset, char)
+        return any(self.p.is_final(state) for state in subset)
@@ -0,0 +1,140 @@
+from __future__ import annotations
+import typing
+from dataclasses import dataclass
+
+import numpy as np
+import numpy.typing as npt
+
+import binary
+import fa
+import charset
+import packed
+
+
+@dataclass(frozen=True)
+class compiled_dfa:
+    '''
+        Deterministic automaton as numpy arrays.
+
+        table[state, letter] is the next state, the last state is dead:
+        missing transitions and letters out of alphabet lead to it.
+        letter_by_code[min(ord(char), len(letter_by_code) - 1)] is column of char,
+        the last column is for unknown chars.
+    '''
+    table: npt.NDArray[np.int32]
+    finals: npt.NDArray[np.bool_]
+    letter_by_code: npt.NDArray[np.int32]
+
+    def encode(self, strings: typing.Sequence[str]) -> tuple[npt.NDArray[np.int32], npt.NDArray[np.int64], npt.NDArray[np.int64]]:
+        '''
+            Sorts strings by length, longest first.
+
+            Returns letter columns of all chars grouped by step: the i-th letters of strings
+            longer than i are letters[step_offsets[i]:step_offsets[i + 1]] in sorted order,
+            then positions of strings in sorted order.
+            Nothing is padded, so memory is linear in the total length of strings.
+        '''
+        lengths = np.fromiter(map(len, strings), dtype=np.int64, count=len(strings))
+        order = np.argsort(-lengths, kind='stable')
+        sorted_lengths = lengths[order]
+
+        codes = np.frombuffer(''.join(strings).encode('utf-32-le'), dtype=np.uint32)
+        letters = self.letter_by_code[np.minimum(codes, len(self.letter_by_code) - 1)]
+
+        width = int(lengths.max(initial=0))
+        rank = np.empty(len(strings), dtype=np.int64)
+        rank[order] = np.arange(len(strings))
+        starts = np.cumsum(lengths) - lengths
+        columns = np.arange(len(codes)) - np.repeat(starts, lengths)
+
+        # strings longer than i are the first active_counts[i] in sorted order
+        active_counts = np.searchsorted(-sorted_lengths, -np.arange(width), side='left')
+        step_offsets = np.zeros(width + 1, dtype=np.int64)
+        np.cumsum(active_counts, out=step_offsets[1:])
+        steps = np.empty(len(codes), dtype=np.int32)
+        steps[step_offsets[columns] + np.repeat(rank, lengths)] = letters
+        return steps, step_offsets, order
+
+    def match(self, strings: typing.Sequence[str]) -> npt.NDArray[np.bool_]:
+        '''
+            Returns whether each string is accepted.
+
+            At step i all strings longer than i are advanced by one indexing operation,
+            the rest of a string longer than all others is stepped over char by char.
+        '''
+        steps, step_offsets, order = self.encode(strings)
+
+        width = self.table.shape[1]
+        flat_table = self.table.ravel()
+        states = np.zeros(len(strings), dtype=np.int32)
+        for step in range(len(step_offsets) - 1):
+            letters = steps[step_offsets[step]:step_offsets[step + 1]]
+            active = len(letters)
+            if active == 1:
+                # letters of the longest string are all that is left
+                state = int(states[0])
+                for letter in steps[step_offsets[step]:].tolist():
+                    state = int(flat_table[state * width + letter])
+                states[0] = state
+                break
+            states[:active] = flat_table[states[:active] * width + letters]
+
+        res = np.empty(len(strings), dtype=np.bool_)
+        res[order] = self.finals[states]
+        return res
+
+
+def compile_dfa(a: fa.FA) -> compiled_dfa:
+    '''
+        a must be deterministic.
+    '''
+    return compile_packed_dfa(packed.fa_to_packed(a))
+
+
+def compile_packed_dfa(p: packed.PackedFA) -> compiled_dfa:
+    '''
+        Edges labeled by names of more than one char can't be passed by a char, so they are dropped.
+        Sets of chars are split into disjoint atoms, every atom is a column.
+    '''
+    assert p.is_deterministic()
+    p = packed.split_labels(p)
+    letters = p.labels[packed.EPS + 1:]
+    ranges = [charset.parse(letter) for letter in letters]
+
+    dead = p.state_count
+    unknown = len(letters)
+    table = np.full((p.state_count + 1, len(letters) + 1), dead, dtype=np.int32)
+    for state in range(p.state_count):
+        for label, target in p.edges(state):
+            if ranges[label - 1] is not None:
+                table[state, label - 1] = target
+
+    finals = np.zeros(p.state_count + 1, dtype=np.bool_)
+    for state in range(p.state_count):
+        finals[state] = p.is_final(state)
+
+    return compiled_dfa(table=table, finals=finals, letter_by_code=letter_columns(letters))
+
+
+def compile_binary_dfa(b: binary.binary_fa) -> compiled_dfa:
+    '''
+        b must be deterministic, its table is used where it is without copying.
+    '''
+    assert b.is_dense
+    width = len(b.labels)
+    table = np.frombuffer(b.buffer, dtype='<i4', count=(b.state_count + 1) * width, offset=b.table_offset)
+    finals = np.zeros(b.state_count + 1, dtype=np.bool_)
+    finals[:b.state_count] = np.unpackbits(np.frombuffer(b.finals, dtype=np.uint8), count=b.state_count, bitorder='little')
+    return compiled_dfa(table=table.reshape(b.state_count + 1, width), finals=finals, letter_by_code=letter_columns(b.labels[packed.EPS + 1:]))
+
+
+def letter_columns(letters: list[str]) -> npt.NDArray[np.int32]:
+    '''
+        letter_by_code of compiled_dfa, letters must be disjoint.
+    '''
+    ranges = [charset.parse(letter) for letter in letters]
+    letter_by_code = np.full(max((high for letter_ranges in ranges for low, high in letter_ranges or ()), default=-1) + 2, len(letters), dtype=np.int32)
+    for column, letter_ranges in enumerate(ranges):
+        for low, high in letter_ranges or ():
+            letter_by_code[low:high + 1] = column
+    return letter_by_code
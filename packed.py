@@ -0,0 +1,1132 @@
+from __future__ import annotations
+import array
+import bisect
+import hashlib
+import itertools
+import json
+import typing
+from dataclasses import dataclass
+
+import fa
+import charset
+import regex_parser
+
+EPS = 0
+
+
+def new_array(values: typing.Iterable[int] = ()) -> array.array[int]:
+    return array.array('i', values)
+
+
+def bit_get(bits: bytearray, index: int) -> bool:
+    return bool(bits[index >> 3] >> (index & 7) & 1)
+
+
+def bit_set(bits: bytearray, index: int) -> None:
+    if len(bits) <= index >> 3:
+        bits.extend(bytes((index >> 3) - len(bits) + 1))
+    bits[index >> 3] |= 1 << (index & 7)
+
+
+@dataclass
+class PackedFA:
+    '''
+        Automaton with states numbered 0..state_count-1, state 0 is start.
+
+        Edges of state s are stored in edge_labels and edge_targets
+        between offsets[s] and offsets[s + 1], grouped by label.
+        Labels are indices into labels, labels[EPS] is always eps.
+        Finals are stored as a bitset.
+    '''
+    labels: list[str]
+    offsets: array.array[int]
+    edge_labels: array.array[int]
+    edge_targets: array.array[int]
+    finals: bytearray
+
+    @property
+    def state_count(self) -> int:
+        return len(self.offsets) - 1
+
+    def edges(self, state: int) -> zip[tuple[int, int]]:
+        begin = self.offsets[state]
+        end = self.offsets[state + 1]
+        return zip(self.edge_labels[begin:end], self.edge_targets[begin:end])
+
+    def is_final(self, state: int) -> bool:
+        return bit_get(self.finals, state)
+
+    def has_eps(self) -> bool:
+        return EPS in self.edge_labels
+
+    def is_deterministic(self) -> bool:
+        if self.has_eps():
+            return False
+        for state in range(self.state_count):
+            begin = self.offsets[state]
+            end = self.offsets[state + 1]
+            if len(set(self.edge_labels[begin:end])) != end - begin:
+                return False
+        return True
+
+    def table(self) -> array.array[int]:
+        '''
+            Dense transition table of deterministic automaton,
+            row of state s is table[s * len(labels):(s + 1) * len(labels)],
+            missing transitions are -1.
+        '''
+        assert self.is_deterministic()
+        width = len(self.labels)
+        res = new_array([-1]) * (self.state_count * width)
+        for state in range(self.state_count):
+            for label, target in self.edges(state):
+                res[state * width + label] = target
+        return res
+
+
+class PackedBuilder:
+    '''
+        Creates PackedFA state by state:
+        add edges of the current state, then call end_state.
+    '''
+
+    def __init__(self, labels: list[str]) -> None:
+        assert labels[EPS] == ''
+        self.labels = list(labels)
+        self.label_ids = {label: index for index, label in enumerate(self.labels)}
+        self.offsets = new_array([0])
+        self.edge_labels = new_array()
+        self.edge_targets = new_array()
+        self.finals = bytearray()
+
+    def label_id(self, label: str) -> int:
+        if label not in self.label_ids:
+            self.label_ids[label] = len(self.labels)
+            self.labels.append(label)
+        return self.label_ids[label]
+
+    def add_edge(self, label: int, target: int) -> None:
+        self.edge_labels.append(label)
+        self.edge_targets.append(target)
+
+    def end_state(self, is_final: bool) -> None:
+        if is_final:
+            bit_set(self.finals, len(self.offsets) - 1)
+        self.offsets.append(len(self.edge_targets))
+
+    def build(self) -> PackedFA:
+        state_count = len(self.offsets) - 1
+        self.finals.extend(bytes((state_count + 7) // 8 - len(self.finals)))
+        return PackedFA(
+            labels=self.labels,
+            offsets=self.offsets,
+            edge_labels=self.edge_labels,
+            edge_targets=self.edge_targets,
+            finals=self.finals,
+        )
+
+
+def fa_to_packed(a: fa.FA) -> PackedFA:
+    return fa_to_packed_and_nodes(a)[0]
+
+
+def fa_to_packed_and_nodes(a: fa.FA) -> tuple[PackedFA, list[fa.Node]]:
+    '''
+        States are numbered in the same bfs order as fa_to_json uses,
+        also returns node of every state.
+    '''
+    ids: dict[fa.Node, int] = {a.start: 0}
+    order = [a.start]
+    builder = PackedBuilder([''])
+    for node in order:
+        for label, next_nodes in node.next_nodes_by_label.items():
+            if not next_nodes:
+                continue
+            label_id = builder.label_id(label)
+            for next_node in next_nodes:
+                if next_node not in ids:
+                    ids[next_node] = len(order)
+                    order.append(next_node)
+                builder.add_edge(label_id, ids[next_node])
+        builder.end_state(a.is_final(node))
+    return builder.build(), order
+
+
+def packed_to_fa(p: PackedFA) -> fa.FA:
+    nodes = [fa.Node() for state in range(p.state_count)]
+    for state, node in enumerate(nodes):
+        node.is_final = p.is_final(state)
+        next_nodes_by_label = node.next_nodes_by_label
+        for label, target in p.edges(state):
+            next_nodes_by_label[p.labels[label]].add(nodes[target])
+    res = fa.FA()
+    res.start = nodes[0]
+    return res
+
+
+def json_to_packed(automaton: dict[str, typing.Any]) -> PackedFA:
+    start_states = automaton["start_states"]
+    assert len(start_states) == 1
+
+    final_states = set(automaton["final_states"])
+
+    next_states: dict[str, dict[str, dict[str, None]]] = {}
+    for frm, letter, to in automaton["transition_function"]:
+        next_states.setdefault(frm, {}).setdefault(letter, {})[to] = None
+
+    ids = {start_states[0]: 0}
+    order = [start_states[0]]
+    builder = PackedBuilder([''])
+    for name in order:
+        for label, targets in next_states.get(name, {}).items():
+            label_id = builder.label_id(label)
+            for target in targets:
+                if target not in ids:
+                    ids[target] = len(order)
+                    order.append(target)
+                builder.add_edge(label_id, ids[target])
+        builder.end_state(name in final_states)
+    return builder.build()
+
+
+def packed_to_json(p: PackedFA, letters: str) -> dict[str, typing.Any]:
+    '''
+        Same output as fa.fa_to_json(packed_to_fa(p), letters).
+    '''
+    ids = {0: 1}
+    order = [0]
+    final_states: list[str] = []
+    transitions: list[list[str]] = []
+    letter_set = set(charset.letters_to_labels(letters))
+
+    for state in order:
+        state_id = str(ids[state])
+        if p.is_final(state):
+            final_states.append(state_id)
+        for label, target in p.edges(state):
+            if target not in ids:
+                ids[target] = len(order) + 1
+                order.append(target)
+            transitions.append([state_id, p.labels[label], str(ids[target])])
+            if label != EPS:
+                letter_set.add(p.labels[label])
+
+    return {
+        "states": sorted(str(state_id) for state_id in ids.values()),
+        "letters": sorted(letter_set),
+        "transition_function": transitions,
+        "start_states": ['1'],
+        "final_states": final_states,
+    }
+
+
+def text_order(count: int) -> typing.Iterator[int]:
+    '''
+        Numbers from 1 to count in order of their decimal strings.
+    '''
+    number = 1
+    for index in range(count):
+        yield number
+        if number * 10 <= count:
+            number *= 10
+        else:
+            if number >= count:
+                number //= 10
+            number += 1
+            while number % 10 == 0:
+                number //= 10
+
+
+def write_json(p: PackedFA, letters: str, file: typing.IO[str], compact: bool = False) -> None:
+    '''
+        Writes packed_to_json(p, letters) with all lists sorted, as frozen_fa in command.py prints it:
+        the same text as json.dumps with indent=4, or without whitespace if compact.
+
+        State of number s has id s + 1, states are visited once in order of their ids as strings,
+        so nothing but edges of one state is kept in memory.
+    '''
+    newline = '' if compact else '\n'
+    colon = ':' if compact else ': '
+
+    def indent(depth: int) -> str:
+        return '' if compact else '    ' * depth
+
+    def write_list(key: str, items: typing.Iterable[str], is_last: bool = False) -> None:
+        file.write(f'{indent(1)}"{key}"{colon}[')
+        separator = ',' + newline + indent(2)
+        items = iter(items)
+        is_empty = True
+        # items are joined in chunks, one write call per item is slow
+        while chunk := list(itertools.islice(items, 1 << 12)):
+            file.write((newline + indent(2) if is_empty else separator) + separator.join(chunk))
+            is_empty = False
+        if not is_empty:
+            file.write(newline + indent(1))
+        file.write(']' + ('' if is_last else ',') + newline)
+
+    def transitions() -> typing.Iterator[str]:
+        inner = ',' + newline + indent(3)
+        for state_id in text_order(p.state_count):
+            edges = sorted((p.labels[label], str(target + 1)) for label, target in p.edges(state_id - 1))
+            for label, target_id in edges:
+                items = inner.join([f'"{state_id}"', json.dumps(label), f'"{target_id}"'])
+                yield f'[{newline}{indent(3)}{items}{newline}{indent(2)}]'
+
+    labels = set(charset.letters_to_labels(letters)) | {p.labels[label] for label in set(p.edge_labels) if label != EPS}
+
+    file.write('{' + newline)
+    write_list('states', (f'"{state_id}"' for state_id in text_order(p.state_count)))
+    write_list('letters', map(json.dumps, sorted(labels)))
+    write_list('transition_function', transitions())
+    write_list('start_states', ['"1"'])
+    write_list('final_states', (f'"{state_id}"' for state_id in text_order(p.state_count) if p.is_final(state_id - 1)), is_last=True)
+    file.write('}')
+
+
+def split_labels(p: PackedFA, other_labels: typing.Iterable[str] = ()) -> PackedFA:
+    '''
+        Replaces labels that are sets of chars by disjoint atoms, see charset.split,
+        other_labels are split with them. Returns p when there are no sets.
+    '''
+    other_labels = list(other_labels)
+    if not charset.has_sets(p.labels) and not charset.has_sets(other_labels):
+        return p
+    atoms = charset.split([*p.labels[EPS + 1:], *other_labels])
+    builder = PackedBuilder([''])
+    new_labels = [[EPS]] + [[builder.label_id(atom) for atom in atoms[label]] for label in p.labels[EPS + 1:]]
+    for state in range(p.state_count):
+        targets_by_label: dict[int, dict[int, None]] = {}
+        for label, target in p.edges(state):
+            for new_label in new_labels[label]:
+                targets_by_label.setdefault(new_label, {})[target] = None
+        for label, targets in targets_by_label.items():
+            for target in targets:
+                builder.add_edge(label, target)
+        builder.end_state(p.is_final(state))
+    return builder.build()
+
+
+def merge_labels(p: PackedFA) -> PackedFA:
+    '''
+        Joins chars leading from a state to the same target into one label.
+        Returns p when there are no sets.
+    '''
+    if not charset.has_sets(p.labels):
+        return p
+    ranges = [charset.parse(label) for label in p.labels]
+    builder = PackedBuilder([''])
+    for state in range(p.state_count):
+        ranges_by_target: dict[int, charset.Ranges] = {}
+        names: list[tuple[int, int]] = []
+        for label, target in p.edges(state):
+            label_ranges = ranges[label]
+            if label == EPS or label_ranges is None:
+                names.append((label, target))
+            else:
+                ranges_by_target[target] = charset.union(ranges_by_target.get(target, ()), label_ranges)
+        for label, target in names:
+            builder.add_edge(builder.label_id(p.labels[label]), target)
+        labels_and_targets = sorted((builder.label_id(charset.format_ranges(target_ranges)), target) for target, target_ranges in ranges_by_target.items())
+        for label, target in labels_and_targets:
+            builder.add_edge(label, target)
+        builder.end_state(p.is_final(state))
+    return builder.build()
+
+
+def thompson_sizes(postfix: list[regex_parser.Term]) -> tuple[int, int]:
+    '''
+        Numbers of states and edges thompson creates for postfix.
+    '''
+    ids, starts, sizes = term_ids(postfix)
+    return sizes[ids[-1]]
+
+
+def term_ids(postfix: list[regex_parser.Term]) -> tuple[list[int], list[int], list[tuple[int, int]]]:
+    '''
+        For every position of postfix returns id of the term ending there,
+        equal terms get equal ids, and position where this term starts.
+        Also returns numbers of states and edges thompson creates for every id.
+    '''
+    ids: dict[tuple[typing.Any, ...], int] = {}
+    sizes: list[tuple[int, int]] = []
+    res: list[int] = []
+    starts: list[int] = []
+    # (id, start position) of every term
+    stack: list[tuple[int, int]] = []
+    for position, (op, arg) in enumerate(postfix):
+        if op in ('name', 'const'):
+            key: tuple[typing.Any, ...] = (op, arg)
+            start = position
+        elif op in ('+', '*'):
+            right_id = stack.pop()[0]
+            left_id, start = stack.pop()
+            key = (op, left_id, right_id)
+        else:
+            child_id, start = stack.pop()
+            key = (op, arg, child_id)
+
+        term_id = ids.get(key)
+        if term_id is None:
+            term_id = ids[key] = len(sizes)
+            if op == 'name':
+                sizes.append((2, 1))
+            elif op == 'const':
+                sizes.append((2, arg))
+            elif op in ('+', '*'):
+                left_states, left_edges = sizes[left_id]
+                right_states, right_edges = sizes[right_id]
+                sizes.append((left_states + right_states, left_edges + right_edges + (2 if op == '+' else 1)))
+            else:
+                states, edges = sizes[child_id]
+                if arg is None:
+                    sizes.append((states + 2, edges + 4))
+                elif arg == 0:
+                    sizes.append((states + 2, edges + 1))
+                else:
+                    sizes.append((states * arg + 2, edges * arg + arg + 1))
+
+        stack.append((term_id, start))
+        res.append(term_id)
+        starts.append(start)
+    assert len(stack) == 1
+    return res, starts, sizes
+
+
+def thompson(a: regex_parser.regex_ast) -> PackedFA:
+    '''
+        Same eps-nfa as fa.FA operators build, made without recursion.
+
+        States are numbered in creation order and edges are written into
+        arrays allocated up front. Every term owns contiguous ranges of states and edges,
+        so a term equal to an already built one is stamped from its ranges instead of built,
+        and term ** n reuses the term as the first copy and stamps the others.
+        Edges of every state keep the order the fa.FA operators add them in.
+    '''
+    postfix = a.postfix
+    ids, starts, sizes = term_ids(postfix)
+    state_count, edge_count = sizes[ids[-1]]
+    sources = new_array([0]) * edge_count
+    edge_labels = new_array([0]) * edge_count
+    targets = new_array([0]) * edge_count
+    labels = ['']
+    label_ids = {'': EPS}
+    next_state = 0
+    next_edge = 0
+
+    def add_edge(source: int, label: int, target: int) -> None:
+        nonlocal next_edge
+        sources[next_edge] = source
+        edge_labels[next_edge] = label
+        targets[next_edge] = target
+        next_edge += 1
+
+    def stamp(first_state: int, end_state: int, first_edge: int, end_edge: int) -> int:
+        '''
+            Copies states and edges of the given ranges, returns shift of state numbers.
+        '''
+        nonlocal next_state, next_edge
+        shift = next_state - first_state
+        new_end_edge = next_edge + end_edge - first_edge
+        sources[next_edge:new_end_edge] = new_array(map(shift.__add__, sources[first_edge:end_edge]))
+        edge_labels[next_edge:new_end_edge] = edge_labels[first_edge:end_edge]
+        targets[next_edge:new_end_edge] = new_array(map(shift.__add__, targets[first_edge:end_edge]))
+        next_state += end_state - first_state
+        next_edge = new_end_edge
+        return shift
+
+    # position where the longest repeated term starting at given position ends
+    repeat_ends = [-1] * len(postfix)
+    first_ends: dict[int, int] = {}
+    for end, (term_id, start) in enumerate(zip(ids, starts)):
+        if term_id in first_ends:
+            if start != end:
+                repeat_ends[start] = end
+        else:
+            first_ends[term_id] = end
+    # (first state, end state, first edge, end edge, start, final) of built terms by id
+    built: dict[int, tuple[int, int, int, int, int, int]] = {}
+
+    # (start, final, first state, first edge) of every term
+    stack: list[tuple[int, int, int, int]] = []
+    position = 0
+    while position < len(postfix):
+        if repeat_ends[position] != -1:
+            end = repeat_ends[position]
+            first_state, end_state, first_edge, end_edge, start, final = built[ids[end]]
+            term_first_state, term_first_edge = next_state, next_edge
+            shift = stamp(first_state, end_state, first_edge, end_edge)
+            stack.append((start + shift, final + shift, term_first_state, term_first_edge))
+            position = end + 1
+            continue
+
+        op, arg = postfix[position]
+        term_end_state, term_end_edge = next_state, next_edge
+        if op in ('name', 'const', '**'):
+            first_state = next_state
+            first_edge = next_edge
+            start, final = next_state, next_state + 1
+            next_state += 2
+
+        if op == 'name':
+            if arg not in label_ids:
+                label_ids[arg] = len(labels)
+                labels.append(arg)
+            add_edge(start, label_ids[arg], final)
+            stack.append((start, final, first_state, first_edge))
+        elif op == 'const':
+            if arg:
+                add_edge(start, EPS, final)
+            stack.append((start, final, first_state, first_edge))
+        elif op == '+':
+            right_start, right_final = stack.pop()[:2]
+            left_start, left_final, first_state, first_edge = stack.pop()
+            add_edge(left_start, EPS, right_start)
+            add_edge(right_final, EPS, left_final)
+            stack.append((left_start, left_final, first_state, first_edge))
+        elif op == '*':
+            right_start, right_final = stack.pop()[:2]
+            left_start, left_final, first_state, first_edge = stack.pop()
+            add_edge(left_final, EPS, right_start)
+            stack.append((left_start, right_final, first_state, first_edge))
+        elif arg is None:
+            term_start, term_final, first_state, first_edge = stack.pop()
+            add_edge(term_final, EPS, term_start)
+            add_edge(start, EPS, final)
+            add_edge(start, EPS, term_start)
+            add_edge(term_final, EPS, final)
+            stack.append((start, final, first_state, first_edge))
+        else:
+            term_start, term_final, first_state, first_edge = stack.pop()
+            add_edge(start, EPS, final)
+            if arg:
+                add_edge(final, EPS, term_start)
+                final = term_final
+            for i in range(1, arg):
+                shift = stamp(first_state, term_end_state, first_edge, term_end_edge)
+                add_edge(final, EPS, term_start + shift)
+                final = term_final + shift
+            stack.append((start, final, first_state, first_edge))
+
+        if ids[position] not in built:
+            start, final, first_state, first_edge = stack[-1]
+            built[ids[position]] = (first_state, next_state, first_edge, next_edge, start, final)
+        position += 1
+
+    assert len(stack) == 1 and next_state == state_count and next_edge == edge_count
+    start, final = stack[0][:2]
+
+    # counting sort by source keeps edges of every state in the order they were added,
+    # start and state 0 are swapped
+    offsets = new_array([0]) * (next_state + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    offsets[1], offsets[start + 1] = offsets[start + 1], offsets[1]
+    for state in range(next_state):
+        offsets[state + 1] += offsets[state]
+    positions = offsets[:-1]
+    positions[0], positions[start] = positions[start], positions[0]
+    sorted_labels = new_array([0]) * edge_count
+    sorted_targets = new_array([0]) * edge_count
+    for source, label, target in zip(sources, edge_labels, targets):
+        position = positions[source]
+        sorted_labels[position] = label
+        sorted_targets[position] = 0 if target == start else start if target == 0 else target
+        positions[source] = position + 1
+
+    finals = bytearray((next_state + 7) // 8)
+    bit_set(finals, 0 if final == start else start if final == 0 else final)
+    return PackedFA(
+        labels=labels,
+        offsets=offsets,
+        edge_labels=sorted_labels,
+        edge_targets=sorted_targets,
+        finals=finals,
+    )
+
+
+def components(p: PackedFA, eps_only: bool) -> tuple[list[int], list[list[int]]]:
+    '''
+        Strongly connected components of all edges or eps edges only by iterative Tarjan's algorithm.
+
+        Returns component of every state and states of every component,
+        components are numbered in reverse topological order.
+    '''
+    state_count = p.state_count
+    offsets = p.offsets
+    edge_labels = p.edge_labels
+    edge_targets = p.edge_targets
+
+    index = [-1] * state_count
+    low = [0] * state_count
+    component = [-1] * state_count
+    components: list[list[int]] = []
+    stack: list[int] = []
+    counter = 0
+
+    # dfs stack: state and position of its next edge to look at
+    work_states: list[int] = []
+    work_positions: list[int] = []
+
+    for root in range(state_count):
+        if index[root] != -1:
+            continue
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        work_states.append(root)
+        work_positions.append(offsets[root])
+        while work_states:
+            state = work_states[-1]
+            position = work_positions[-1]
+            end = offsets[state + 1]
+            while eps_only and position < end and edge_labels[position] != EPS:
+                position += 1
+            if position < end:
+                work_positions[-1] = position + 1
+                target = edge_targets[position]
+                if index[target] == -1:
+                    index[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    work_states.append(target)
+                    work_positions.append(offsets[target])
+                elif component[target] == -1 and index[target] < low[state]:
+                    low[state] = index[target]
+                continue
+            work_states.pop()
+            work_positions.pop()
+            if work_states and low[state] < low[work_states[-1]]:
+                low[work_states[-1]] = low[state]
+            if low[state] == index[state]:
+                members = []
+                while True:
+                    member = stack.pop()
+                    component[member] = len(components)
+                    members.append(member)
+                    if member == state:
+                        break
+                components.append(members)
+
+    return component, components
+
+
+def eps_closures(p: PackedFA, states: typing.Iterable[int]) -> dict[int, list[int]]:
+    '''
+        For every given state, states reachable from it by eps edges
+        that are final or have non-eps edges, in increasing order.
+
+        Closures are computed once per eps component in reverse topological order
+        from the closures of the components its eps edges lead to,
+        only for components reachable from the given states.
+    '''
+    offsets = p.offsets
+    edge_labels = p.edge_labels
+    edge_targets = p.edge_targets
+    component, component_members = components(p, True)
+
+    useful = [p.is_final(state) for state in range(p.state_count)]
+    for position, label in enumerate(edge_labels):
+        if label != EPS:
+            useful[bisect.bisect_right(offsets, position) - 1] = True
+
+    def successors(number: int) -> set[int]:
+        return {
+            component[edge_targets[position]]
+            for member in component_members[number]
+            for position in range(offsets[member], offsets[member + 1])
+            if edge_labels[position] == EPS
+        } - {number}
+
+    needed = {component[state] for state in states}
+    queue = list(needed)
+    for current in queue:
+        for next_component in successors(current) - needed:
+            needed.add(next_component)
+            queue.append(next_component)
+
+    # components are numbered in reverse topological order, eps edges lead to smaller numbers
+    closures: dict[int, list[int]] = {}
+    for number in sorted(needed):
+        own = [member for member in component_members[number] if useful[member]]
+        next_components = successors(number)
+        if not own and len(next_components) == 1:
+            closures[number] = closures[next_components.pop()]
+            continue
+        closure = set(own)
+        for next_component in next_components:
+            closure.update(closures[next_component])
+        closures[number] = sorted(closure)
+
+    return {state: closures[component[state]] for state in states}
+
+
+def remove_eps(p: PackedFA) -> PackedFA:
+    '''
+        States of the result are start and targets of non-eps edges of p.
+    '''
+    offsets = p.offsets
+    edge_labels = p.edge_labels
+    edge_targets = p.edge_targets
+
+    needed = {0}
+    for label, target in zip(edge_labels, edge_targets):
+        if label != EPS:
+            needed.add(target)
+    closures = eps_closures(p, needed)
+
+    ids = {0: 0}
+    order = [0]
+    builder = PackedBuilder(p.labels)
+    for state in order:
+        targets_by_label: dict[int, dict[int, None]] = {}
+        is_final = False
+        for current in closures[state]:
+            is_final |= p.is_final(current)
+            for position in range(offsets[current], offsets[current + 1]):
+                label = edge_labels[position]
+                if label != EPS:
+                    targets_by_label.setdefault(label, {})[edge_targets[position]] = None
+        for label, targets in targets_by_label.items():
+            for target in targets:
+                if target not in ids:
+                    ids[target] = len(order)
+                    order.append(target)
+                builder.add_edge(label, ids[target])
+        builder.end_state(is_final)
+    return builder.build()
+
+
+def make_deterministic(p: PackedFA) -> PackedFA:
+    '''
+        Subset construction, subsets are sorted tuples of states of p.
+
+        Sets of chars are split into disjoint atoms first and joined after.
+    '''
+    assert not p.has_eps()
+    p = split_labels(p)
+
+    targets: list[tuple[tuple[int, tuple[int, ...]], ...]] = []
+    for state in range(p.state_count):
+        targets_by_label: dict[int, list[int]] = {}
+        for label, target in p.edges(state):
+            targets_by_label.setdefault(label, []).append(target)
+        targets.append(tuple((label, tuple(sorted(set(states)))) for label, states in targets_by_label.items()))
+
+    start: tuple[int, ...] = (0,)
+    ids = {start: 0}
+    order = [start]
+    builder = PackedBuilder(p.labels)
+    for subset in order:
+        if len(subset) == 1:
+            subset_by_label = dict(targets[subset[0]])
+        else:
+            parts_by_label: dict[int, list[tuple[int, ...]]] = {}
+            for state in subset:
+                for label, states in targets[state]:
+                    parts_by_label.setdefault(label, []).append(states)
+            subset_by_label = {
+                label: parts[0] if len(parts) == 1 else tuple(sorted(set().union(*parts)))
+                for label, parts in parts_by_label.items()
+            }
+        for label, next_subset in subset_by_label.items():
+            new_state = ids.get(next_subset)
+            if new_state is None:
+                new_state = ids[next_subset] = len(order)
+                order.append(next_subset)
+            builder.add_edge(label, new_state)
+        builder.end_state(any(p.is_final(state) for state in subset))
+    return merge_labels(builder.build())
+
+
+def make_full(p: PackedFA, labels: str) -> PackedFA:
+    '''
+        labels are letters as --letters gives them, sets of chars included.
+    '''
+    if charset.has_sets(p.labels) or charset.has_sets(charset.letters_to_labels(labels)):
+        return make_full_sets(p, labels)
+    builder = PackedBuilder(p.labels)
+    label_ids = [builder.label_id(label) for label in labels]
+    sink = p.state_count
+    sink_is_used = False
+    for state in range(p.state_count):
+        present = set()
+        for label, target in p.edges(state):
+            present.add(label)
+            builder.add_edge(label, target)
+        for label in label_ids:
+            if label not in present:
+                present.add(label)
+                builder.add_edge(label, sink)
+                sink_is_used = True
+        builder.end_state(p.is_final(state))
+    if sink_is_used:
+        for label in dict.fromkeys(label_ids):
+            builder.add_edge(label, sink)
+        builder.end_state(False)
+    return builder.build()
+
+
+def letter_classes(p: PackedFA, letters: typing.Iterable[str]) -> list[list[str]]:
+    '''
+        Groups letters and labels of p that lead from every state to the same states,
+        counting states with the same final flag and edges as the same.
+        Letters of one class can be replaced by the first of them without changing the language.
+        Letters and labels must not be sets of chars: operations split and merge sets
+        into new labels that are in no class.
+
+        Classes and letters in them are in order of letters, then of labels.
+    '''
+    letters = list(letters)
+    assert not charset.has_sets(letters) and not charset.has_sets(p.labels)
+
+    # states with equal keys accept the same words
+    keys: dict[tuple[bool, tuple[tuple[int, int], ...]], int] = {}
+    state_keys = [
+        keys.setdefault((p.is_final(state), tuple(sorted(p.edges(state)))), len(keys))
+        for state in range(p.state_count)
+    ]
+
+    edges_by_label: dict[str, list[tuple[int, tuple[int, ...]]]] = {letter: [] for letter in letters}
+    for name in p.labels[EPS + 1:]:
+        edges_by_label.setdefault(name, [])
+    for state in range(p.state_count):
+        targets_by_label: dict[int, set[int]] = {}
+        for label, target in p.edges(state):
+            if label != EPS:
+                targets_by_label.setdefault(label, set()).add(state_keys[target])
+        for label, target_keys in targets_by_label.items():
+            edges_by_label[p.labels[label]].append((state, tuple(sorted(target_keys))))
+
+    classes: dict[tuple[tuple[int, tuple[int, ...]], ...], list[str]] = {}
+    for letter, edges in edges_by_label.items():
+        classes.setdefault(tuple(edges), []).append(letter)
+    return list(classes.values())
+
+
+def compress_letters(p: PackedFA, classes: list[list[str]]) -> PackedFA:
+    '''
+        Keeps edges labeled by the first letter of every class, classes must come from letter_classes.
+    '''
+    builder = PackedBuilder([''])
+    first_letters = {letters[0] for letters in classes}
+    new_labels = [builder.label_id(label) if label in first_letters else -1 for label in p.labels]
+    new_labels[EPS] = EPS
+    for state in range(p.state_count):
+        for label, target in p.edges(state):
+            if new_labels[label] != -1:
+                builder.add_edge(new_labels[label], target)
+        builder.end_state(p.is_final(state))
+    return builder.build()
+
+
+def expand_letters(p: PackedFA, classes: list[list[str]]) -> PackedFA:
+    '''
+        Inverse of compress_letters: edges labeled by the first letter of a class
+        are repeated for every letter of the class.
+    '''
+    builder = PackedBuilder([''])
+    letters_by_label: list[list[int]] = [[EPS]] + [[] for index in range(len(p.labels) - 1)]
+    for letters in classes:
+        if letters[0] in p.labels:
+            letters_by_label[p.labels.index(letters[0])] = [builder.label_id(letter) for letter in letters]
+    for state in range(p.state_count):
+        begin = p.offsets[state]
+        end = p.offsets[state + 1]
+        while begin < end:
+            label = p.edge_labels[begin]
+            group_end = begin
+            while group_end < end and p.edge_labels[group_end] == label:
+                group_end += 1
+            for new_label in letters_by_label[label]:
+                for target in p.edge_targets[begin:group_end]:
+                    builder.add_edge(new_label, target)
+            begin = group_end
+        builder.end_state(p.is_final(state))
+    return builder.build()
+
+
+def make_full_sets(p: PackedFA, labels: str) -> PackedFA:
+    '''
+        Chars of labels missing from a state lead to the sink by one label.
+    '''
+    alphabet: charset.Ranges = ()
+    names = []
+    for letter in charset.letters_to_labels(labels):
+        letter_ranges = charset.parse(letter)
+        if letter_ranges is None:
+            names.append(letter)
+        else:
+            alphabet = charset.union(alphabet, letter_ranges)
+
+    builder = PackedBuilder(p.labels)
+    name_ids = [builder.label_id(name) for name in names]
+    ranges = [charset.parse(label) for label in p.labels]
+    sink = p.state_count
+    sink_is_used = False
+    for state in range(p.state_count):
+        covered: charset.Ranges = ()
+        present = set()
+        for label, target in p.edges(state):
+            present.add(label)
+            label_ranges = ranges[label]
+            if label != EPS and label_ranges is not None:
+                covered = charset.union(covered, label_ranges)
+            builder.add_edge(label, target)
+        missing = charset.difference(alphabet, covered)
+        if missing:
+            builder.add_edge(builder.label_id(charset.format_ranges(missing)), sink)
+            sink_is_used = True
+        for label in name_ids:
+            if label not in present:
+                builder.add_edge(label, sink)
+                sink_is_used = True
+        builder.end_state(p.is_final(state))
+    if sink_is_used:
+        if alphabet:
+            builder.add_edge(builder.label_id(charset.format_ranges(alphabet)), sink)
+        for label in name_ids:
+            builder.add_edge(label, sink)
+        builder.end_state(False)
+    return builder.build()
+
+
+def min_partition(p: PackedFA, partial: bool = False) -> list[int]:
+    '''
+        Hopcroft's partition refinement, p must be deterministic and full.
+
+        With partial p may miss transitions, they go to a sink state that is not stored
+        and no state of p is equivalent to, see trim_sink. The sink stays a block of its own,
+        so it is never a splitter, but every other initial block is one.
+
+        A p that misses transitions by labels it has elsewhere, such as names that are not
+        in --letters, is minimized as partial, missing transitions never lead to a state of p.
+
+        Returns block of every state, blocks are numbered by their first state.
+    '''
+    state_count = p.state_count
+    labels = sorted(set(p.edge_labels))
+    index_by_label = {label: index for index, label in enumerate(labels)}
+    partial = partial or len(p.edge_labels) != len(labels) * state_count
+
+    # predecessors of state t by labels[i] are
+    # preds[pred_offsets[i * state_count + t]:pred_offsets[i * state_count + t + 1]]
+    pred_offsets = new_array([0]) * (len(labels) * state_count + 1)
+    # indices of labels of edges to every state, a block is a splitter by these only
+    in_labels: list[set[int]] = [set() for state in range(state_count)]
+    for state in range(state_count):
+        for label, target in p.edges(state):
+            pred_offsets[index_by_label[label] * state_count + target + 1] += 1
+            in_labels[target].add(index_by_label[label])
+    pred_offsets = new_array(itertools.accumulate(pred_offsets))
+    cursors = new_array(pred_offsets)
+    preds = new_array([0]) * pred_offsets[-1]
+    for state in range(state_count):
+        for label, target in p.edges(state):
+            key = index_by_label[label] * state_count + target
+            preds[cursors[key]] = state
+            cursors[key] += 1
+
+    # block b holds elems[first[b]:end[b]], marked states are elems[first[b]:mid[b]]
+    elems = [state for state in range(state_count) if not p.is_final(state)]
+    elems += [state for state in range(state_count) if p.is_final(state)]
+    loc = [0] * state_count
+    for index, state in enumerate(elems):
+        loc[state] = index
+    block = [int(p.is_final(state)) for state in range(state_count)]
+    split_at = len(elems) - sum(block)
+    first = [0, split_at]
+    end = [split_at, state_count]
+    if split_at in (0, state_count):
+        first = [0]
+        end = [state_count]
+        block = [0] * state_count
+    mid = list(first)
+
+    work = []
+    if partial:
+        work = [(b, index) for b in range(len(first)) for index in range(len(labels))]
+    elif len(first) == 2:
+        smaller = int(end[1] - first[1] < end[0] - first[0])
+        work = [(smaller, index) for index in range(len(labels))]
+
+    while work:
+        splitter, index = work.pop()
+        touched = []
+        for target in elems[first[splitter]:end[splitter]]:
+            key = index * state_count + target
+            for state in preds[pred_offsets[key]:pred_offsets[key + 1]]:
+                b = block[state]
+                i = loc[state]
+                j = mid[b]
+                if i < j:
+                    continue
+                other = elems[j]
+                elems[j] = state
+                loc[state] = j
+                elems[i] = other
+                loc[other] = i
+                if j == first[b]:
+                    touched.append(b)
+                mid[b] = j + 1
+        for b in touched:
+            if mid[b] == end[b]:
+                mid[b] = first[b]
+                continue
+            new_block = len(first)
+            if mid[b] - first[b] <= end[b] - mid[b]:
+                first.append(first[b])
+                end.append(mid[b])
+                first[b] = mid[b]
+            else:
+                first.append(mid[b])
+                end.append(end[b])
+                end[b] = mid[b]
+            mid.append(first[new_block])
+            mid[b] = first[b]
+            new_labels: set[int] = set()
+            for state in elems[first[new_block]:end[new_block]]:
+                block[state] = new_block
+                new_labels |= in_labels[state]
+            work.extend((new_block, index) for index in sorted(new_labels))
+
+    numbers: dict[int, int] = {}
+    return [numbers.setdefault(b, len(numbers)) for b in block]
+
+
+def make_min(p: PackedFA) -> PackedFA:
+    '''
+        p must be deterministic and full, sets of chars are split and joined as in make_deterministic.
+    '''
+    p = split_labels(p)
+    return merge_blocks(p, min_partition(p))
+
+
+def make_min_partial(p: PackedFA, sink_is_final: bool) -> PackedFA:
+    '''
+        Same as make_min for deterministic p whose missing transitions go to a sink state,
+        the result misses transitions to the sink too.
+    '''
+    p = trim_sink(split_labels(p), sink_is_final)
+    return merge_blocks(p, min_partition(p, partial=True))
+
+
+def merge_blocks(p: PackedFA, groups: list[int]) -> PackedFA:
+    '''
+        One state for every block of min_partition, numbered in bfs order from start.
+    '''
+    representative = {group: state for state, group in enumerate(groups)}
+    ids = {groups[0]: 0}
+    order = [groups[0]]
+    builder = PackedBuilder(p.labels)
+    for group in order:
+        state = representative[group]
+        for label, target in p.edges(state):
+            if groups[target] not in ids:
+                ids[groups[target]] = len(order)
+                order.append(groups[target])
+            builder.add_edge(label, ids[groups[target]])
+        builder.end_state(p.is_final(state))
+    return merge_labels(builder.build())
+
+
+def trim_sink(p: PackedFA, sink_is_final: bool) -> PackedFA:
+    '''
+        Removes states equivalent to the sink of a partial p: states that reach only states
+        as final as the sink. Transitions to them become missing, start is kept without edges.
+    '''
+    preds: list[list[int]] = [[] for state in range(p.state_count)]
+    for state in range(p.state_count):
+        for label, target in p.edges(state):
+            preds[target].append(state)
+    live = [p.is_final(state) != sink_is_final for state in range(p.state_count)]
+    stack = [state for state in range(p.state_count) if live[state]]
+    while stack:
+        for pred in preds[stack.pop()]:
+            if not live[pred]:
+                live[pred] = True
+                stack.append(pred)
+
+    ids = {0: 0}
+    order = [0]
+    builder = PackedBuilder(p.labels)
+    for state in order:
+        for label, target in p.edges(state):
+            if not live[target]:
+                continue
+            if target not in ids:
+                ids[target] = len(order)
+                order.append(target)
+            builder.add_edge(label, ids[target])
+        builder.end_state(p.is_final(state))
+    return builder.build()
+
+
+def expand_sink(p: PackedFA, labels: str, sink_is_final: bool) -> PackedFA:
+    '''
+        Full automaton for p whose missing transitions go to a sink state, see make_full.
+    '''
+    res = make_full(p, labels)
+    if sink_is_final and res.state_count > p.state_count:
+        bit_set(res.finals, p.state_count)
+    if p.state_count == 1 and not p.edge_labels and p.is_final(0) == sink_is_final:
+        # start is the sink itself, as trim_sink leaves it
+        return make_min(res)
+    return res
+
+
+def invert_full_fa(p: PackedFA) -> PackedFA:
+    finals = bytearray(byte ^ 0xff for byte in p.finals)
+    if p.state_count & 7:
+        finals[-1] &= (1 << (p.state_count & 7)) - 1
+    return PackedFA(
+        labels=list(p.labels),
+        offsets=new_array(p.offsets),
+        edge_labels=new_array(p.edge_labels),
+        edge_targets=new_array(p.edge_targets),
+        finals=finals,
+    )
+
+
+def canonicalize(p: PackedFA) -> PackedFA:
+    '''
+        p must be deterministic.
+
+        Labels used by edges are sorted, states are renumbered in bfs order from start
+        with edges of every state taken in order of their labels,
+        so isomorphic automata give equal results.
+    '''
+    assert p.is_deterministic()
+    used_labels = sorted({p.labels[label] for label in p.edge_labels})
+    builder = PackedBuilder(['', *used_labels])
+    new_labels = [builder.label_ids.get(label, EPS) for label in p.labels]
+
+    ids = {0: 0}
+    order = [0]
+    for state in order:
+        for label, target in sorted((new_labels[label], target) for label, target in p.edges(state)):
+            if target not in ids:
+                ids[target] = len(order)
+                order.append(target)
+            builder.add_edge(label, ids[target])
+        builder.end_state(p.is_final(state))
+    return builder.build()
+
+
+def canonical_bytes(p: PackedFA) -> bytes:
+    '''
+        Encoding of canonicalize(p): labels, then for every state
+        its final flag and its edges as label and target numbers.
+    '''
+    c = canonicalize(p)
+    lines = [repr(c.labels[EPS + 1:])]
+    for state in range(c.state_count):
+        edges = ' '.join(f'{label}:{target}' for label, target in c.edges(state))
+        lines.append(f'{int(c.is_final(state))} {edges}')
+    return '\n'.join(lines).encode()
+
+
+def fingerprint(p: PackedFA) -> str:
+    '''
+        sha256 of canonical_bytes(p), equal for minimal full automata of the same language over the same letters.
+    '''
+    return hashlib.sha256(canonical_bytes(p)).hexdigest()
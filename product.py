@@ -0,0 +1,96 @@
+from __future__ import annotations
+import typing
+
+import compare
+import packed
+
+# side of a pair with no runs left, it is never stored as a state
+DEAD = -1
+
+
+def build(
+    start: tuple[typing.Hashable, typing.Hashable],
+    next_pairs: typing.Callable[[typing.Any, typing.Any], typing.Iterator[tuple[str, typing.Hashable, typing.Hashable]]],
+    is_final: typing.Callable[[typing.Any, typing.Any], bool],
+) -> packed.PackedFA:
+    '''
+        Reachable part of a product automaton, pairs are numbered in bfs order from start.
+        Sets of chars of the result are joined by packed.merge_labels.
+    '''
+    ids = {start: 0}
+    order = [start]
+    builder = packed.PackedBuilder([''])
+    for pair in order:
+        for label, left, right in next_pairs(*pair):
+            target = ids.get((left, right))
+            if target is None:
+                target = ids[left, right] = len(order)
+                order.append((left, right))
+            builder.add_edge(builder.label_id(label), target)
+        builder.end_state(is_final(*pair))
+    return packed.merge_labels(builder.build())
+
+
+def intersect(a: packed.PackedFA, b: packed.PackedFA) -> packed.PackedFA:
+    '''
+        a and b must have no eps, the result is deterministic if both are.
+    '''
+    a, b = packed.split_labels(a, b.labels[packed.EPS + 1:]), packed.split_labels(b, a.labels[packed.EPS + 1:])
+    next_a = compare.next_states(a)
+    next_b = compare.next_states(b)
+
+    def next_pairs(x: int, y: int) -> typing.Iterator[tuple[str, int, int]]:
+        next_y = next_b[y]
+        for label, targets in next_a[x].items():
+            for new_x in targets:
+                for new_y in next_y.get(label, ()):
+                    yield label, new_x, new_y
+
+    return build((0, 0), next_pairs, lambda x, y: a.is_final(x) and b.is_final(y))
+
+
+def union(a: packed.PackedFA, b: packed.PackedFA) -> packed.PackedFA:
+    '''
+        a and b must have no eps, the result is deterministic if both are.
+
+        A side without a transition becomes DEAD instead of a sink state.
+    '''
+    a, b = packed.split_labels(a, b.labels[packed.EPS + 1:]), packed.split_labels(b, a.labels[packed.EPS + 1:])
+    next_a = compare.next_states(a)
+    next_b = compare.next_states(b)
+    dead: dict[str, tuple[int, ...]] = {}
+
+    def next_pairs(x: int, y: int) -> typing.Iterator[tuple[str, int, int]]:
+        next_x = next_a[x] if x != DEAD else dead
+        next_y = next_b[y] if y != DEAD else dead
+        for label in {**next_x, **next_y}:
+            for new_x in next_x.get(label, (DEAD,)):
+                for new_y in next_y.get(label, (DEAD,)):
+                    yield label, new_x, new_y
+
+    def is_final(x: int, y: int) -> bool:
+        return (x != DEAD and a.is_final(x)) or (y != DEAD and b.is_final(y))
+
+    return build((0, 0), next_pairs, is_final)
+
+
+def difference(a: packed.PackedFA, b: packed.PackedFA) -> packed.PackedFA:
+    '''
+        Accepts words of a not accepted by b, a and b must have no eps.
+
+        b is determinized lazily, the empty subset stands for its sink state.
+        The result is deterministic if a is.
+    '''
+    a, b = packed.split_labels(a, b.labels[packed.EPS + 1:]), packed.split_labels(b, a.labels[packed.EPS + 1:])
+    next_a = compare.next_states(a)
+    side = compare.subsets(b)
+    empty: tuple[int, ...] = ()
+
+    def next_pairs(x: int, subset: tuple[int, ...]) -> typing.Iterator[tuple[str, int, tuple[int, ...]]]:
+        next_subsets = side.next(subset) if subset else {}
+        for label, targets in next_a[x].items():
+            new_subset = next_subsets.get(label, empty)
+            for new_x in targets:
+                yield label, new_x, new_subset
+
+    return build((0, (0,)), next_pairs, lambda x, subset: a.is_final(x) and not side.is_final(subset))
@@ -0,0 +1,109 @@
+from __future__ import annotations
+import re
+import typing
+from dataclasses import dataclass
+
+import fa
+import charset
+
+token_re = re.compile(r'\s*(?:(?P<name>[^\W\d]\w*)|(?P<number>\d+)|(?P<op>\*\*|[+*()])|(?P<set>\[(?:\\.|[^\]\\])*\])|(?P<end>\Z)|(?P<other>.))', re.DOTALL)
+
+Term = tuple[str, typing.Any]
+
+
+@dataclass(frozen=True)
+class regex_ast:
+    '''
+        Regex in postfix order:
+        ('name', label) and ('const', 0 or 1) push a term, sets of chars are labels like '[a-z]',
+        ('+', None) and ('*', None) replace two top terms by one,
+        ('**', n) and ('**', None) replace the top term.
+    '''
+    postfix: list[Term]
+
+
+class RegexSyntaxError(SyntaxError):
+
+    def __init__(self, message: str, text: str, position: int) -> None:
+        super().__init__(f'{message} at position {position}', ('<regex>', 1, position + 1, text))
+        self.position = position
+
+
+def parse(text: str) -> regex_ast:
+    '''
+        Shunting-yard parser for the grammar from README, linear in len(text), no recursion.
+    '''
+    postfix: list[Term] = []
+    operators: list[tuple[str, int]] = []
+    expect_operand = True
+    after_pow = False
+
+    tokens = token_re.finditer(text)
+    for match in tokens:
+        kind = typing.cast(str, match.lastgroup)
+        value = match.group(kind)
+        position = match.start(kind)
+
+        if kind == 'other':
+            raise RegexSyntaxError(f'unexpected {value!r}', text, position)
+
+        if expect_operand:
+            if kind == 'name' and value != 'None':
+                postfix.append(('name', value))
+                expect_operand = False
+            elif kind == 'number' and value in ('0', '1'):
+                postfix.append(('const', int(value)))
+                expect_operand = False
+            elif kind == 'set':
+                try:
+                    ranges = charset.parse_set(value)
+                except ValueError as e:
+                    raise RegexSyntaxError(str(e), text, position)
+                postfix.append(('name', charset.format_ranges(ranges)) if ranges else ('const', 0))
+                expect_operand = False
+            elif value == '(':
+                operators.append(('(', position))
+            elif kind == 'end':
+                raise RegexSyntaxError('unexpected end', text, position)
+            else:
+                raise RegexSyntaxError('expected name, 0, 1 or (', text, position)
+            continue
+
+        if value in ('+', '*'):
+            level = fa.operator_level[value]
+            while operators and operators[-1][0] != '(' and fa.operator_level[operators[-1][0]] >= level:
+                postfix.append((operators.pop()[0], None))
+            operators.append((value, position))
+            expect_operand = True
+            after_pow = False
+        elif value == '**':
+            if after_pow:
+                raise RegexSyntaxError('repeated ** needs parentheses', text, position)
+            exponent = next(tokens)
+            exponent_value = exponent.group(typing.cast(str, exponent.lastgroup))
+            if exponent.lastgroup == 'number':
+                postfix.append(('**', int(exponent_value)))
+            elif exponent_value == 'None':
+                postfix.append(('**', None))
+            else:
+                raise RegexSyntaxError('exponent must be a number or None', text, exponent.start(typing.cast(str, exponent.lastgroup)))
+            after_pow = True
+        elif value == ')':
+            while operators and operators[-1][0] != '(':
+                postfix.append((operators.pop()[0], None))
+            if not operators:
+                raise RegexSyntaxError('unmatched )', text, position)
+            operators.pop()
+            after_pow = False
+        elif kind == 'end':
+            break
+        else:
+            raise RegexSyntaxError('expected +, *, ** or )', text, position)
+
+    while operators:
+        operator, position = operators.pop()
+        if operator == '(':
+            raise RegexSyntaxError('unmatched (', text, position)
+        postfix.append((operator, None))
+
+    return regex_ast(postfix)
@@ -0,0 +1,130 @@
+from __future__ import annotations
+from dataclasses import dataclass
+
+import fa
+
+
+@dataclass(frozen=True, eq=False)
+class regex_term:
+    '''
+        Node of a regex DAG, terms are interned by term_table,
+        so equal terms are the same object and compare by identity.
+
+        op is 'name' or 'const' with text, or '+', '*', '**' with operands.
+        length is the length of the rendered text.
+    '''
+    op: str
+    level: int
+    operands: tuple[regex_term, ...]
+    text: str
+    id: int
+    length: int
+
+
+class term_table:
+    '''
+        Builds interned terms with the same 0 and 1 simplifications as the string regexes had,
+        operands of + are ordered by id.
+    '''
+
+    def __init__(self) -> None:
+        self.terms: dict[tuple[str, str, tuple[int, ...]], regex_term] = {}
+        self.zero = self.name('0')
+        self.one = self.name('1')
+
+    def intern(self, op: str, level: int, operands: tuple[regex_term, ...], text: str, length: int) -> regex_term:
+        key = op, text, tuple(operand.id for operand in operands)
+        term = self.terms.get(key)
+        if term is None:
+            term = self.terms[key] = regex_term(op, level, operands, text, len(self.terms), length)
+        return term
+
+    def name(self, text: str) -> regex_term:
+        return self.intern('name', fa.constant_op_level, (), text, len(text))
+
+    def plus(self, left: regex_term, right: regex_term) -> regex_term:
+        if left is self.zero:
+            return right
+        if right is self.zero or left is right:
+            return left
+        if left.id > right.id:
+            left, right = right, left
+        return self.intern('+', fa.add_op_level, (left, right), '', left.length + 1 + right.length)
+
+    def times(self, left: regex_term, right: regex_term) -> regex_term:
+        if left is self.one:
+            return right
+        if right is self.one:
+            return left
+        if left is self.zero or right is self.zero:
+            return self.zero
+        length = left.length + 1 + right.length
+        length += 2 * (left.level < fa.mul_op_level) + 2 * (right.level < fa.mul_op_level)
+        return self.intern('*', fa.mul_op_level, (left, right), '', length)
+
+    def star(self, term: regex_term) -> regex_term:
+        if term is self.zero or term is self.one:
+            return self.one
+        if term.op == '**':
+            return term
+        return self.intern('**', fa.pow_op_level, (term,), '', term.length + len('()**None'))
+
+
+def wrap(term: regex_term, level: int) -> list[regex_term | str]:
+    if term.level < level:
+        return ['(', term, ')']
+    return [term]
+
+
+def render(term: regex_term) -> str:
+    '''
+        Public text of term, written without recursion.
+
+        Terms with several parents are rendered once, children first,
+        other terms are written inline into their only parent.
+    '''
+    parent_counts = {term: 0}
+    queue = [term]
+    for current in queue:
+        for operand in current.operands:
+            if operand not in parent_counts:
+                parent_counts[operand] = 0
+                queue.append(operand)
+            parent_counts[operand] += 1
+
+    # parents before children
+    order = [term]
+    waiting = dict(parent_counts)
+    for current in order:
+        for operand in current.operands:
+            waiting[operand] -= 1
+            if not waiting[operand]:
+                order.append(operand)
+
+    texts: dict[regex_term, str] = {}
+    for current in reversed(order):
+        if current is term or parent_counts[current] > 1:
+            texts[current] = render_inline(current, texts)
+    return texts[term]
+
+
+def render_inline(term: regex_term, texts: dict[regex_term, str]) -> str:
+    '''
+        Text of term, operands with known texts are not expanded.
+    '''
+    parts: list[str] = []
+    stack: list[regex_term | str] = [term]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            parts.append(item)
+        elif item in texts:
+            parts.append(texts[item])
+        elif not item.operands:
+            parts.append(item.text)
+        elif item.op == '**':
+            stack += [')**None', item.operands[0], '(']
+        else:
+            left, right = item.operands
+            stack += reversed([*wrap(left, item.level), item.op, *wrap(right, item.level)])
+    return ''.join(parts)
@@ -1,10 +1,19 @@
 from __future__ import annotations
 from utils import debug
+import binary
+import cache
+import charset
 import command
+import compare
+import product
+import lazy_dfa
 import convert
 import fa
 from dataclasses import dataclass
 import functools
+import pathlib
+import json
+import itertools
 from copy import deepcopy as cp
 import random
 import re
@@ -13,7 +22,12 @@ import time
 import ast
 import sys
 import io
+import struct
+import os
 import validate
+import packed
+import regex_parser
+import regex_term
 import typing
 pytest = __import__('pytest')
 
@@ -881,3 +895,868 @@ def test_fa_stress_fa_to_re(arg: int) -> None:
 
 test_fa_stress_fa_to_re = pytest.mark.parametrize('arg', arg_values)(test_fa_stress_fa_to_re)
 
+
+
+def test_packed_json() -> None:
+    labels = 'qwer'
+    for text in ['q*w+e*r+q*w', '0', '1', '(q+w)**None*e', '(q*w)**3+r']:
+        a = convert.ast_to_eps_nfa(convert.regex_to_ast(text))
+        p = packed.fa_to_packed(a)
+        assert packed.packed_to_json(p, labels) == fa.fa_to_json(a, labels)
+        assert fa.fa_to_json(packed.packed_to_fa(p), labels) == fa.fa_to_json(a, labels)
+        q = packed.json_to_packed(fa.fa_to_json(a, labels))
+        assert packed.packed_to_json(q, labels) == fa.fa_to_json(a, labels)
+
+
+def test_packed_stress(arg: int) -> None:
+    labels = 'qwer'
+    while True:
+        try:
+            r = random_fa(rand, 6, labels)
+        except RecursionError:
+            continue
+        eps_nfa = convert.ast_to_eps_nfa(convert.regex_to_ast(r.regex_for_converting_to_fa))
+        min_full_dfa = convert.make_min(convert.make_full(convert.make_deterministic(convert.remove_eps(eps_nfa)), labels))
+
+        p = packed.fa_to_packed(eps_nfa)
+        nfa = packed.remove_eps(p)
+        assert not nfa.has_eps()
+        dfa = packed.make_deterministic(nfa)
+        assert dfa.is_deterministic()
+        full_dfa = packed.make_full(dfa, labels)
+        min_dfa = packed.make_min(full_dfa)
+        inverted_min_dfa = packed.invert_full_fa(min_dfa)
+        assert min_dfa.state_count == len([*min_full_dfa.start.bfs()])
+        assert packed.packed_to_json(min_dfa, labels) == fa.fa_to_json(packed.packed_to_fa(min_dfa), labels)
+
+        for t in r.random_strings_that_maybe_match + [r.random_string_that_matches]:
+            if t is not None:
+                u = can_fa_eval_string(min_full_dfa, t, 1 << 16)
+                for q in [p, nfa, dfa, full_dfa, min_dfa]:
+                    assert can_fa_eval_string(packed.packed_to_fa(q), t, 1 << 16) == u
+                assert can_fa_eval_string(packed.packed_to_fa(inverted_min_dfa), t, 1 << 16) != u
+        break
+
+test_packed_stress = pytest.mark.parametrize('arg', arg_values)(test_packed_stress)
+
+
+def test_remove_eps_long_chains() -> None:
+    k = 3000
+    a = functools.reduce(lambda x, y: x + y, [fa.FA('qw'[i % 2]) * fa.FA('qw'[i % 3 % 2]) for i in range(k)])
+    a = ~(a * fa.FA('q'))
+    nfa = convert.remove_eps(a)
+    assert not validate.fa_has_eps(nfa)
+    for t in ['', 'qqq', 'wqq', 'qwq', 'wwq', 'qwqqqq', 'qw', 'qqqw', 'qqwqq']:
+        assert can_fa_eval_string(nfa, t, 1 << 20) == can_fa_eval_string(a, t, 1 << 20)
+
+
+def test_remove_eps_shared_tail() -> None:
+    # every state of a q-cycle has an eps edge into one long eps chain ending in the final state
+    k = 3000
+    builder = packed.PackedBuilder(['', 'q'])
+    for state in range(k):
+        builder.add_edge(packed.EPS, k)
+        builder.add_edge(1, (state + 1) % k)
+        builder.end_state(False)
+    for state in range(k, 2 * k):
+        builder.add_edge(packed.EPS, state + 1)
+        builder.end_state(False)
+    builder.end_state(True)
+    closures = packed.eps_closures(builder.build(), range(2 * k + 1))
+    assert all(closures[state] == [state, 2 * k] for state in range(k))
+    assert all(closures[state] == [2 * k] for state in range(k, 2 * k + 1))
+    nfa = packed.remove_eps(builder.build())
+    assert nfa.state_count == k and all(nfa.is_final(state) for state in range(k))
+
+
+def test_fa_to_re_language(arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 5, labels)
+    nfa = convert.remove_eps(convert.ast_to_eps_nfa(convert.regex_to_ast(r.regex_for_converting_to_fa)))
+    for a in [nfa, convert.make_min(convert.make_full(convert.make_deterministic(nfa), labels))]:
+        created_re = convert.fa_to_re(a)
+        assert created_re == convert.fa_to_re(a)
+        created = convert.remove_eps(convert.ast_to_eps_nfa(convert.regex_to_ast(created_re)))
+        for length in range(5):
+            for t in itertools.product(labels, repeat=length):
+                assert can_fa_eval_string(created, ''.join(t), 1 << 20) == can_fa_eval_string(a, ''.join(t), 1 << 20)
+
+
+test_fa_to_re_language = pytest.mark.parametrize('arg', range(30))(test_fa_to_re_language)
+
+
+def test_fingerprint(arg: int) -> None:
+    labels = 'qwe'
+    regexes = [random_fa(rand, 4, labels).regex_for_converting_to_fa for i in range(2)]
+    r = regexes[0]
+    same = [r, f'{r}+{r}', f'({r})*1', convert.fa_to_re(convert.ast_to_eps_nfa(convert.regex_to_ast(r)))]
+    assert len({command.fingerprint(command.fa_or_re(text), labels) for text in same}) == 1
+
+    minimal = [
+        packed.make_min(packed.make_full(command.compile_value(command.fa_or_re(text)), labels))
+        for text in regexes
+    ]
+    languages = [
+        [can_fa_eval_string(packed.packed_to_fa(p), ''.join(t)) for length in range(5) for t in itertools.product(labels, repeat=length)]
+        for p in minimal
+    ]
+    fingerprints = [packed.fingerprint(p) for p in minimal]
+    assert (fingerprints[0] == fingerprints[1]) == (languages[0] == languages[1])
+
+    # renumbering states and labels does not change canonical form
+    p = minimal[0]
+    order = [0, *rand.sample(range(1, p.state_count), p.state_count - 1)]
+    new_ids = {state: index for index, state in enumerate(order)}
+    builder = packed.PackedBuilder(['', *reversed(labels)])
+    for state in order:
+        for label, target in p.edges(state):
+            builder.add_edge(builder.label_id(p.labels[label]), new_ids[target])
+        builder.end_state(p.is_final(state))
+    shuffled = builder.build()
+    assert packed.canonical_bytes(shuffled) == packed.canonical_bytes(p)
+    assert packed.canonical_bytes(packed.canonicalize(p)) == packed.canonical_bytes(p)
+
+
+test_fingerprint = pytest.mark.parametrize('arg', range(30))(test_fingerprint)
+
+
+def test_compare(arg: int) -> None:
+    labels = 'qw'
+    regexes = [random_fa(rand, 3, labels).regex_for_converting_to_fa for i in range(2)]
+    regexes[1] = rand.choice([regexes[1], f'{regexes[0]}+{regexes[1]}', f'({regexes[0]})*1'])
+    a, b = [command.nfa_value(command.fa_or_re(regex)) for regex in regexes]
+    fa_a, fa_b = packed.packed_to_fa(a), packed.packed_to_fa(b)
+
+    words = [''.join(t) for length in range(7) for t in itertools.product(labels, repeat=length)]
+    differences = [w for w in words if can_fa_eval_string(fa_a, w) != can_fa_eval_string(fa_b, w)]
+    missing = [w for w in words if can_fa_eval_string(fa_a, w) and not can_fa_eval_string(fa_b, w)]
+
+    for counterexample, expected in [
+        (compare.equivalence_counterexample(a, b), differences),
+        (compare.inclusion_counterexample(a, b), missing),
+    ]:
+        if counterexample is None:
+            assert not expected
+        else:
+            assert counterexample in expected or len(counterexample) > 6
+            assert not expected or len(counterexample) == len(expected[0])
+    assert (compare.equivalence_counterexample(a, b) is None) == (command.fingerprint(command.fa_or_re(regexes[0]), labels) == command.fingerprint(command.fa_or_re(regexes[1]), labels))
+    assert compare.equivalence_counterexample(a, a) is None and compare.inclusion_counterexample(a, a) is None
+
+
+test_compare = pytest.mark.parametrize('arg', range(50))(test_compare)
+
+
+def random_dfa(rand: random.Random, labels: str) -> packed.PackedFA:
+    count = rand.randint(1, 8)
+    builder = packed.PackedBuilder(['', *labels])
+    for state in range(count):
+        for label in range(1, len(labels) + 1):
+            if rand.random() < 0.8:
+                builder.add_edge(label, rand.randrange(count))
+        builder.end_state(rand.random() < 0.5)
+    return builder.build()
+
+
+def test_compare_random_dfa(arg: int) -> None:
+    rand = random.Random(arg)
+    labels = 'qw'
+    a, b = random_dfa(rand, labels), random_dfa(rand, labels)
+    same = packed.fingerprint(packed.make_min(packed.make_full(a, labels))) == packed.fingerprint(packed.make_min(packed.make_full(b, labels)))
+    counterexample = compare.equivalence_counterexample(a, b)
+    assert (counterexample is None) == same
+    if counterexample is not None:
+        fa_a, fa_b = packed.packed_to_fa(a), packed.packed_to_fa(b)
+        assert can_fa_eval_string(fa_a, counterexample) != can_fa_eval_string(fa_b, counterexample)
+
+
+test_compare_random_dfa = pytest.mark.parametrize('arg', range(100))(test_compare_random_dfa)
+
+
+def test_product(arg: int) -> None:
+    labels = 'qwe'
+    regexes = [random_fa(rand, 3, labels).regex_for_converting_to_fa for i in range(2)]
+    nfas = [command.nfa_value(command.fa_or_re(regex)) for regex in regexes]
+    dfas = [packed.make_deterministic(p) for p in nfas]
+    words = [''.join(t) for length in range(5) for t in itertools.product(labels, repeat=length)]
+    accepted = [{w for w in words if can_fa_eval_string(packed.packed_to_fa(p), w)} for p in nfas]
+
+    for a, b in [nfas, dfas, (nfas[0], dfas[1])]:
+        for operation, expected in [
+            (product.intersect, accepted[0] & accepted[1]),
+            (product.union, accepted[0] | accepted[1]),
+            (product.difference, accepted[0] - accepted[1]),
+        ]:
+            res = operation(a, b)
+            assert {w for w in words if can_fa_eval_string(packed.packed_to_fa(res), w)} == expected
+            if a.is_deterministic() and (b.is_deterministic() or operation is product.difference):
+                assert res.is_deterministic()
+
+
+test_product = pytest.mark.parametrize('arg', range(30))(test_product)
+
+
+def test_letter_classes(arg: int) -> None:
+    labels = 'qwrty'
+    r = random_fa(rand, 4, 'qwr')
+    regex = r.regex_for_converting_to_fa.replace('r', '(r+t+y)')
+    if arg % 3 == 0:
+        # with sets of chars letters are not grouped
+        labels = 'qw[r-y]'
+        regex = r.regex_for_converting_to_fa.replace('r', rand.choice(['[r-t]', '(r+[s-y])', '[r-y]']))
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'minimize', 'invert']
+    count = rand.randint(2, len(operations))
+    plain = run_main(['command.py', '--letters', labels, '--operations', *operations[:count]], regex)
+    classes = run_main(['command.py', '--letters', labels, '--operations', *operations[:count], '--letter-classes'], regex)
+    assert plain[0] == classes[0] == 0
+    a, b = [command.nfa_value(command.fa_or_re.from_public_str(out)) for code, out, err in (plain, classes)]
+    assert compare.equivalence_counterexample(a, b) is None
+    assert json.loads(plain[1])['letters'] == json.loads(classes[1])['letters']
+    if count >= 4:
+        assert validate.analyze(packed.packed_to_fa(b), labels).is_full
+
+
+test_letter_classes = pytest.mark.parametrize('arg', range(30))(test_letter_classes)
+
+
+def test_letter_classes_grouping() -> None:
+    p = command.nfa_value(command.fa_or_re('(q+w+e)**None*r*(q+w)'))
+    classes = packed.letter_classes(p, 'qwerty')
+    assert classes == [['q', 'w'], ['e'], ['r'], ['t', 'y']]
+    compressed = packed.compress_letters(p, classes)
+    assert set(compressed.labels) == {'', 'q', 'e', 'r'}
+    expanded = packed.expand_letters(compressed, classes)
+    assert compare.equivalence_counterexample(expanded, p) is None
+
+
+def test_implicit_sink(arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 4, labels)
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'minimize', 'invert', 'minimize']
+    count = rand.randint(4, len(operations))
+    plain = run_main(['command.py', '--letters', labels, '--operations', *operations[:count]], r.regex_for_converting_to_fa)
+    implicit = run_main(['command.py', '--letters', labels, '--operations', *operations[:count], '--implicit-sink'], r.regex_for_converting_to_fa)
+    assert plain[0] == implicit[0] == 0
+    a, b = [command.nfa_value(command.fa_or_re.from_public_str(out)) for code, out, err in (plain, implicit)]
+    assert a.state_count == b.state_count
+    assert compare.equivalence_counterexample(a, b) is None
+    assert validate.fa_is_full(packed.packed_to_fa(b), labels)
+
+    dfa = packed.make_deterministic(command.nfa_value(command.fa_or_re(r.regex_for_converting_to_fa)))
+    for sink_is_final in (False, True):
+        expected = packed.make_min(packed.expand_sink(dfa, labels, sink_is_final))
+        res = packed.expand_sink(packed.make_min_partial(dfa, sink_is_final), labels, sink_is_final)
+        assert packed.fingerprint(res) == packed.fingerprint(expected)
+
+
+test_implicit_sink = pytest.mark.parametrize('arg', range(30))(test_implicit_sink)
+
+
+def test_minimize_names() -> None:
+    # names that are not in --letters are missing from some states after make-full
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'minimize']
+    for regex in ['ab * cd', 'ab * (cd + a)**None', '(ab+a)*(cd+c)**None', 'a*ab + ab*a']:
+        code, out, err = run_main(['command.py', '--letters', 'abcd', '--operations', *operations], regex)
+        assert code == 0 and err == ''
+        a = command.nfa_value(command.fa_or_re(regex))
+        b = command.nfa_value(command.fa_or_re.from_public_str(out))
+        assert b.is_deterministic() and compare.equivalence_counterexample(a, b) is None
+    code, out, err = run_main(['command.py', '--letters', 'abcd', '--operations', *operations], 'ab * cd')
+    assert len(json.loads(out)['states']) == 4
+
+
+def test_binary_format(tmp_path: typing.Any, monkeypatch: typing.Any, arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 4, labels)
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'minimize']
+    count = rand.randint(1, len(operations))
+    args = ['command.py', '--letters', labels, '--operations', *operations[:count]]
+    path = str(tmp_path / 'fa.bin')
+    code, out, err = run_main(args, r.regex_for_converting_to_fa)
+    assert run_main([*args, '--output', path, '--format', 'binary'], r.regex_for_converting_to_fa) == (0, '', '')
+
+    code, binary_out, err = run_main(['command.py', '--letters', labels, '--operations', '--input', path], '')
+    assert code == 0
+    a, b = [command.nfa_value(command.fa_or_re.from_public_str(text)) for text in (out, binary_out)]
+    assert a.state_count == b.state_count and json.loads(out)['letters'] == json.loads(binary_out)['letters']
+    assert compare.equivalence_counterexample(a, b) is None
+    assert binary.binary_fa(pathlib.Path(path).read_bytes()).is_dense or count < 3
+
+    lines = tmp_path / 'lines.txt'
+    strings = [t for t in r.random_strings_that_maybe_match if t is not None] + [''.join(rand.choice(labels + 'x') for i in range(5))]
+    lines.write_text('\n'.join(strings) + '\n')
+    expected = run_main([*args, '--match', str(lines)], r.regex_for_converting_to_fa)
+    assert run_main(['command.py', '--letters', labels, '--operations', '--input', path, '--match', str(lines)], '') == expected
+    monkeypatch.setitem(sys.modules, 'matcher', None)
+    assert run_main(['command.py', '--letters', labels, '--operations', '--input', path, '--match', str(lines)], '') == expected
+
+
+test_binary_format = pytest.mark.parametrize('arg', range(20))(test_binary_format)
+
+
+def test_binary_format_letters(tmp_path: typing.Any) -> None:
+    path = tmp_path / 'fa.bin'
+    args = ['command.py', '--letters', '[a-z]', '--operations']
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'minimize']
+    for regex in ['[a-z]**None*[d-w]*c', '[a-z]**None*[d-w]*(c+x)']:
+        code, out, err = run_main([*args, *operations], regex)
+        assert run_main([*args, '--output', str(path), '--format', 'binary'], out) == (0, '', '')
+        assert binary.binary_fa(path.read_bytes()).letters == json.loads(out)['letters']
+        assert run_main([*args, '--input', str(path)], '') == (0, out, '')
+
+
+def test_binary_format_errors(tmp_path: typing.Any) -> None:
+    path = tmp_path / 'fa.bin'
+    assert run_main(['command.py', '--letters', 'qw', '--operations', '--format', 'binary'], 'q') == (1, '', '--format binary needs --output.\n')
+    assert run_main(['command.py', '--letters', 'qw', '--operations', '--output', str(path), '--format', 'binary'], 'q') == (
+        1, '', '--format binary needs an automaton, not a regex.\n')
+    assert run_main(['command.py', '--letters', 'qw', '--operations', 're-to-eps-nfa', '--output', str(path), '--format', 'binary'], 'q*w') == (0, '', '')
+    data = path.read_bytes()
+    path.write_bytes(data[:-4])
+    assert run_main(['command.py', '--letters', 'qw', '--operations', '--input', str(path)], '') == (
+        1, '', "ValueError('binary automaton is truncated')\n")
+    path.write_bytes(data[:4] + b'\x03' + data[5:])
+    assert run_main(['command.py', '--letters', 'q', '--operations', '--input', str(path)], '') == (
+        1, '', "ValueError('unknown binary format version 3')\n")
+
+    # numbers out of range: the last edge target of an automaton with eps, the first offset of its edges
+    # and the first target in the table of a deterministic one
+    cases: list[tuple[list[str], typing.Callable[[binary.binary_fa, int], int], list[int], str]] = [
+        (['re-to-eps-nfa'], lambda b, size: size - 4, [999, -1], 'edge target out of range'),
+        (['re-to-eps-nfa'], lambda b, size: b.table_offset, [1], 'edge offsets out of order'),
+        (['re-to-eps-nfa', 'remove-eps', 'make-deterministic'], lambda b, size: b.table_offset, [999, -1], 'transition target out of range'),
+    ]
+    for operations, offset_of, values, message in cases:
+        assert run_main(['command.py', '--letters', 'qw', '--operations', *operations, '--output', str(path), '--format', 'binary'], 'q*w') == (0, '', '')
+        data = path.read_bytes()
+        offset = offset_of(binary.binary_fa(data), len(data))
+        for value in values:
+            with pytest.raises(ValueError, match=message):
+                binary.binary_fa(data[:offset] + struct.pack('<i', value) + data[offset + 4:])
+
+
+def test_write_json(arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 5, labels)
+    a = packed.packed_to_fa(packed.thompson(regex_parser.parse(r.regex_for_converting_to_fa)))
+    if arg % 2:
+        a = convert.make_full(convert.make_deterministic(convert.remove_eps(a)), labels)
+    p = packed.fa_to_packed(a)
+    expected = command.frozen_fa.from_json(fa.fa_to_json(a, labels + 'r')).to_json_str()
+    file = io.StringIO()
+    packed.write_json(p, labels + 'r', file)
+    assert file.getvalue() == expected
+    file = io.StringIO()
+    packed.write_json(p, labels + 'r', file, compact=True)
+    assert json.loads(file.getvalue()) == json.loads(expected) and ' ' not in file.getvalue()
+
+
+test_write_json = pytest.mark.parametrize('arg', range(20))(test_write_json)
+
+
+def test_write_json_escapes() -> None:
+    builder = packed.PackedBuilder([''])
+    builder.add_edge(builder.label_id('"'), 1)
+    builder.end_state(False)
+    builder.add_edge(builder.label_id('ё'), 0)
+    builder.end_state(True)
+    p = builder.build()
+    file = io.StringIO()
+    packed.write_json(p, '', file)
+    assert file.getvalue() == command.frozen_fa.from_json(packed.packed_to_json(p, '')).to_json_str()
+    assert run_main(['command.py', '--letters', 'qw', '--operations', 're-to-eps-nfa', 'remove-eps', '--compact'], 'q') == (
+        0, '{"states":["1","2"],"letters":["q","w"],"transition_function":[["1","q","2"]],"start_states":["1"],"final_states":["2"]}\n', '')
+
+
+def test_charset() -> None:
+    assert charset.parse('[a-cx\\-\\x41\\u0416]') == ((45, 45), (65, 65), (97, 99), (120, 120), (1046, 1046))
+    assert charset.parse('q') == ((113, 113),) and charset.parse('None') is None
+    assert charset.format_ranges(((97, 99), (32, 32), (45, 45))) == '[a-c\\x20\\-]'
+    assert charset.format_ranges(((97, 97),)) == 'a' and charset.format_ranges(((46, 46),)) == '[.]'
+    assert charset.split(['[a-m]', '[h-z]', 'q', 'qq']) == {
+        '[a-m]': ['[a-g]', '[h-m]'], '[h-z]': ['[h-m]', '[n-p]', 'q', '[r-z]'], 'q': ['q'], 'qq': ['qq']}
+    classify = charset.classifier(['[a-g]', '[h-m]', 'q'])
+    assert [classify(c) for c in 'ahmqz'] == ['[a-g]', '[h-m]', '[h-m]', 'q', None]
+    assert charset.covers('[a-z]', '[c-f]') and not charset.covers('[a-z]', '[0-9]') and charset.covers('qw', 'q')
+
+    assert regex_parser.parse('[a-c]*[]+[x]').postfix == [('name', '[a-c]'), ('const', 0), ('*', None), ('name', 'x'), ('+', None)]
+    for text, position in [('[z-a]', 0), ('q*[a', 2)]:
+        with pytest.raises(regex_parser.RegexSyntaxError) as e:
+            regex_parser.parse(text)
+        assert e.value.position == position
+
+
+def test_char_sets(arg: int) -> None:
+    sets = {'q': '[a-m]', 'w': '[h-t]', 'e': 'z'}
+    r = random_fa(rand, 4, 'qwe')
+    regex = re.sub(r'\b[qwe]\b', lambda m: sets[m.group()], r.regex_for_converting_to_fa)
+    plain = re.sub(r'\[(.)-(.)\]', lambda m: '(' + '+'.join(map(chr, range(ord(m.group(1)), ord(m.group(2)) + 1))) + ')', regex)
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'minimize']
+    code, out, err = run_main(['command.py', '--letters', '[a-z]', '--operations', *operations], regex)
+    assert code == 0, err
+    p = command.nfa_value(command.fa_or_re.from_public_str(out))
+    assert all(charset.is_set(label) or len(label) == 1 for label in p.labels[packed.EPS + 1:])
+    assert validate.analyze(packed.packed_to_fa(p), '[a-z]').is_full
+    expected = command.nfa_value(command.fa_or_re(plain))
+    assert compare.equivalence_counterexample(p, expected) is None
+    assert compare.inclusion_counterexample(product.union(p, expected), expected) is None
+    assert compare.equivalence_counterexample(product.intersect(p, expected), p) is None
+
+    strings = [''.join(rand.choice('ahmqtz0') for i in range(rand.randint(0, 6))) for j in range(100)]
+    accepted = [accepted for line, accepted in command.match_lines(packed.make_deterministic(expected), strings)]
+    assert [accepted for line, accepted in command.match_lines(p, strings)] == accepted
+    assert [lazy_dfa.lazy_dfa(command.nfa_value(command.fa_or_re(regex)), 3).match(s) for s in strings] == accepted
+
+
+test_char_sets = pytest.mark.parametrize('arg', range(20))(test_char_sets)
+
+
+def test_regex_term() -> None:
+    terms = regex_term.term_table()
+    q, w = terms.name('q'), terms.name('w')
+    assert terms.plus(q, w) is terms.plus(w, q) is terms.plus(terms.plus(q, w), terms.plus(w, q))
+    assert terms.plus(q, terms.zero) is terms.plus(terms.zero, q) is terms.plus(q, q) is q
+    assert terms.times(q, terms.one) is terms.times(terms.one, q) is q
+    assert terms.times(q, terms.zero) is terms.times(terms.zero, q) is terms.zero
+    assert terms.star(terms.zero) is terms.star(terms.one) is terms.one
+    assert terms.star(terms.star(q)) is terms.star(q)
+    qw = terms.times(terms.plus(q, w), terms.star(terms.times(q, w)))
+    assert regex_term.render(qw) == '(q+w)*(q*w)**None'
+    assert regex_term.render(terms.plus(qw, qw)) == '(q+w)*(q*w)**None'
+    assert qw.length == len(regex_term.render(qw))
+
+    deep = q
+    for i in range(100000):
+        deep = terms.times(terms.plus(deep, w), q)
+    text = regex_term.render(deep)
+    assert len(text) == deep.length and text.count('(') == 100000 and text.endswith(')*q')
+
+
+def postfix_to_python(postfix: list[regex_parser.Term]) -> str:
+    stack: list[str] = []
+    for op, arg in postfix:
+        if op in ('name', 'const'):
+            stack.append(str(arg))
+        elif op == '**':
+            stack.append(f'({stack.pop()}) ** {arg}')
+        else:
+            right = stack.pop()
+            stack.append(f'({stack.pop()}) {op} ({right})')
+    return stack.pop()
+
+
+def test_regex_parser_matches_ast() -> None:
+    for text in ['q', '0', '1', 'q + w * e', '(q + w) * e', 'q ** 3 * w ** None', '(q ** 2) ** None + 1', 'q*w+e*r', 'q + w + e * r * t']:
+        got = postfix_to_python(regex_parser.parse(text).postfix)
+        assert ast.unparse(ast.parse(got)) == ast.unparse(ast.parse(text))
+
+
+def test_regex_parser_errors() -> None:
+    for text, position in [('q +', 3), ('q w', 2), ('(q', 0), ('q)', 1), ('q ** w', 5), ('q ** 2 ** 3', 7), ('2', 0), ('q $ w', 2), ('', 0)]:
+        with pytest.raises(regex_parser.RegexSyntaxError) as e:
+            regex_parser.parse(text)
+        assert e.value.position == position
+
+
+def test_regex_parser_large() -> None:
+    k = 100000
+    assert len(regex_parser.parse('(' * k + 'q' + ')' * k).postfix) == 1
+    postfix = regex_parser.parse(' + '.join(['q * w'] * k)).postfix
+    assert len(postfix) == 4 * k - 1 and postfix[-1] == ('+', None)
+
+
+def test_thompson(arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 5, labels)
+    a = regex_parser.parse(r.regex_for_converting_to_fa)
+    expected = convert.postfix_to_fa(a.postfix)
+    p = packed.thompson(a)
+    got = packed.packed_to_fa(p)
+    assert p.state_count == packed.thompson_sizes(a.postfix)[0]
+    assert len([*got.start.bfs()]) == len([*expected.start.bfs()])
+    for t in ['', 'q', 'qw', 'wq', 'qqe', 'eqw', 'qweq', 'wwwe']:
+        assert can_fa_eval_string(got, t, 1 << 20) == can_fa_eval_string(expected, t, 1 << 20)
+
+
+test_thompson = pytest.mark.parametrize('arg', range(20))(test_thompson)
+
+
+def test_thompson_repeated_terms(arg: int) -> None:
+    labels = 'qwe'
+    term = random_fa(rand, 3, labels).regex_for_converting_to_fa
+    regex = f'({term}) * ({term}) ** 2 + (({term}) + q) ** None * (({term}) + q)'
+    a = regex_parser.parse(regex)
+    expected = convert.postfix_to_fa(a.postfix)
+    got = packed.packed_to_fa(packed.thompson(a))
+    assert len([*got.start.bfs()]) == len([*expected.start.bfs()])
+    for t in ['', 'q', 'qw', 'wq', 'qqe', 'eqw', 'qweq', 'wwwe', 'qqqqqq']:
+        assert can_fa_eval_string(got, t, 1 << 20) == can_fa_eval_string(expected, t, 1 << 20)
+
+
+test_thompson_repeated_terms = pytest.mark.parametrize('arg', range(20))(test_thompson_repeated_terms)
+
+
+def test_thompson_deep() -> None:
+    k = 100000
+    p = packed.thompson(convert.regex_to_ast('(' * k + 'q' + ' * w)' * k + ' ** 2'))
+    assert p.state_count == 4 * k + 6
+    dfa = packed.remove_eps(p)
+    assert dfa.state_count == 2 * k + 3
+    table = dfa.table()
+    width = len(dfa.labels)
+
+    def accepts(t: str) -> bool:
+        state = 0
+        for c in t:
+            state = table[state * width + dfa.labels.index(c)]
+            if state == -1:
+                return False
+        return dfa.is_final(state)
+
+    expected = ('q' + 'w' * k) * 2
+    for t in ['', 'q', 'q' + 'w' * k, expected, expected + 'w', expected[1:]]:
+        assert accepts(t) == (t == expected)
+
+
+def run_main(argv: list[str], text_in: str) -> tuple[int, str, str]:
+    stdin = io.StringIO(text_in)
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    rc = command.main(argv, stdin, stdout, stderr)
+    return rc, stdout.getvalue(), stderr.getvalue()
+
+
+def test_chained_operations_match_separate_runs(arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 4, labels)
+    rc, dfa, err = run_main(
+        ['command.py', '--letters', labels, '--operations', 're-to-eps-nfa', 'remove-eps', 'make-deterministic'],
+        r.regex_for_converting_to_fa,
+    )
+    assert rc == 0 and err == ''
+    chain = ['make-full', 'minimize', 'invert', 'minimize', 'invert']
+    text = dfa
+    for operation in chain:
+        rc, text, err = run_main(['command.py', '--letters', labels, '--operations', operation], text)
+        assert rc == 0 and err == ''
+    assert run_main(['command.py', '--letters', labels, '--operations', *chain], dfa) == (0, text, '')
+
+test_chained_operations_match_separate_runs = pytest.mark.parametrize('arg', range(20))(test_chained_operations_match_separate_runs)
+
+
+def test_analyze(arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 5, labels)
+    eps_nfa = convert.ast_to_eps_nfa(convert.regex_to_ast(r.regex_for_converting_to_fa))
+    nfa = convert.remove_eps(eps_nfa)
+    dfa = convert.make_deterministic(nfa)
+    full_dfa = convert.make_full(dfa, labels)
+    for a in [r.fa, eps_nfa, nfa, dfa, full_dfa, convert.make_min(full_dfa)]:
+        for letters in ['', labels, labels + 'r']:
+            assert validate.analyze(a, letters) == validate.fa_properties(
+                has_eps=validate.fa_has_eps(a),
+                is_det=validate.fa_is_det(a),
+                is_full=validate.fa_is_full(a, letters),
+            )
+
+    value = command.fa_or_re.from_private_fa(full_dfa, labels)
+    assert value.properties is value.properties
+    assert command.IsFull()(value)
+
+test_analyze = pytest.mark.parametrize('arg', range(20))(test_analyze)
+
+
+def test_matcher(arg: int) -> None:
+    pytest.importorskip('numpy')
+    import matcher
+
+    labels = 'qwe'
+    r = random_fa(rand, 5, labels)
+    nfa = convert.remove_eps(convert.ast_to_eps_nfa(convert.regex_to_ast(r.regex_for_converting_to_fa)))
+    dfa = convert.make_deterministic(nfa)
+    min_full_dfa = convert.make_min(convert.make_full(dfa, labels))
+    strings = [t for t in r.random_strings_that_maybe_match + [r.random_string_that_matches] if t is not None]
+    strings += ['', 'r', 'qr', 'qwe' * 5, 'ё']
+    for a in [dfa, min_full_dfa]:
+        res = matcher.compile_dfa(a).match(strings)
+        assert res.tolist() == [can_fa_eval_string(a, t, 1 << 16) for t in strings]
+    assert matcher.compile_dfa(dfa).match([]).tolist() == []
+
+test_matcher = pytest.mark.parametrize('arg', range(20))(test_matcher)
+
+
+def test_match_chunks() -> None:
+    pytest.importorskip('numpy')
+    import matcher
+
+    compiled = matcher.compile_dfa(convert.make_deterministic(convert.remove_eps(convert.ast_to_eps_nfa(convert.regex_to_ast('(q+w)**None*q')))))
+    chunks: list[list[str]] = []
+
+    class recording:
+        def match(self, strings: list[str]) -> typing.Any:
+            chunks.append(strings)
+            return compiled.match(strings)
+
+    lines = ['qw\n'] * 9 + ['w' * 25 + 'q\n', 'q\n', 'q']
+    res = list(command.match_chunks(recording(), lines, 4, max_chars=10))
+    assert res == [(line.rstrip('\n'), line.rstrip('\n').endswith('q')) for line in lines]
+    assert [len(chunk) for chunk in chunks] == [4, 4, 1, 1, 2]
+
+
+def test_matcher_ragged() -> None:
+    pytest.importorskip('numpy')
+    import matcher
+
+    compiled = matcher.compile_dfa(convert.make_deterministic(convert.remove_eps(convert.ast_to_eps_nfa(convert.regex_to_ast('(q+w)**None*q')))))
+    strings = ['qw'] * 1000 + ['w' * 100000 + 'q', '', 'q', 'w' * 100000, 'wq' * 10]
+    steps, step_offsets, order = compiled.encode(strings)
+    assert len(steps) == step_offsets[-1] == sum(map(len, strings))
+    assert compiled.match(strings).tolist() == [False] * 1000 + [True, False, True, False, True]
+
+
+def test_lazy_dfa(arg: int) -> None:
+    labels = 'qwe'
+    r = random_fa(rand, 4, labels)
+    p = command.nfa_value(command.fa_or_re(r.regex_for_converting_to_fa))
+    p_dfa = packed.make_deterministic(p)
+    strings = [''.join(rand.choice(labels + 'x') for i in range(rand.randint(0, 12))) for j in range(300)]
+    expected = [accepted for line, accepted in command.match_lines(p_dfa, strings)]
+
+    for max_states in [2, 3, 5, 1 << 14]:
+        matcher = lazy_dfa.lazy_dfa(p, max_states)
+        assert [matcher.match(s) for s in strings] == expected
+        assert len(matcher.subsets) <= max(max_states, 2) + 1
+        assert len(set(matcher.subsets)) == len(matcher.subsets)
+    assert [lazy_dfa.lazy_dfa(p).match_nfa((0,), s) for s in strings] == expected
+
+
+test_lazy_dfa = pytest.mark.parametrize('arg', range(30))(test_lazy_dfa)
+
+
+def test_lazy_dfa_fallback() -> None:
+    p = command.nfa_value(command.fa_or_re('(q+w)**None*q*(q+w)**8'))
+    matcher = lazy_dfa.lazy_dfa(p, 16)
+    assert matcher.match('q' + 'w' * 8) and not matcher.match('w' * 9)
+    text = ''.join(rand.choice('qw') for i in range(300))
+    assert matcher.match(text + 'q' + 'w' * 8)
+    assert matcher.uses_nfa and matcher.flush_count > 1
+    assert matcher.match('q' + 'qw' * 4) and not matcher.match('w' * 30)
+    # short strings need few subsets, the cache is used again for them
+    for i in range(20):
+        assert matcher.match('qwwwwwwww') and not matcher.match('wq')
+    assert not matcher.uses_nfa
+    assert all(matcher.match('qwwwwwwww') for i in range(100)) and not matcher.uses_nfa
+
+
+def test_match_mode(tmp_path: typing.Any, monkeypatch: typing.Any) -> None:
+    lines = tmp_path / 'lines.txt'
+    lines.write_text('q\nqw\nwq\n\nqqqq\nx\nab\n')
+    regex = tmp_path / 're.txt'
+    regex.write_text('(q+w)**None*q+ab')
+
+    for numpy_is_available, lazy in [(True, []), (False, []), (False, ['--lazy'])]:
+        if not numpy_is_available:
+            monkeypatch.setitem(sys.modules, 'matcher', None)
+
+        assert run_main(
+            ['command.py', '--letters', 'qw', '--operations', '--match', str(lines), *lazy],
+            '(q+w)**None*q',
+        ) == (0, 'accept\nreject\naccept\nreject\naccept\nreject\nreject\n', '')
+
+        assert run_main(
+            ['command.py', '--letters', 'qwab', '--operations', 're-to-eps-nfa', 'remove-eps',
+                '--input', str(regex), '--match', '-', '--only-matching', *lazy],
+            lines.read_text(),
+        ) == (0, 'q\nwq\nqqqq\n', '')
+
+        assert run_main(
+            ['command.py', '--letters', '[a-z0-9]', '--operations', 're-to-eps-nfa', 'remove-eps',
+                '--match', str(lines), '--only-matching', *lazy],
+            '[a-z]**None*[p-r]*[0-9]**None',
+        ) == (0, 'q\nwq\nqqqq\n', '')
+
+    assert run_main(
+        ['command.py', '--letters', 'qw', '--operations', '--match', '-'],
+        'q',
+    ) == (1, '', '--match - reads lines from stdin, so --input is required.\n')
+
+
+def test_serve() -> None:
+    requests = [
+        {'id': 1, 'operations': ['re-to-eps-nfa', 'remove-eps', 'make-deterministic'], 'letters': 'qw', 'input': '(q+w)**None*q'},
+        {'operations': ['make-full', 'minimize'], 'letters': 'qw', 'input': json.loads(run_main(
+            ['command.py', '--letters', 'qw', '--operations', 're-to-eps-nfa', 'remove-eps', 'make-deterministic'], 'q*w')[1])},
+        {'id': 'bad chain', 'operations': ['minimize', 'remove-eps'], 'letters': 'qw', 'input': 'q'},
+        {'id': 'bad input', 'operations': ['minimize'], 'letters': 'qw', 'input': 'q'},
+        {'id': 'bad letters', 'operations': ['re-to-eps-nfa', 'remove-eps'], 'letters': 'q', 'input': 'q*w'},
+        {'id': 'bad operation', 'operations': ['nope'], 'letters': 'q', 'input': 'q'},
+    ]
+    lines = [json.dumps(request) for request in requests] + ['', 'not json', '[]']
+    rc, out, err = run_main(['command.py', '--serve'], '\n'.join(lines) + '\n')
+    assert rc == 0 and err == ''
+    responses = [json.loads(line) for line in out.splitlines()]
+    assert len(responses) == len(requests) + 2
+
+    for request, response in zip(requests, responses):
+        text = request['input'] if isinstance(request['input'], str) else json.dumps(request['input'])
+        expected = run_main(['command.py', '--letters', request['letters'], '--operations', *request['operations']], text)
+        if request.get('id') == 'bad operation':
+            expected = (1, '', "ValueError(\"unknown operation 'nope'\")\n")
+        assert response == {'id': request.get('id'), 'code': expected[0], 'output': expected[1], 'error': expected[2]}
+
+    assert [response['code'] for response in responses[len(requests):]] == [1, 1]
+    assert run_main(['command.py', '--letters', 'q', '--operations', '--serve'], '') == (1, '', '--serve must be the first argument.\n')
+    assert run_main(['command.py', '--serve', '--letters', 'q'], '')[0] == 1
+
+
+def test_answer_cache() -> None:
+    answers = cache.answer_cache(max_count=3, max_chars=10)
+    keys = [answers.key(['minimize'], 'q', 'q' * i, None) for i in range(5)]
+    assert len(set(keys)) == 5 and keys[0] == answers.key(['minimize'], 'q', '', None)
+    for key in keys[:3]:
+        answers.store(key, (0, 'qq', ''))
+    assert answers.load(keys[0]) == (0, 'qq', '')
+    answers.store(keys[3], (0, 'qq', ''))
+    assert answers.load(keys[1]) is None and len(answers.answers) == 3
+    answers.store(keys[4], (1, '', 'e' * 8))
+    assert answers.load(keys[4]) == (1, '', 'e' * 8) and answers.chars <= 10 and len(answers.answers) == 2
+    answers.store(keys[1], (0, 'q' * 11, ''))
+    assert answers.load(keys[1]) is None and answers.chars <= 10
+
+
+def test_batch(tmp_path: typing.Any) -> None:
+    regexes = ['q*w', '(q+w)**None*q', 'q+', 'w**3']
+    lines = tmp_path / 'regexes.txt'
+    lines.write_text('\n'.join(regexes[:2]) + '\n\n' + '\n'.join(regexes[2:]) + '\n')
+    directory = tmp_path / 'inputs'
+    directory.mkdir()
+    for number, regex in enumerate(regexes):
+        (directory / f'{number}.txt').write_text(regex)
+
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic']
+    expected = [run_main(['command.py', '--letters', 'qw', '--operations', *operations], regex) for regex in regexes if regex != 'q+']
+    expected.insert(2, (1, '', f'{regex_parser.RegexSyntaxError("unexpected end", "q+", 2)!r}\n'))
+    inputs: list[tuple[typing.Any, list[typing.Any]]] = [(lines, [1, 2, 4, 5]), (directory, [f'{number}.txt' for number in range(len(regexes))])]
+    for path, ids in inputs:
+        rc, out, err = run_main(['command.py', '--letters', 'qw', '--operations', *operations, '--batch', str(path), '--jobs', '2'], '')
+        assert rc == 0 and err == ''
+        assert [json.loads(line) for line in out.splitlines()] == [
+            {'id': item_id, 'code': code, 'output': output, 'error': error}
+            for item_id, (code, output, error) in zip(ids, expected)
+        ]
+
+    # the first input takes minutes, the second milliseconds
+    lines.write_text('(q+w)**None*q*(q+w)**18\nq\n')
+    rc, out, err = run_main(['command.py', '--letters', 'qw', '--operations', *operations, 'make-full', 'minimize',
+                             '--batch', str(lines), '--timeout', '2'], '')
+    slow, fast = [json.loads(line) for line in out.splitlines()]
+    assert slow['code'] == 1 and slow['error'].startswith('TimeoutError') and fast['code'] == 0
+
+    assert run_main(['command.py', '--letters', 'qw', '--operations', '--batch', str(lines), '--match', str(lines)], '') == (
+        1, '', '--batch can not be used with --input or --match.\n')
+
+
+def test_batch_dead_worker(monkeypatch: typing.Any) -> None:
+    run_request = command.run_request
+
+    def dying_run_request(operation_names: tuple[str, ...], letters: str, text: str, *args: typing.Any) -> tuple[int, str, str]:
+        if text == 'die':
+            os._exit(1)
+        return run_request(operation_names, letters, text, *args)
+
+    # workers are forked and see the patched function
+    monkeypatch.setattr(command, 'run_request', dying_run_request)
+    texts = ['q' * (i % 5 + 1) for i in range(40)]
+    texts[7] = texts[25] = 'die'
+    items: list[tuple[str | int, str | Exception]] = list(enumerate(texts))
+    for chunk_size in [1, 3]:
+        responses = list(command.run_batch(items, ('re-to-eps-nfa',), 'q', 2, None, chunk_size=chunk_size))
+        assert [response['id'] for response in responses] == list(range(40))
+        for text, response in zip(texts, responses):
+            if text == 'die':
+                assert response['code'] == 1 and response['error'].startswith('BrokenProcessPool')
+            else:
+                assert response['code'] == 0 and response['error'] == ''
+
+
+def test_cache(tmp_path: typing.Any, monkeypatch: typing.Any) -> None:
+    directory = tmp_path / 'cache'
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'minimize']
+    regex = '(q+w)**None * q * (q+w)'
+    expected = run_main(['command.py', '--letters', 'qw', '--operations', *operations], regex)
+
+    def cached_files() -> list[str]:
+        return sorted(path.name for path in directory.glob('*/*'))
+
+    assert run_main(['command.py', '--letters', 'qw', '--operations', *operations[:3], '--cache', str(directory)], regex) == \
+        run_main(['command.py', '--letters', 'qw', '--operations', *operations[:3]], regex)
+    assert len(cached_files()) == 3
+
+    # the chain resumes after make-deterministic, so earlier operations are not called
+    calls = []
+
+    def counted(name: str, function: typing.Callable[..., typing.Any], *args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        calls.append(name)
+        return function(*args, **kwargs)
+
+    for name in ['re_to_eps_nfa', 'remove_eps', 'make_deterministic', 'make_full', 'minimize']:
+        monkeypatch.setattr(command, name, functools.partial(counted, name, getattr(command, name)))
+    assert run_main(['command.py', '--letters', 'qw', '--operations', *operations, '--cache', str(directory)], ' ( q + w ) ** None*q*(q+w)') == expected
+    assert calls == ['make_full', 'minimize'] and len(cached_files()) == 5
+    calls.clear()
+    assert run_main(['command.py', '--letters', 'qw', '--operations', *operations, '--cache', str(directory)], regex) == expected
+    assert calls == []
+
+    files = cached_files()
+    rc, out, err = run_main(['command.py', '--letters', 'qw', '--operations', *operations, '--cache', str(directory), '--cache-size', '2000'], 'q*w*q')
+    assert rc == 0 and sum(path.stat().st_size for path in directory.glob('*/*')) <= 2000
+    assert len(set(files) - set(cached_files())) > 0
+
+    # flags that change the output are part of the key
+    flagged = directory / 'flagged'
+    args = ['command.py', '--letters', 'qwe', '--operations', 're-to-eps-nfa', 'remove-eps']
+    for flags in [['--letter-classes'], []]:
+        expected = run_main([*args, *flags], '(w+q)*e**None')
+        assert run_main([*args, '--cache', str(flagged), *flags], '(w+q)*e**None') == expected
+    assert expected != run_main([*args, '--letter-classes'], '(w+q)*e**None')
+    operations = ['re-to-eps-nfa', 'remove-eps', 'make-deterministic', 'make-full', 'invert']
+    for flags in [['--implicit-sink'], []]:
+        expected = run_main([*args[:4], *operations, *flags], 'q*w')
+        assert run_main([*args[:4], *operations, '--cache', str(flagged), *flags], 'q*w') == expected
+    assert expected != run_main([*args[:4], *operations, '--implicit-sink'], 'q*w')
+
+    # whitespace inside names and sets is part of the regex
+    args = ['command.py', '--letters', 'qwb ', '--operations', 're-to-eps-nfa', '--cache', str(directory)]
+    assert run_main(args, 'qw')[0] == 0
+    with pytest.raises(regex_parser.RegexSyntaxError):
+        run_main(args, 'q w')
+    assert run_main(args, '[b]') == run_main(args[:-2], '[b]')
+    assert run_main(args, '[ b]') == run_main(args[:-2], '[ b]') != run_main(args, '[b]')
+
+
+def test_compare_mode(tmp_path: typing.Any) -> None:
+    other = tmp_path / 'other'
+    other.write_text('q*(q+w)**None')
+    args = ['command.py', '--letters', 'qw', '--operations', '--other', str(other), '--compare']
+    assert run_main([*args, 'equivalence'], 'q * (q+w)**None * (w+1)') == (0, 'equivalent\n', '')
+    assert run_main([*args, 'equivalence'], '(q+w)**None*q') == (0, 'counterexample: "qw"\n', '')
+    assert run_main([*args, 'inclusion'], 'q*q*w') == (0, 'included\n', '')
+    assert run_main([*args, 'inclusion'], '(q+w)**None') == (0, 'counterexample: ""\n', '')
+    assert run_main(['command.py', '--letters', 'qw', '--operations', '--compare', 'inclusion'], 'q')[0] == 1
+
+
+def test_product_mode(tmp_path: typing.Any) -> None:
+    other = tmp_path / 'other'
+    other.write_text('q*(q+w)**None')
+    args = ['command.py', '--letters', 'qw', '--other', str(other), '--operations']
+    rc, out, err = run_main([*args, 'intersect'], '(q+w)**None*w')
+    (tmp_path / 'intersection').write_text(out)
+    assert run_main(['command.py', '--letters', 'qw', '--other', str(tmp_path / 'intersection'), '--compare', 'equivalence', '--operations'], 'q*(q+w)**None*w') == \
+        (0, 'equivalent\n', '')
+    assert run_main([*args, 'union', 'eps-nfa-to-re'], 'w') == (0, 'q+w+q*q*(q)**None+(q*w+q*q*(q)**None*w)*(w+q*(q)**None*w)**None*(1+q*(q)**None)\n', '')
+    rc, out, err = run_main([*args, 'difference'], '(q+w)**None*w')
+    assert rc == 0 and json.loads(out)['start_states'] == ['1']
+    assert run_main(['command.py', '--letters', 'qw', '--operations', 'union'], 'w') == (1, '', 'union needs --other.\n')
+
+    response = command.serve_request(json.dumps({'operations': ['intersect', 'eps-nfa-to-re'], 'letters': 'qw', 'input': 'q*w', 'other': '(q+w)**None*w'}))
+    assert response['code'] == 0 and response['output'] == 'q*w\n'
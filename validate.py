@@ -1,10 +1,12 @@
 import typing
 import ast
+from dataclasses import dataclass
 from copy import deepcopy as cp
 from collections import defaultdict as dd
 from utils import *
 
 import fa
+import charset
 
 
 def fa_has_eps(a: fa.FA) -> bool:
@@ -33,6 +35,69 @@ def fa_is_full(a: fa.FA, labels: str) -> bool:
         return False
     for node in a.start.bfs():
         for label in labels:
-            if not node.next_nodes_by_label[label]:
+            if not node.next_nodes_by_label.get(label):
                 return False
     return True
+
+
+def letter_ranges(labels: typing.Iterable[str]) -> charset.Ranges:
+    '''
+        All chars of labels, names are skipped.
+    '''
+    res: charset.Ranges = ()
+    for label in labels:
+        res = charset.union(res, charset.parse(label) or ())
+    return res
+
+
+@dataclass(frozen=True)
+class fa_properties:
+    has_eps: bool
+    is_det: bool
+    is_full: bool
+
+
+def analyze(a: fa.FA, labels: str) -> fa_properties:
+    '''
+        Same as fa_has_eps, fa_is_det and fa_is_full, but in one traversal.
+
+        Sets of chars in labels and on edges are compared by their chars.
+    '''
+    letters = charset.letters_to_labels(labels)
+    alphabet = None
+    if charset.has_sets(letters):
+        alphabet = letter_ranges(letters)
+
+    has_eps = False
+    has_many_next_nodes = False
+    has_missing_labels = False
+    for node in a.start.bfs():
+        next_nodes_by_label = node.next_nodes_by_label
+        if next_nodes_by_label.get(''):
+            has_eps = True
+        for next_nodes in next_nodes_by_label.values():
+            if len(next_nodes) > 1:
+                has_many_next_nodes = True
+        if alphabet is None and not charset.has_sets(next_nodes_by_label):
+            for label in labels:
+                if not next_nodes_by_label.get(label):
+                    has_missing_labels = True
+            continue
+
+        present = [label for label, next_nodes in next_nodes_by_label.items() if next_nodes and label]
+        covered, has_overlaps = letter_ranges(present), False
+        all_ranges = sorted(ranges for label in present for ranges in charset.parse(label) or ())
+        for (low, high), (next_low, next_high) in zip(all_ranges, all_ranges[1:]):
+            if next_low <= high:
+                has_overlaps = True
+        has_many_next_nodes |= has_overlaps
+        if charset.difference(alphabet or letter_ranges(letters), covered):
+            has_missing_labels = True
+        if any(charset.parse(letter) is None and letter not in present for letter in letters):
+            has_missing_labels = True
+    is_det = not has_eps and not has_many_next_nodes
+    return fa_properties(
+        has_eps=has_eps,
+        is_det=is_det,
+        is_full=is_det and not has_missing_labels,
+    )